@@ -0,0 +1,72 @@
+"""
+Set de preguntas contra un chatbot, para revisar su cobertura
+
+Lee un JSONL (una pregunta por línea: {"id": ..., "question": ...} o un
+string) y escribe NDJSON con la respuesta, las fuentes, la decisión de la
+política y los tiempos de cada pregunta, más una línea final de resumen. Es el
+mismo proceso que POST /api/chat/chatbots/{id}/batch, sin pasar por HTTP.
+
+Uso:
+    python batch_qa.py --chatbot-id 3 preguntas.jsonl
+    python batch_qa.py --chatbot-id 3 preguntas.jsonl --output respuestas.ndjson
+"""
+
+import sys
+import os
+import json
+import asyncio
+import argparse
+import logging
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+
+async def main(chatbot_id: int, input_path: str, output) -> int:
+    from database import SessionLocal
+    from models import CustomChatbot
+    from routes.batch_qa import answer_batch, parse_questions
+
+    with open(input_path, encoding="utf-8-sig") as f:
+        questions = parse_questions(f)
+    if not questions:
+        logger.error(f"{input_path} no contiene preguntas")
+        return 1
+
+    db = SessionLocal()
+    errors = 0
+    try:
+        chatbot = db.query(CustomChatbot).filter(CustomChatbot.id == chatbot_id).first()
+        if not chatbot:
+            logger.error(f"Chatbot {chatbot_id} no encontrado")
+            return 1
+
+        logger.info(f"Respondiendo {len(questions)} preguntas con el chatbot {chatbot_id}")
+        async for result in answer_batch(db, chatbot, questions):
+            errors += "error" in result
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+    finally:
+        db.close()
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Responde un set de preguntas (JSONL) contra un chatbot")
+    parser.add_argument("questions", help="Archivo JSONL con las preguntas")
+    parser.add_argument("--chatbot-id", type=int, required=True, help="Chatbot a evaluar")
+    parser.add_argument("--output", help="Archivo NDJSON de salida (por defecto, la salida estándar)")
+    args = parser.parse_args()
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        errors = asyncio.run(main(args.chatbot_id, args.questions, output))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,88 @@
+"""
+Calibración offline de top_k y umbral de score por chatbot
+
+Mide la distribución de scores del namespace de cada chatbot y guarda los
+parámetros en chatbot_settings. Se omiten los chatbots con valores fijados a
+mano, salvo con --include-manual. Sin --allow-stricter, el umbral no sube
+sobre RAG_MIN_SCORE ni top_k baja de TOP_K_RESULTS.
+
+Uso:
+    python calibrate_retrieval.py                 # todos los chatbots
+    python calibrate_retrieval.py --chatbot-id 3  # uno (repetible)
+    python calibrate_retrieval.py --dry-run       # solo mostrar resultados
+"""
+
+import sys
+import os
+import json
+import asyncio
+import argparse
+import logging
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def chatbots_to_calibrate(db, chatbot_ids, include_manual: bool):
+    from models import ChatbotDocument, ChatbotSettings, CustomChatbot
+
+    query = db.query(CustomChatbot.id).filter(
+        CustomChatbot.is_active == True,
+        db.query(ChatbotDocument.id).filter(
+            ChatbotDocument.chatbot_id == CustomChatbot.id,
+            ChatbotDocument.is_processed == True
+        ).exists()
+    )
+    if chatbot_ids:
+        query = query.filter(CustomChatbot.id.in_(chatbot_ids))
+    if not include_manual:
+        # Valores fijados a mano: top_k o min_score sin fecha de calibración
+        manual = db.query(ChatbotSettings.chatbot_id).filter(
+            ChatbotSettings.calibrated_at == None,
+            (ChatbotSettings.top_k != None) | (ChatbotSettings.min_score != None)
+        )
+        query = query.filter(CustomChatbot.id.notin_(manual))
+
+    return [chatbot_id for (chatbot_id,) in query.order_by(CustomChatbot.id.asc()).all()]
+
+
+async def main(chatbot_ids, dry_run: bool, include_manual: bool, allow_stricter: bool) -> int:
+    from database import SessionLocal
+    from services.retrieval_calibration import retrieval_calibrator
+
+    db = SessionLocal()
+    failures = 0
+    try:
+        for chatbot_id in chatbots_to_calibrate(db, chatbot_ids, include_manual):
+            try:
+                result = await retrieval_calibrator.calibrate(
+                    db, chatbot_id, apply=not dry_run, allow_stricter=allow_stricter
+                )
+                print(json.dumps(result.to_dict(), ensure_ascii=False))
+            except Exception as e:
+                db.rollback()
+                failures += 1
+                logger.error(f"Error calibrando chatbot {chatbot_id}: {str(e)}")
+    finally:
+        db.close()
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibración de top_k y umbral de score por chatbot")
+    parser.add_argument("--chatbot-id", type=int, action="append", help="Chatbot a calibrar (repetible)")
+    parser.add_argument("--dry-run", action="store_true", help="Medir sin guardar los parámetros")
+    parser.add_argument("--include-manual", action="store_true", help="Recalibrar también los valores fijados a mano")
+    parser.add_argument(
+        "--allow-stricter", action="store_true",
+        help="Permitir un umbral sobre RAG_MIN_SCORE y un top_k bajo TOP_K_RESULTS"
+    )
+    args = parser.parse_args()
+
+    failures = asyncio.run(main(args.chatbot_id, args.dry_run, args.include_manual, args.allow_stricter))
+    sys.exit(1 if failures else 0)
@@ -170,7 +170,7 @@ async def main():
                                 index_name=sample_chatbot.pinecone_index_name,
                                 query_vector=query_embedding,
                                 top_k=3,
-                                namespace=f"chatbot_{sample_chatbot.id}"
+                                namespace=sample_chatbot.active_namespace
                             )
                             
                             print(f"✅ Búsqueda ejecutada")
@@ -84,10 +84,43 @@ Base.metadata.create_all(bind=engine)
 from routes.chatbots import router as chatbots_router
 from routes.documents import router as documents_router  
 from routes.chat_rag import router as chat_rag_router
+from routes.batch_qa import router as batch_qa_router
 
 app.include_router(chatbots_router)
 app.include_router(documents_router)
 app.include_router(chat_rag_router)
+app.include_router(batch_qa_router)
+
+# --------------- Worker de ingesta embebido ------------------
+# En despliegues con un solo servicio, la API consume también la cola de ingesta.
+# Con workers dedicados (python worker.py) configurar EMBEDDED_INGESTION_WORKER=false.
+
+_ingestion_worker_stop = None
+_ingestion_worker_task = None
+
+@app.on_event("startup")
+async def start_embedded_ingestion_worker():
+    global _ingestion_worker_stop, _ingestion_worker_task
+    if os.getenv("EMBEDDED_INGESTION_WORKER", "true").lower() != "true":
+        return
+    import asyncio
+    import socket
+    from services.ingestion import run_worker_loop
+    
+    _ingestion_worker_stop = asyncio.Event()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:api"
+    _ingestion_worker_task = asyncio.create_task(run_worker_loop(worker_id, _ingestion_worker_stop))
+
+@app.on_event("shutdown")
+async def stop_embedded_ingestion_worker():
+    if _ingestion_worker_stop is not None:
+        _ingestion_worker_stop.set()
+        await _ingestion_worker_task
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    from services.groq_service import groq_service
+    await groq_service.aclose()
 
 # --------------- Schemas Pydantic ------------------
 
@@ -155,6 +188,24 @@ async def ai_health():
             "timestamp": datetime.utcnow().isoformat()
         }
 
+@app.get("/metrics/")
+async def get_metrics():
+    """Métricas del proceso: límites de APIs externas, cuota disponible, caché de respuestas, búsquedas adelantadas y router de LLM"""
+    from services.metrics import metrics
+    from services.rate_limiter import rate_limiters
+    from services.answer_cache import answer_cache
+    from services.llm_router import llm_router
+    from services.retrieval_prefetch import retrieval_prefetch
+    
+    return {
+        **metrics.snapshot(),
+        "rate_limiters": {name: limiter.state() for name, limiter in rate_limiters.items()},
+        "answer_cache": answer_cache.stats(),
+        "retrieval_prefetch": retrieval_prefetch.stats(),
+        "llm_router": llm_router.state(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
 @app.get("/chatbot_info/")
 async def chatbot_info():
     """Información sobre el estado del chatbot"""
@@ -0,0 +1,109 @@
+"""
+Migración de columnas nuevas en tablas existentes
+
+create_all() crea las tablas nuevas pero no agrega columnas a las que ya
+existen. Este script agrega las columnas faltantes y puede ejecutarse varias
+veces sin efecto adicional.
+
+Uso:
+    python migrate_schema.py
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+import logging
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (tabla, columna, definición SQL)
+COLUMNS = [
+    # Checkpoints de procesamiento de documentos
+    ("document_processing", "checkpoint_chunks", "INTEGER NOT NULL DEFAULT 0"),
+    ("document_processing", "checkpoint_signature", "VARCHAR"),
+    ("document_processing", "checkpoint_at", "TIMESTAMP WITH TIME ZONE"),
+    # Puntero al índice/namespace activo y re-index blue/green
+    ("custom_chatbots", "pinecone_namespace", "VARCHAR"),
+    ("custom_chatbots", "embedding_model", "VARCHAR"),
+    ("custom_chatbots", "embedding_dimension", "INTEGER"),
+    ("custom_chatbots", "shadow_index_name", "VARCHAR"),
+    ("custom_chatbots", "shadow_namespace", "VARCHAR"),
+    # Resumen acumulado y título automático de conversaciones
+    ("conversations", "summary", "TEXT"),
+    ("conversations", "summary_message_id", "INTEGER"),
+    ("conversations", "title_status", "VARCHAR"),
+    # Parámetros de búsqueda por chatbot y su calibración
+    ("chatbot_settings", "top_k", "INTEGER"),
+    ("chatbot_settings", "min_score", "DOUBLE PRECISION"),
+    ("chatbot_settings", "calibrated_at", "TIMESTAMP WITH TIME ZONE"),
+    ("chatbot_settings", "calibration_stats", "TEXT"),
+]
+
+
+def column_exists(conn, table: str, column: str) -> bool:
+    result = conn.execute(text("""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_name = :table
+        AND column_name = :column
+    """), {"table": table, "column": column})
+    return result.fetchone() is not None
+
+
+def table_exists(conn, table: str) -> bool:
+    result = conn.execute(text("""
+        SELECT table_name
+        FROM information_schema.tables
+        WHERE table_name = :table
+    """), {"table": table})
+    return result.fetchone() is not None
+
+
+def migrate_schema():
+    """Agrega las columnas de COLUMNS que aún no existen"""
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        logger.error("DATABASE_URL no encontrada en las variables de entorno")
+        return False
+
+    try:
+        engine = create_engine(database_url)
+
+        with engine.connect() as conn:
+            for table, column, definition in COLUMNS:
+                if not table_exists(conn, table):
+                    # La tabla completa la crea create_all() al iniciar la API
+                    logger.info(f"⏭️  La tabla {table} no existe aún, se omite {column}")
+                    continue
+
+                if column_exists(conn, table, column):
+                    logger.info(f"✅ {table}.{column} ya existe")
+                    continue
+
+                logger.info(f"🔧 Agregando {table}.{column}...")
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                conn.commit()
+                logger.info(f"✅ {table}.{column} agregada")
+
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ Error durante la migración: {str(e)}")
+        return False
+
+
+if __name__ == "__main__":
+    print("🚀 Iniciando migración de base de datos...")
+    success = migrate_schema()
+    if success:
+        print("✅ Migración completada exitosamente")
+    else:
+        print("❌ Error en la migración")
+        sys.exit(1)
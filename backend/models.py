@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Boolean, Enum, BigInteger
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Boolean, Enum, BigInteger, Index, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -13,6 +13,13 @@ class AccessLevel(enum.Enum):
     ADMIN = "admin"
 
 
+class JobStatus(enum.Enum):
+    PENDING = "pending"      # Esperando ser tomado (o reintento programado)
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    DEAD = "dead"            # Agotó los reintentos (dead-letter)
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -40,6 +47,14 @@ class CustomChatbot(Base):
     description = Column(Text, nullable=True)
     created_by = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     pinecone_index_name = Column(String, nullable=False, unique=True)
+    # Namespace activo en el índice (None = "chatbot_{id}", esquema original)
+    pinecone_namespace = Column(String, nullable=True)
+    # Modelo y dimensión con que se generaron los vectores activos (None = anteriores al registro)
+    embedding_model = Column(String, nullable=True)
+    embedding_dimension = Column(Integer, nullable=True)
+    # Destino en construcción durante un re-index; recibe también las escrituras nuevas
+    shadow_index_name = Column(String, nullable=True)
+    shadow_namespace = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -49,6 +64,20 @@ class CustomChatbot(Base):
     documents = relationship("ChatbotDocument", back_populates="chatbot", cascade="all, delete-orphan")
     access_list = relationship("ChatbotAccess", back_populates="chatbot", cascade="all, delete-orphan")
     conversations = relationship("Conversation", back_populates="chatbot")
+    settings = relationship("ChatbotSettings", back_populates="chatbot", uselist=False, cascade="all, delete-orphan")
+    profile = relationship("ChatbotProfile", back_populates="chatbot", uselist=False, cascade="all, delete-orphan")
+
+    @property
+    def active_namespace(self) -> str:
+        """Namespace de Pinecone que se consulta para responder"""
+        return self.pinecone_namespace or f"chatbot_{self.id}"
+
+    def vector_targets(self):
+        """Pares (índice, namespace) donde deben escribirse y borrarse vectores"""
+        targets = [(self.pinecone_index_name, self.active_namespace)]
+        if self.shadow_index_name and self.shadow_namespace:
+            targets.append((self.shadow_index_name, self.shadow_namespace))
+        return targets
 
 
 class ChatbotAccess(Base):
@@ -67,6 +96,61 @@ class ChatbotAccess(Base):
     granter = relationship("User", foreign_keys=[granted_by])
 
 
+class ChatbotSettings(Base):
+    """Política de respuesta de un chatbot (una fila por chatbot, opcional)"""
+    __tablename__ = "chatbot_settings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    chatbot_id = Column(Integer, ForeignKey("custom_chatbots.id", ondelete="CASCADE"), nullable=False, unique=True)
+    # Responder saludos y agradecimientos sin búsqueda ni LLM
+    quick_replies_enabled = Column(Boolean, nullable=False, default=True)
+    # Acción cuando ningún chunk pasa el umbral: 'template' | 'widen' | 'llm'
+    no_hits_action = Column(String, nullable=False, default="template")
+    # Acción cuando el mejor score queda entre widen_min_score y el umbral
+    low_score_action = Column(String, nullable=False, default="widen")
+    widen_min_score = Column(Float, nullable=False, default=0.6)
+    widen_top_k = Column(Integer, nullable=False, default=10)
+    # Respuesta sin contexto (None usa la plantilla por defecto)
+    no_context_template = Column(Text, nullable=True)
+    # Parámetros de búsqueda (None usa TOP_K_RESULTS / RAG_MIN_SCORE)
+    top_k = Column(Integer, nullable=True)
+    min_score = Column(Float, nullable=True)
+    # Última calibración automática de top_k/min_score (None si se fijaron a mano)
+    calibrated_at = Column(DateTime(timezone=True), nullable=True)
+    calibration_stats = Column(Text, nullable=True)  # JSON con la distribución de scores
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    # Relaciones
+    chatbot = relationship("CustomChatbot", back_populates="settings")
+
+    @classmethod
+    def with_defaults(cls, chatbot_id=None) -> "ChatbotSettings":
+        """Configuración sin guardar con los valores por defecto de cada columna"""
+        values = {
+            column.name: column.default.arg
+            for column in cls.__table__.columns
+            if column.default is not None and not callable(column.default.arg)
+        }
+        return cls(chatbot_id=chatbot_id, **values)
+
+
+class ChatbotProfile(Base):
+    """Perfil precalculado del chatbot para el mensaje de bienvenida (ver services/chatbot_profile.py)"""
+    __tablename__ = "chatbot_profiles"
+
+    id = Column(Integer, primary_key=True, index=True)
+    chatbot_id = Column(Integer, ForeignKey("custom_chatbots.id", ondelete="CASCADE"), nullable=False, unique=True)
+    # Huella de los documentos procesados con que se calculó (ver corpus_fingerprint)
+    fingerprint = Column(String, nullable=False)
+    documents = Column(Text, nullable=False, default="[]")  # JSON: nombres de los documentos
+    topics = Column(Text, nullable=False, default="[]")  # JSON: temas principales
+    suggested_questions = Column(Text, nullable=False, default="[]")  # JSON: preguntas sugeridas
+    built_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    # Relaciones
+    chatbot = relationship("CustomChatbot", back_populates="profile")
+
+
 class ChatbotDocument(Base):
     __tablename__ = "chatbot_documents"
 
@@ -86,6 +170,60 @@ class ChatbotDocument(Base):
     # Relaciones
     chatbot = relationship("CustomChatbot", back_populates="documents")
     uploader = relationship("User", foreign_keys=[uploaded_by])
+    processing = relationship("DocumentProcessing", back_populates="document", uselist=False, cascade="all, delete-orphan")
+
+
+class IngestionJob(Base):
+    """Trabajo persistente de ingesta, tomado por los workers con SKIP LOCKED"""
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_type = Column(String, nullable=False)
+    chatbot_id = Column(Integer, ForeignKey("custom_chatbots.id", ondelete="CASCADE"), nullable=False, index=True)
+    document_id = Column(Integer, ForeignKey("chatbot_documents.id", ondelete="CASCADE"), nullable=True, index=True)
+    payload = Column(Text, nullable=True)  # JSON con parámetros adicionales
+    status = Column(Enum(JobStatus), nullable=False, default=JobStatus.PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_ingestion_jobs_status_run_after", "status", "run_after"),
+    )
+
+
+class DocumentProcessing(Base):
+    """Progreso y resultado del último procesamiento de un documento"""
+    __tablename__ = "document_processing"
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("chatbot_documents.id", ondelete="CASCADE"), nullable=False, unique=True)
+    chatbot_id = Column(Integer, ForeignKey("custom_chatbots.id", ondelete="CASCADE"), nullable=False, index=True)
+    # 'pending' | 'processing' | 'retrying' | 'completed' | 'failed'
+    status = Column(String, nullable=False, default="pending")
+    # Etapa actual: 'extract' | 'chunk' | 'embed' | 'upsert'
+    stage = Column(String, nullable=True)
+    chunks_done = Column(Integer, nullable=False, default=0)
+    chunks_total = Column(Integer, nullable=True)
+    stage_timings = Column(Text, nullable=True)  # JSON {etapa: segundos}
+    # Checkpoint: los chunks 1..checkpoint_chunks ya están confirmados en Pinecone
+    checkpoint_chunks = Column(Integer, nullable=False, default=0)
+    # Archivo, extractor y parámetros de chunking/embeddings con que se generó el checkpoint
+    checkpoint_signature = Column(String, nullable=True)
+    checkpoint_at = Column(DateTime(timezone=True), nullable=True)
+    error_message = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    document = relationship("ChatbotDocument", back_populates="processing")
 
 
 class Conversation(Base):
@@ -97,6 +235,11 @@ class Conversation(Base):
     # Nuevo: referencia al chatbot personalizado (opcional, para conversaciones con RAG)
     chatbot_id = Column(Integer, ForeignKey("custom_chatbots.id", ondelete="SET NULL"), nullable=True, index=True)
     title = Column(String, nullable=False, default="Nueva conversación")
+    # Resumen acumulado de los mensajes hasta summary_message_id (ver services/conversation_summary.py)
+    summary = Column(Text, nullable=True)
+    summary_message_id = Column(Integer, nullable=True)
+    # Título automático: 'auto' (espera el primer mensaje), 'pending', 'ready'; None si es manual
+    title_status = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
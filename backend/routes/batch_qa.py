@@ -0,0 +1,237 @@
+from fastapi import APIRouter, Depends, HTTPException, Path, UploadFile, File
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from typing import Annotated, AsyncIterator, Dict, Iterable, List, Optional
+from dataclasses import dataclass
+import os
+import json
+import time
+import asyncio
+
+from database import get_db, SessionLocal
+from models import User as UserModel, CustomChatbot
+from auth import get_current_user
+from services.groq_service import groq_service
+from services.embedding_service_pinecone import embedding_service
+from services.rate_limiter import BULK
+from services.metrics import metrics
+from routes.chat_rag import (
+    get_accessible_chatbot,
+    load_policy_state,
+    plan_answer,
+    run_in_session,
+    timed
+)
+
+router = APIRouter(prefix="/api/chat", tags=["Batch QA"])
+
+# Máximo de preguntas por lote
+BATCH_QA_MAX_QUESTIONS = int(os.getenv("BATCH_QA_MAX_QUESTIONS", "1000"))
+# Preguntas por llamada de embeddings
+BATCH_QA_EMBED_BATCH_SIZE = int(os.getenv("BATCH_QA_EMBED_BATCH_SIZE", "96"))
+# Búsquedas en Pinecone y respuestas del LLM en curso a la vez
+BATCH_QA_SEARCH_CONCURRENCY = int(os.getenv("BATCH_QA_SEARCH_CONCURRENCY", "8"))
+BATCH_QA_CONCURRENCY = int(os.getenv("BATCH_QA_CONCURRENCY", "4"))
+
+
+class BatchQuestionError(ValueError):
+    """Línea del archivo de preguntas con formato inválido"""
+    pass
+
+
+@dataclass
+class BatchQuestion:
+    index: int
+    id: str
+    text: str
+
+
+def parse_questions(lines: Iterable[str]) -> List[BatchQuestion]:
+    """
+    Lee un set de preguntas en JSONL: una por línea, como objeto
+    {"id": ..., "question": ...} o como string JSON. Las líneas vacías se
+    ignoran; sin "id" se usa el número de línea.
+
+    Raises:
+        BatchQuestionError: Si una línea no es JSON válido o no trae pregunta
+    """
+    questions = []
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise BatchQuestionError(f"Línea {line_number}: JSON inválido ({e.msg})")
+
+        if isinstance(item, str):
+            question_id, text = str(line_number), item
+        elif isinstance(item, dict):
+            question_id = str(item.get("id", line_number))
+            text = item.get("question") or item.get("text") or ""
+        else:
+            raise BatchQuestionError(f"Línea {line_number}: se esperaba un objeto o un string")
+
+        text = text.strip() if isinstance(text, str) else ""
+        if not text:
+            raise BatchQuestionError(f"Línea {line_number}: pregunta vacía")
+        questions.append(BatchQuestion(index=len(questions), id=question_id, text=text))
+    return questions
+
+
+async def answer_batch(
+    db: Session,
+    chatbot: CustomChatbot,
+    questions: List[BatchQuestion]
+) -> AsyncIterator[dict]:
+    """
+    Responde un lote de preguntas contra el chatbot, entregando cada resultado
+    apenas está listo (no en el orden de entrada; ver "index")
+
+    - La configuración y la huella del chatbot se leen una sola vez.
+    - Los embeddings de las preguntas se piden en lotes, con prioridad BULK.
+    - Las búsquedas y las respuestas corren con concurrencia acotada
+      (BATCH_QA_SEARCH_CONCURRENCY y BATCH_QA_CONCURRENCY) y la generación
+      pasa por el limitador de Groq como BULK, sin quitarle cuota al chat.
+    - No se usa la caché semántica: se quiere medir la respuesta real.
+
+    Al final se entrega un resumen {"summary": {...}}.
+    """
+    batch_started = time.perf_counter()
+    state = await run_in_session(load_policy_state, chatbot.id)
+    search_slots = asyncio.Semaphore(BATCH_QA_SEARCH_CONCURRENCY)
+    generation_slots = asyncio.Semaphore(BATCH_QA_CONCURRENCY)
+    results: asyncio.Queue = asyncio.Queue()
+    tasks = set()
+
+    async def answer(question: BatchQuestion, query_embedding: Optional[List[float]], timings: Dict[str, float]):
+        started = time.perf_counter()
+        result = {"index": question.index, "id": question.id, "question": question.text}
+        try:
+            if query_embedding is None:
+                raise RuntimeError("No se pudo generar el embedding de la pregunta")
+
+            async with search_slots:
+                plan = await plan_answer(
+                    db, chatbot, question.text, f" (lote, pregunta {question.id})", timings,
+                    query_embedding=query_embedding, state=state, use_cache=False
+                )
+
+            answer_text, sources = plan.reply, plan.sources
+            if not answer_text:
+                async with generation_slots:
+                    response_data = await timed(timings, "generation", groq_service.generate_response(
+                        user_question=question.text,
+                        context_chunks=plan.context_chunks,
+                        chatbot_name=chatbot.title,
+                        has_documents=plan.has_documents,
+                        priority=BULK
+                    ))
+                if not response_data.get("success"):
+                    raise RuntimeError(response_data.get("error") or "El LLM no entregó respuesta")
+                answer_text = response_data.get("response", "")
+                sources = response_data.get("sources", [])
+                result["model"] = response_data.get("model_used")
+
+            result.update({
+                "answer": answer_text,
+                "sources": sources,
+                "context_chunks": plan.context_count,
+                "decision": plan.decision
+            })
+            metrics.increment("batch_qa_questions_total", outcome="ok")
+        except Exception as e:
+            result["error"] = str(e)
+            metrics.increment("batch_qa_questions_total", outcome="error")
+
+        timings["total"] = round(timings.get("embedding", 0.0) + time.perf_counter() - started, 3)
+        result["timings"] = timings
+        await results.put(result)
+
+    async def embed_and_dispatch():
+        for i in range(0, len(questions), BATCH_QA_EMBED_BATCH_SIZE):
+            batch = questions[i:i + BATCH_QA_EMBED_BATCH_SIZE]
+            started = time.perf_counter()
+            try:
+                embeddings = await embedding_service.generate_embeddings(
+                    [question.text for question in batch], BULK, input_type="query"
+                )
+            except Exception as e:
+                print(f"Error generando embeddings del lote de preguntas: {str(e)}")
+                embeddings = []
+            if len(embeddings) != len(batch):
+                embeddings = [None] * len(batch)
+            # Tiempo de la llamada repartido entre las preguntas del lote
+            share = round((time.perf_counter() - started) / len(batch), 3)
+            for question, query_embedding in zip(batch, embeddings):
+                tasks.add(asyncio.create_task(answer(question, query_embedding, {"embedding": share})))
+
+    dispatcher = asyncio.create_task(embed_and_dispatch())
+    errors = 0
+    try:
+        for _ in range(len(questions)):
+            result = await results.get()
+            errors += "error" in result
+            yield result
+        await dispatcher
+    finally:
+        # Cliente desconectado: no seguir gastando cuota
+        dispatcher.cancel()
+        for task in tasks:
+            task.cancel()
+
+    yield {"summary": {
+        "chatbot_id": chatbot.id,
+        "questions": len(questions),
+        "errors": errors,
+        "seconds": round(time.perf_counter() - batch_started, 3)
+    }}
+
+
+async def stream_batch(chatbot: CustomChatbot, questions: List[BatchQuestion]) -> AsyncIterator[str]:
+    """Resultados del lote en NDJSON, con una sesión propia que dura todo el stream"""
+    db = SessionLocal()
+    try:
+        async for result in answer_batch(db, chatbot, questions):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+    finally:
+        db.close()
+
+
+@router.post("/chatbots/{chatbot_id}/batch")
+async def run_batch_questions(
+    current_user: Annotated[UserModel, Depends(get_current_user)],
+    chatbot_id: int = Path(..., ge=1),
+    questions: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Responde un set de preguntas (JSONL) contra el chatbot, para revisar su
+    cobertura. Devuelve NDJSON: una línea por pregunta, a medida que se
+    responden, con respuesta, fuentes, decisión de la política y tiempos por
+    etapa, y una línea final con el resumen. No guarda conversaciones.
+    """
+    chatbot = get_accessible_chatbot(db, chatbot_id, current_user.id)
+
+    try:
+        content = (await questions.read()).decode("utf-8-sig")
+        parsed = parse_questions(content.splitlines())
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="El archivo de preguntas debe estar en UTF-8")
+    except BatchQuestionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not parsed:
+        raise HTTPException(status_code=400, detail="El archivo no contiene preguntas")
+    if len(parsed) > BATCH_QA_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo {BATCH_QA_MAX_QUESTIONS} preguntas por lote (se recibieron {len(parsed)})"
+        )
+
+    print(f"📋 Lote de {len(parsed)} preguntas para chatbot {chatbot_id} (usuario {current_user.id})")
+    return StreamingResponse(
+        stream_batch(chatbot, parsed),
+        media_type="application/x-ndjson"
+    )
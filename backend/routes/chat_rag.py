@@ -1,15 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Path
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import Annotated, List, Optional
+from typing import Annotated, Any, Awaitable, Callable, Dict, List, Optional
 from datetime import datetime
+from dataclasses import dataclass, field
+from functools import partial
 from pydantic import BaseModel
 import os
+import json
+import time
+import asyncio
 
-from database import get_db
+from database import get_db, SessionLocal
 from models import (
     User as UserModel, 
     CustomChatbot, 
     ChatbotAccess, 
+    ChatbotDocument,
+    ChatbotSettings,
     Conversation as ConversationModel,
     Message as MessageModel,
     AccessLevel
@@ -17,10 +25,22 @@ from models import (
 from auth import get_current_user
 from services.pinecone_service import pinecone_service
 from services.groq_service import groq_service  # Groq - ultrarrápido y confiable
+from services.llm_router import llm_router
 from services.embedding_service_pinecone import embedding_service
+from services.answer_cache import answer_cache, corpus_fingerprint, CachedAnswer
+from services.response_policy import response_policy, LLM, TEMPLATE, WIDEN
+from services.metrics import metrics
+from services.conversation_summary import conversation_summarizer, PromptHistory
+from services.context_packer import context_packer
+from services.conversation_titles import conversation_titler, TITLE_AUTO, TITLE_PENDING
+from services.chatbot_profile import chatbot_profiles, ProfileView
+from services.retrieval_prefetch import retrieval_prefetch, PrefetchResult
 
 router = APIRouter(prefix="/api/chat", tags=["Chat with RAG"])
 
+# Largo mínimo del borrador para adelantar su búsqueda
+PREFETCH_MIN_CHARS = int(os.getenv("RETRIEVAL_PREFETCH_MIN_CHARS", "8"))
+
 # Pydantic Models
 class MessageCreate(BaseModel):
     text: str
@@ -38,6 +58,10 @@ class ChatResponse(BaseModel):
     sources: List[str] = []
     chatbot_used: Optional[str] = None
     context_chunks: int = 0
+    cached: bool = False
+    prompt_tokens: Optional[int] = None
+    # El título de la conversación se está generando (ver GET /conversations/{id}/title)
+    title_pending: bool = False
 
 class ConversationCreate(BaseModel):
     title: Optional[str] = None
@@ -51,6 +75,25 @@ class ConversationOut(BaseModel):
     updated_at: datetime
     chatbot_id: Optional[int] = None
     chatbot_name: Optional[str] = None
+    # Solo al crear: preguntas de ejemplo del perfil del chatbot
+    suggested_questions: List[str] = []
+
+class PrefetchRequest(BaseModel):
+    text: str
+    chatbot_id: Optional[int] = None
+    # Alternativa a chatbot_id: el chatbot de la conversación
+    conversation_id: Optional[int] = None
+
+class PrefetchOut(BaseModel):
+    # 'started', 'reused' (ya había una búsqueda para ese texto) o 'skipped'
+    status: str
+    reason: Optional[str] = None
+
+class ConversationTitleOut(BaseModel):
+    id: int
+    title: str
+    # 'auto' (sin mensajes), 'pending', 'ready' o None si el título es manual
+    title_status: Optional[str] = None
 
 
 async def verify_chatbot_access(
@@ -59,6 +102,11 @@ async def verify_chatbot_access(
     db: Session
 ) -> CustomChatbot:
     """Verifica que el usuario tenga acceso al chatbot"""
+    return get_accessible_chatbot(db, chatbot_id, user.id)
+
+
+def get_accessible_chatbot(db: Session, chatbot_id: int, user_id: int) -> CustomChatbot:
+    """Chatbot activo al que el usuario tiene acceso (404/403 si no)"""
     
     chatbot = db.query(CustomChatbot).filter(
         CustomChatbot.id == chatbot_id,
@@ -69,13 +117,13 @@ async def verify_chatbot_access(
         raise HTTPException(status_code=404, detail="Chatbot no encontrado o inactivo")
     
     # Propietario siempre tiene acceso
-    if chatbot.created_by == user.id:
+    if chatbot.created_by == user_id:
         return chatbot
     
     # Verificar acceso otorgado
     access_record = db.query(ChatbotAccess).filter(
         ChatbotAccess.chatbot_id == chatbot_id,
-        ChatbotAccess.user_id == user.id
+        ChatbotAccess.user_id == user_id
     ).first()
     
     if not access_record:
@@ -84,6 +132,344 @@ async def verify_chatbot_access(
     return chatbot
 
 
+def quick_reply(intent: Optional[str], chatbot: Optional[CustomChatbot], db: Session) -> Optional[str]:
+    """Respuesta directa para saludos y agradecimientos simples (no requieren búsqueda RAG)"""
+    
+    if intent == "greeting":
+        # Obtener lista de archivos si hay chatbot
+        files_info = ""
+        if chatbot:
+            documents = db.query(ChatbotDocument).filter(
+                ChatbotDocument.chatbot_id == chatbot.id,
+                ChatbotDocument.is_processed == True
+            ).all()
+            
+            if documents:
+                file_names = [doc.original_filename for doc in documents]
+                files_text = ", ".join(file_names)
+                files_info = f"\n\nTengo acceso a: {files_text}. ¿Qué te gustaría saber sobre ellos?"
+        
+        return f"¡Hola! ¿En qué puedo ayudarte?{files_info}"
+    
+    if intent == "thanks":
+        return "¡De nada! ¿Hay algo más en lo que pueda ayudarte?"
+    
+    return None
+
+
+async def embed_question(user_text: str) -> List[float]:
+    """Embedding de la pregunta del usuario (vacío si falla)"""
+    try:
+        return await embedding_service.generate_query_embedding(user_text) or []
+    except Exception as e:
+        print(f"Error generando embedding de la pregunta: {str(e)}")
+        return []
+
+
+async def search_chunks(
+    chatbot: CustomChatbot,
+    user_text: str,
+    query_embedding: List[float],
+    top_k: int,
+    label: str = ""
+) -> List[dict]:
+    """
+    Busca en Pinecone los chunks más parecidos a la pregunta, sin filtrar por score
+    
+    Returns:
+        List[dict]: Resultados de Pinecone (vacío si la búsqueda falla)
+    """
+    if not query_embedding:
+        return []
+    
+    try:
+        search_results = await pinecone_service.query_vectors(
+            index_name=chatbot.pinecone_index_name,
+            query_vector=query_embedding,
+            top_k=top_k,
+            namespace=chatbot.active_namespace
+        )
+    except Exception as e:
+        print(f"Error en búsqueda RAG: {str(e)}")
+        # Continuar sin contexto en caso de error
+        return []
+    
+    # Debug: mostrar scores de resultados
+    if search_results:
+        print(f"🔍 Búsqueda RAG{label}: '{user_text}' (top_k={top_k})")
+        for i, result in enumerate(search_results[:3]):
+            score = result.get('score', 0)
+            source = result.get('metadata', {}).get('source', 'N/A')
+            print(f"   Resultado {i+1}: score={score:.3f}, fuente={source}")
+    
+    return search_results
+
+
+def has_processed_documents(chatbot: Optional[CustomChatbot], db: Session) -> bool:
+    """Verifica si el chatbot tiene documentos cargados"""
+    if not chatbot:
+        return False
+    doc_count = db.query(ChatbotDocument).filter(
+        ChatbotDocument.chatbot_id == chatbot.id,
+        ChatbotDocument.is_processed == True
+    ).count()
+    return doc_count > 0
+
+
+def conversation_history(db: Session, conversation_id: int) -> PromptHistory:
+    """
+    Resumen acumulado y últimos mensajes de la conversación, sin el mensaje
+    actual del usuario, dentro del presupuesto de tokens del historial
+    """
+    return conversation_summarizer.prompt_history(db, conversation_id)
+
+
+def has_prior_messages(db: Session, conversation_id: int) -> bool:
+    """
+    Si el usuario ya escribió en la conversación. Con historial o resumen en
+    el prompt la respuesta depende de la conversación, así que no se lee ni se
+    guarda en la caché semántica, que se comparte entre todos los usuarios del
+    chatbot. El mensaje de bienvenida del bot no cuenta.
+    """
+    return db.query(MessageModel.id).filter(
+        MessageModel.conversation_id == conversation_id,
+        MessageModel.sender == "user"
+    ).first() is not None
+
+
+def save_user_message(db: Session, conversation_id: int, user_text: str) -> PromptHistory:
+    """Guarda el mensaje del usuario y devuelve el historial previo de la conversación"""
+    db.add(MessageModel(
+        conversation_id=conversation_id,
+        sender="user",
+        text=user_text
+    ))
+    db.commit()
+    return conversation_history(db, conversation_id)
+
+
+def _in_session(fn: Callable, *args) -> Any:
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+async def run_in_session(fn: Callable, *args) -> Any:
+    """
+    Ejecuta fn(db, *args) en un hilo con su propia sesión, para que las
+    consultas a la BD no bloqueen el event loop y puedan correr en paralelo
+    con otras etapas. Los objetos devueltos quedan desvinculados de la sesión.
+    """
+    return await asyncio.to_thread(_in_session, fn, *args)
+
+
+async def timed(timings: Dict[str, float], step: str, awaitable: Awaitable) -> Any:
+    """Espera una etapa del chat registrando su duración"""
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        elapsed = time.perf_counter() - started
+        timings[step] = round(elapsed, 3)
+        metrics.observe("chat_step_seconds", elapsed, step=step)
+
+
+def chunk_sources(context_chunks: List[dict]) -> List[str]:
+    """Fuentes de los chunks de contexto, en orden"""
+    return [chunk.get('metadata', {}).get('source', 'Desconocido') for chunk in context_chunks]
+
+
+def remember_answer(
+    chatbot_id: int,
+    fingerprint: str,
+    user_text: str,
+    query_embedding: List[float],
+    started: float,
+    response: str,
+    sources: List[str],
+    context_chunks: int
+) -> None:
+    """
+    Guarda la respuesta en la caché semántica. Solo se guardan respuestas
+    basadas en documentos: sin contexto dependen más de la conversación.
+    """
+    if context_chunks:
+        answer_cache.store(
+            chatbot_id, fingerprint, user_text, query_embedding,
+            response, sources, context_chunks,
+            generation_seconds=time.perf_counter() - started
+        )
+
+
+@dataclass
+class PolicyState:
+    """Datos de la BD que necesita la política de respuesta"""
+    settings: ChatbotSettings
+    has_documents: bool
+    fingerprint: Optional[str]
+
+
+def load_policy_state(db: Session, chatbot_id: Optional[int]) -> PolicyState:
+    if chatbot_id is None:
+        return PolicyState(response_policy.settings_for(db, None), False, None)
+    
+    fingerprint = corpus_fingerprint(db, chatbot_id)
+    return PolicyState(
+        settings=response_policy.settings_for(db, chatbot_id),
+        # La huella empieza con la cantidad de documentos procesados
+        has_documents=not fingerprint.startswith("0:"),
+        fingerprint=fingerprint
+    )
+
+
+@dataclass
+class AnswerPlan:
+    """Cómo responder una pregunta: sin LLM (reply) o con el LLM y este contexto"""
+    reply: Optional[str] = None
+    cached: Optional[CachedAnswer] = None
+    context_chunks: List[dict] = field(default_factory=list)
+    has_documents: bool = False
+    # Guarda en la caché la respuesta generada: remember(response, sources, context_chunks)
+    remember: Optional[Callable] = None
+    # Decisión de la política, "acción:motivo" (o "cache")
+    decision: Optional[str] = None
+    
+    @property
+    def sources(self) -> List[str]:
+        if self.cached:
+            return self.cached.sources
+        return chunk_sources(self.context_chunks)
+    
+    @property
+    def context_count(self) -> int:
+        return self.cached.context_chunks if self.cached else len(self.context_chunks)
+
+
+async def plan_answer(
+    db: Session,
+    chatbot: Optional[CustomChatbot],
+    user_text: str,
+    label: str = "",
+    timings: Optional[Dict[str, float]] = None,
+    query_embedding: Optional[List[float]] = None,
+    state: Optional[PolicyState] = None,
+    use_cache: bool = True,
+    user_id: Optional[int] = None
+) -> AnswerPlan:
+    """
+    Aplica la política de respuesta del chatbot: saludos, caché semántica y
+    búsqueda RAG. Solo se llama al LLM si la búsqueda encontró contexto o si
+    la política del chatbot lo pide.
+    
+    La configuración del chatbot se lee de la BD mientras se genera el
+    embedding de la pregunta; el embedding se adelanta salvo que el mensaje
+    parezca un saludo, que no lo necesita. Quien ya tiene el embedding o la
+    configuración (p. ej. un lote de preguntas) puede pasarlos.
+    
+    Con user_id, si el usuario adelantó la búsqueda de su borrador (POST
+    /prefetch) y el texto coincide, se reutilizan ese embedding y top-k. Si
+    el mensaje solo completa el borrador, el embedding no es el de la
+    pregunta final y no se usa la caché semántica.
+    """
+    timings = {} if timings is None else timings
+    chatbot_id = chatbot.id if chatbot else None
+    
+    prefetched = None
+    if query_embedding is None and chatbot and user_id is not None:
+        prefetched = retrieval_prefetch.take(user_id, chatbot_id, user_text)
+    
+    embedding_task = None
+    if (query_embedding is None and prefetched is None and chatbot
+            and not response_policy.intent(user_text, ChatbotSettings.with_defaults())):
+        embedding_task = asyncio.create_task(timed(timings, "embedding", embed_question(user_text)))
+    
+    try:
+        if state is None:
+            state = await timed(timings, "policy_state", run_in_session(load_policy_state, chatbot_id))
+        
+        intent = response_policy.intent(user_text, state.settings)
+        if intent:
+            response_policy.record(TEMPLATE, intent)
+            return AnswerPlan(reply=quick_reply(intent, chatbot, db), decision=f"{TEMPLATE}:{intent}")
+        
+        if not state.has_documents:
+            # Asistente general o chatbot sin documentos: no hay nada que buscar
+            response_policy.record(LLM, "no_documents")
+            return AnswerPlan(decision=f"{LLM}:no_documents")
+        
+        prefetch_result = None
+        if prefetched is not None:
+            # Búsqueda adelantada (terminada o todavía en curso)
+            prefetch_result = await timed(timings, "prefetch", prefetched.wait())
+            if prefetch_result is not None:
+                query_embedding = prefetch_result.embedding
+                use_cache = use_cache and prefetched.same_text(user_text)
+        
+        if query_embedding is None:
+            if embedding_task is None:
+                embedding_task = asyncio.create_task(timed(timings, "embedding", embed_question(user_text)))
+            query_embedding = await embedding_task
+    finally:
+        if embedding_task and not embedding_task.done():
+            embedding_task.cancel()
+        if prefetched and not prefetched.task.done():
+            prefetched.task.cancel()
+    
+    # Preguntas similares ya respondidas se sirven desde la caché
+    cached = answer_cache.lookup(chatbot_id, state.fingerprint, query_embedding) if use_cache else None
+    if cached:
+        return AnswerPlan(reply=cached.response, cached=cached, has_documents=True, decision="cache")
+    
+    started = time.perf_counter()
+    top_k, min_score = response_policy.retrieval_params(state.settings)
+    if (prefetch_result is not None and prefetch_result.results
+            and prefetched.covers(top_k, chatbot.active_namespace, state.fingerprint)):
+        search_results = prefetch_result.results[:top_k]
+        print(f"🔍 Búsqueda RAG{label}: reutilizada del borrador '{prefetched.text}'")
+    else:
+        search_results = await timed(
+            timings, "search", search_chunks(chatbot, user_text, query_embedding, top_k, label)
+        )
+    decision = response_policy.decide(state.settings, search_results, min_score)
+    
+    if decision.action == WIDEN:
+        response_policy.record(WIDEN, decision.reason)
+        search_results = await timed(
+            timings, "search_widened",
+            search_chunks(chatbot, user_text, query_embedding, max(state.settings.widen_top_k, top_k), label)
+        )
+        decision = response_policy.decide(state.settings, search_results, min_score, widened=True)
+    
+    response_policy.record(decision.action, decision.reason)
+    print(f"   🧭 Política: {decision.action} ({decision.reason}, score máximo {decision.max_score:.3f})")
+    
+    if decision.action == TEMPLATE:
+        return AnswerPlan(reply=decision.reply, has_documents=True, decision=f"{TEMPLATE}:{decision.reason}")
+    
+    # Contexto dentro del presupuesto de tokens, sin texto repetido entre chunks vecinos
+    packed = context_packer.pack(decision.context_chunks)
+    metrics.observe("rag_context_tokens", packed.tokens)
+    if packed.merged or packed.dropped:
+        print(f"   📦 Contexto: {packed.tokens} tokens ({packed.merged} chunks unidos, {packed.dropped} descartados)")
+    
+    return AnswerPlan(
+        context_chunks=packed.chunks,
+        has_documents=True,
+        remember=(
+            partial(remember_answer, chatbot_id, state.fingerprint, user_text, query_embedding, started)
+            if use_cache else None
+        ),
+        decision=f"{decision.action}:{decision.reason}"
+    )
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Formatea un evento Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @router.post("/message", response_model=ChatResponse)
 async def send_message_with_rag(
     payload: MessageCreate,
@@ -96,116 +482,41 @@ async def send_message_with_rag(
     if not user_text:
         raise HTTPException(status_code=400, detail="Mensaje vacío")
     
-    # Detectar saludos y respuestas simples (no requieren búsqueda RAG)
-    greetings = ["hola", "hello", "hi", "buenos días", "buenas tardes", "buenas noches", "hey", "saludos"]
-    thanks = ["gracias", "thank you", "thanks", "muchas gracias"]
-    is_greeting = any(greeting in user_text.lower() for greeting in greetings)
-    is_thanks = any(thank in user_text.lower() for thank in thanks)
-    
     chatbot = None
     chatbot_name = "Asistente General"
-    context_chunks = []
     
     # Obtener información del chatbot si se especifica
     if payload.chatbot_id:
         chatbot = await verify_chatbot_access(payload.chatbot_id, current_user, db)
         chatbot_name = chatbot.title
     
-    # Respuesta directa para saludos simples
-    if is_greeting and len(user_text.split()) <= 3:
-        files_info = ""
-        if chatbot:
-            from models import ChatbotDocument
-            documents = db.query(ChatbotDocument).filter(
-                ChatbotDocument.chatbot_id == chatbot.id,
-                ChatbotDocument.is_processed == True
-            ).all()
-            
-            if documents:
-                file_names = [doc.original_filename for doc in documents]
-                files_text = ", ".join(file_names)
-                files_info = f"\n\nTengo acceso a: {files_text}. ¿Qué te gustaría saber sobre ellos?"
-        
-        return ChatResponse(
-            response=f"¡Hola! ¿En qué puedo ayudarte?{files_info}",
-            sources=[],
-            chatbot_used=chatbot_name,
-            context_chunks=0
-        )
-    
-    # Respuesta directa para agradecimientos
-    if is_thanks and len(user_text.split()) <= 5:
+    # Saludos, caché o plantilla: respuesta sin LLM
+    plan = await plan_answer(db, chatbot, user_text, user_id=current_user.id)
+    if plan.reply:
         return ChatResponse(
-            response="¡De nada! ¿Hay algo más en lo que pueda ayudarte?",
-            sources=[],
+            response=plan.reply,
+            sources=plan.sources,
             chatbot_used=chatbot_name,
-            context_chunks=0
+            context_chunks=plan.context_count,
+            cached=plan.cached is not None
         )
     
-    # Si se especifica un chatbot, usar RAG
-    if payload.chatbot_id:
-        chatbot = await verify_chatbot_access(payload.chatbot_id, current_user, db)
-        chatbot_name = chatbot.title
-        
-        try:
-            # Generar embedding de la pregunta del usuario
-            query_embedding = await embedding_service.generate_query_embedding(user_text)
-            
-            if query_embedding:
-                # Buscar contexto relevante en Pinecone
-                search_results = await pinecone_service.query_vectors(
-                    index_name=chatbot.pinecone_index_name,
-                    query_vector=query_embedding,
-                    top_k=int(os.getenv("TOP_K_RESULTS", "5")),
-                    namespace=f"chatbot_{chatbot.id}"
-                )
-                
-                # Filtrar resultados por score mínimo
-                # Usar umbral más alto para evitar falsos positivos
-                min_score = 0.70  # ✅ Score alto para asegurar relevancia real
-                context_chunks = [
-                    result for result in search_results 
-                    if result.get("score", 0) >= min_score
-                ]
-                
-                # Debug: mostrar scores de resultados
-                if search_results:
-                    print(f"🔍 Búsqueda RAG para: '{user_text}'")
-                    for i, result in enumerate(search_results[:3]):
-                        score = result.get('score', 0)
-                        source = result.get('metadata', {}).get('source', 'N/A')
-                        print(f"   Resultado {i+1}: score={score:.3f}, fuente={source}")
-                    print(f"   ✅ {len(context_chunks)} chunks pasaron el umbral de {min_score}")
-                    if len(context_chunks) == 0 and search_results:
-                        max_score = max(r.get('score', 0) for r in search_results)
-                        print(f"   ⚠️ Score más alto ({max_score:.3f}) está por debajo del umbral - pregunta probablemente no relacionada")
-                
-        except Exception as e:
-            print(f"Error en búsqueda RAG: {str(e)}")
-            # Continuar sin contexto en caso de error
-    
     # Generar respuesta usando Groq (ultrarrápido y confiable)
+    prompt_tokens = None
     try:
-        # Verificar si el chatbot tiene documentos cargados
-        has_documents = False
-        if chatbot:
-            from models import ChatbotDocument
-            doc_count = db.query(ChatbotDocument).filter(
-                ChatbotDocument.chatbot_id == chatbot.id,
-                ChatbotDocument.is_processed == True
-            ).count()
-            has_documents = doc_count > 0
-        
         response_data = await groq_service.generate_response(
             user_question=user_text,
-            context_chunks=context_chunks,
+            context_chunks=plan.context_chunks,
             chatbot_name=chatbot_name,
-            has_documents=has_documents
+            has_documents=plan.has_documents
         )
         
         if response_data.get("success"):
             ai_response = response_data.get("response", "")
             sources = response_data.get("sources", [])
+            prompt_tokens = response_data.get("prompt_tokens")
+            if plan.remember:
+                plan.remember(ai_response, sources, len(plan.context_chunks))
         else:
             ai_response = "Lo siento, hubo un error procesando tu consulta."
             sources = []
@@ -219,8 +530,95 @@ async def send_message_with_rag(
         response=ai_response,
         sources=sources,
         chatbot_used=chatbot_name if chatbot else None,
-        context_chunks=len(context_chunks)
+        context_chunks=len(plan.context_chunks),
+        prompt_tokens=prompt_tokens
+    )
+
+
+@router.post("/message/stream")
+async def stream_message_with_rag(
+    payload: MessageCreate,
+    current_user: Annotated[UserModel, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+):
+    """
+    Enviar mensaje con búsqueda RAG y recibir la respuesta por SSE
+    
+    Eventos: 'sources' (al inicio), 'token' (fragmentos de texto),
+    'done' (respuesta completa) o 'error'.
+    """
+    
+    user_text = payload.text.strip()
+    if not user_text:
+        raise HTTPException(status_code=400, detail="Mensaje vacío")
+    
+    chatbot = None
+    chatbot_name = "Asistente General"
+    if payload.chatbot_id:
+        chatbot = await verify_chatbot_access(payload.chatbot_id, current_user, db)
+        chatbot_name = chatbot.title
+    
+    plan = await plan_answer(db, chatbot, user_text, user_id=current_user.id)
+    messages = None
+    if not plan.reply:
+        messages = groq_service.build_messages(
+            user_text, plan.context_chunks, chatbot_name, has_documents=plan.has_documents
+        )
+    
+    return _stream_chat(
+        plan=plan,
+        messages=messages,
+        chatbot_name=chatbot_name if chatbot else None
+    )
+
+
+async def prefetch_retrieval(chatbot: CustomChatbot, text: str, top_k: int) -> PrefetchResult:
+    """Embedding y top-k del borrador (se ejecuta en segundo plano)"""
+    query_embedding = await embed_question(text)
+    results = await search_chunks(chatbot, text, query_embedding, top_k, " (borrador)")
+    return PrefetchResult(embedding=query_embedding, results=results)
+
+
+@router.post("/prefetch", response_model=PrefetchOut, status_code=202)
+async def prefetch_draft(
+    payload: PrefetchRequest,
+    current_user: Annotated[UserModel, Depends(get_current_user)]
+):
+    """
+    Adelanta la búsqueda RAG del borrador que el usuario está escribiendo
+    
+    El frontend lo llama tras una pausa al escribir; responde de inmediato y
+    la búsqueda sigue en segundo plano. Si el mensaje enviado coincide (o
+    casi) con el borrador, el envío reutiliza el embedding y los resultados.
+    """
+    text = payload.text.strip()
+    if len(text) < PREFETCH_MIN_CHARS or not retrieval_prefetch.enabled:
+        return PrefetchOut(status="skipped", reason="short_text" if retrieval_prefetch.enabled else "disabled")
+    
+    chatbot_id = payload.chatbot_id
+    if payload.conversation_id:
+        conversation = await run_in_session(
+            lambda db: db.query(ConversationModel).filter(ConversationModel.id == payload.conversation_id).first()
+        )
+        if not conversation or conversation.user_id != current_user.id:
+            raise HTTPException(status_code=404, detail="Conversación no encontrada")
+        chatbot_id = conversation.chatbot_id
+    if not chatbot_id:
+        return PrefetchOut(status="skipped", reason="no_chatbot")
+    
+    chatbot = await run_in_session(get_accessible_chatbot, chatbot_id, current_user.id)
+    state = await run_in_session(load_policy_state, chatbot.id)
+    if response_policy.intent(text, state.settings):
+        return PrefetchOut(status="skipped", reason="intent")
+    if not state.has_documents:
+        return PrefetchOut(status="skipped", reason="no_documents")
+    
+    top_k, _ = response_policy.retrieval_params(state.settings)
+    started = retrieval_prefetch.start(
+        current_user.id, chatbot.id, text, top_k, chatbot.active_namespace, state.fingerprint,
+        partial(prefetch_retrieval, chatbot, text, top_k)
     )
+    return PrefetchOut(status="started" if started else "reused")
 
 
 @router.post("/conversations", response_model=ConversationOut, status_code=201)
@@ -239,7 +637,7 @@ async def create_conversation_with_chatbot(
         chatbot = await verify_chatbot_access(payload.chatbot_id, current_user, db)
         chatbot_name = chatbot.title
     
-    # Generar título si no se proporciona
+    # Título provisorio si no se proporciona; el definitivo se genera con el primer mensaje
     title = payload.title
     if not title:
         if chatbot:
@@ -251,65 +649,46 @@ async def create_conversation_with_chatbot(
     conversation = ConversationModel(
         user_id=current_user.id,
         chatbot_id=payload.chatbot_id,
-        title=title
+        title=title,
+        title_status=None if payload.title else TITLE_AUTO
     )
     
     db.add(conversation)
     db.commit()
     db.refresh(conversation)
     
-    # Mensaje de bienvenida
+    # Mensaje de bienvenida (desde el perfil precalculado: sin embeddings ni Pinecone)
+    suggested_questions = []
     if payload.with_welcome:
         if chatbot:
-            # Obtener lista de documentos del chatbot
-            from models import ChatbotDocument
-            documents = db.query(ChatbotDocument).filter(
-                ChatbotDocument.chatbot_id == chatbot.id,
-                ChatbotDocument.is_processed == True
-            ).all()
+            profile = chatbot_profiles.get(db, chatbot.id)
+            if profile is None:
+                # Perfil aún no calculado: solo la lista de documentos
+                documents = db.query(ChatbotDocument.original_filename).filter(
+                    ChatbotDocument.chatbot_id == chatbot.id,
+                    ChatbotDocument.is_processed == True
+                ).order_by(ChatbotDocument.original_filename.asc()).all()
+                profile = ProfileView(documents=[name for (name,) in documents])
             
-            if documents:
-                # Crear lista de nombres de archivos
-                file_names = [doc.original_filename for doc in documents]
-                files_text = "\n".join([f"📄 {name}" for name in file_names])
+            if profile.documents:
+                files_text = "\n".join([f"📄 {name}" for name in profile.documents])
                 
-                # Intentar obtener un resumen del contenido
-                try:
-                    # Hacer una búsqueda general para obtener contenido de los documentos
-                    sample_embedding = await embedding_service.generate_query_embedding(
-                        "resumen contenido principal documentos"
-                    )
-                    
-                    if sample_embedding:
-                        sample_results = await pinecone_service.query_vectors(
-                            index_name=chatbot.pinecone_index_name,
-                            query_vector=sample_embedding,
-                            top_k=3,
-                            namespace=f"chatbot_{chatbot.id}"
-                        )
-                        
-                        # Obtener temas principales de los metadatos
-                        topics = set()
-                        for result in sample_results:
-                            metadata = result.get('metadata', {})
-                            text_sample = metadata.get('text', '')[:200]
-                            if text_sample:
-                                topics.add(text_sample.split('.')[0] if '.' in text_sample else text_sample[:100])
-                        
-                        topics_text = ""
-                        if topics:
-                            topics_list = list(topics)[:2]  # Máximo 2 temas
-                            topics_text = f"\n\nEstos documentos contienen información sobre:\n" + "\n".join([f"• {t}" for t in topics_list])
+                topics_text = ""
+                if profile.topics:
+                    topics_list = profile.topics[:2]  # Máximo 2 temas
+                    topics_text = f"\n\nEstos documentos contienen información sobre:\n" + "\n".join([f"• {t}" for t in topics_list])
                 
-                except Exception as e:
-                    print(f"Error obteniendo resumen de documentos: {str(e)}")
-                    topics_text = ""
+                suggested_questions = profile.suggested_questions
+                questions_text = ""
+                if suggested_questions:
+                    questions_text = "\n\nPor ejemplo, puedes preguntarme:\n" + "\n".join([f"• {q}" for q in suggested_questions])
                 
                 welcome_text = (
                     f"¡Hola! Soy {chatbot.title}, tu asistente especializado.\n\n"
                     f"Tengo acceso a los siguientes documentos:\n{files_text}"
                     f"{topics_text}\n\n"
                     f"¿Qué te gustaría saber? Puedo ayudarte con cualquier pregunta sobre el contenido de estos archivos."
+                    f"{questions_text}"
                 )
             else:
                 welcome_text = (
@@ -334,7 +713,8 @@ async def create_conversation_with_chatbot(
         created_at=conversation.created_at,
         updated_at=conversation.updated_at,
         chatbot_id=conversation.chatbot_id,
-        chatbot_name=chatbot_name
+        chatbot_name=chatbot_name,
+        suggested_questions=suggested_questions
     )
 
 
@@ -364,170 +744,70 @@ async def send_message_to_conversation(
     if not user_text:
         raise HTTPException(status_code=400, detail="Mensaje vacío")
     
-    # Detectar saludos y respuestas simples (no requieren búsqueda RAG)
-    greetings = ["hola", "hello", "hi", "buenos días", "buenas tardes", "buenas noches", "hey", "saludos"]
-    thanks = ["gracias", "thank you", "thanks", "muchas gracias"]
-    is_greeting = any(greeting in user_text.lower() for greeting in greetings)
-    is_thanks = any(thank in user_text.lower() for thank in thanks)
-    
-    # Guardar mensaje del usuario
-    user_msg = MessageModel(
-        conversation_id=conversation.id,
-        sender="user",
-        text=user_text
-    )
-    db.add(user_msg)
-    db.commit()
-    
-    chatbot = None
-    chatbot_name = "Asistente General"
-    context_chunks = []
-    
-    # Obtener información del chatbot si existe
-    if conversation.chatbot_id:
-        chatbot = await verify_chatbot_access(conversation.chatbot_id, current_user, db)
-        chatbot_name = chatbot.title
+    timings = {}
+    turn_started = time.perf_counter()
+    # Antes de guardar el mensaje actual: solo el primer mensaje usa la caché
+    use_cache = not has_prior_messages(db, conversation.id)
     
-    # Respuesta directa para saludos simples
-    if is_greeting and len(user_text.split()) <= 3:
-        # Obtener lista de archivos si hay chatbot
-        files_info = ""
-        if chatbot:
-            from models import ChatbotDocument
-            documents = db.query(ChatbotDocument).filter(
-                ChatbotDocument.chatbot_id == chatbot.id,
-                ChatbotDocument.is_processed == True
-            ).all()
-            
-            if documents:
-                file_names = [doc.original_filename for doc in documents]
-                files_text = ", ".join(file_names)
-                files_info = f"\n\nTengo acceso a: {files_text}. ¿Qué te gustaría saber sobre ellos?"
-        
-        greeting_response = f"¡Hola! ¿En qué puedo ayudarte?{files_info}"
-        
-        # Guardar respuesta
-        ai_msg = MessageModel(
-            conversation_id=conversation.id,
-            sender="ai",
-            text=greeting_response
-        )
-        db.add(ai_msg)
-        conversation.updated_at = datetime.utcnow()
-        db.commit()
-        
-        return ChatResponse(
-            response=greeting_response,
-            sources=[],
-            chatbot_used=chatbot_name,
-            context_chunks=0
-        )
+    # Etapas independientes en paralelo:
+    #   guardar el mensaje del usuario + cargar el historial (BD)
+    #   acceso al chatbot (BD) -> configuración (BD) || embedding (red) -> búsqueda (red)
+    async def resolve_plan():
+        chatbot = None
+        if conversation.chatbot_id:
+            chatbot = await timed(
+                timings, "verify_access",
+                run_in_session(get_accessible_chatbot, conversation.chatbot_id, current_user.id)
+            )
+        try:
+            plan = await plan_answer(
+                db, chatbot, user_text, f" (conversación {conversation_id})", timings,
+                use_cache=use_cache, user_id=current_user.id
+            )
+        except Exception as e:
+            print(f"Error en RAG para conversación: {str(e)}")
+            plan = AnswerPlan(has_documents=has_processed_documents(chatbot, db))
+        return chatbot, plan
     
-    # Respuesta directa para agradecimientos
-    if is_thanks and len(user_text.split()) <= 5:
-        thanks_response = "¡De nada! ¿Hay algo más en lo que pueda ayudarte?"
-        
-        # Guardar respuesta
-        ai_msg = MessageModel(
-            conversation_id=conversation.id,
-            sender="ai",
-            text=thanks_response
-        )
-        db.add(ai_msg)
-        conversation.updated_at = datetime.utcnow()
-        db.commit()
-        
-        return ChatResponse(
-            response=thanks_response,
-            sources=[],
-            chatbot_used=chatbot_name,
-            context_chunks=0
-        )
+    prompt_tokens = None
+    history, (chatbot, plan) = await asyncio.gather(
+        timed(timings, "save_and_history", run_in_session(save_user_message, conversation.id, user_text)),
+        resolve_plan()
+    )
+    chatbot_name = chatbot.title if chatbot else "Asistente General"
     
-    # Si la conversación está vinculada a un chatbot, usar RAG
-    if conversation.chatbot_id:
+    if plan.reply:
+        # Saludos, caché o plantilla: respuesta sin LLM
+        ai_response = plan.reply
+        sources = plan.sources
+    else:
+        # Generar respuesta con Groq (ultrarrápido y confiable)
         try:
-            chatbot = await verify_chatbot_access(conversation.chatbot_id, current_user, db)
-            chatbot_name = chatbot.title
-            
-            # Generar embedding de la pregunta
-            query_embedding = await embedding_service.generate_query_embedding(user_text)
+            response_data = await timed(timings, "generation", groq_service.generate_response(
+                user_question=user_text,
+                context_chunks=plan.context_chunks,
+                chatbot_name=chatbot_name,
+                conversation_history=history.messages,
+                has_documents=plan.has_documents,
+                conversation_summary=history.summary,
+                # Lo que queda del presupuesto del turno tras la búsqueda
+                time_budget=llm_router.turn_budget_seconds - (time.perf_counter() - turn_started)
+            ))
             
-            if query_embedding:
-                # Buscar contexto en Pinecone
-                search_results = await pinecone_service.query_vectors(
-                    index_name=chatbot.pinecone_index_name,
-                    query_vector=query_embedding,
-                    top_k=int(os.getenv("TOP_K_RESULTS", "5")),
-                    namespace=f"chatbot_{chatbot.id}"
-                )
-                
-                # Filtrar por score mínimo
-                # Usar umbral más alto para evitar falsos positivos
-                min_score = 0.70  # ✅ Score alto para asegurar relevancia real
-                context_chunks = [
-                    result for result in search_results 
-                    if result.get("score", 0) >= min_score
-                ]
-                
-                # Debug: mostrar scores de resultados
-                if search_results:
-                    print(f"🔍 Búsqueda RAG (conversación {conversation_id}): '{user_text}'")
-                    for i, result in enumerate(search_results[:3]):
-                        score = result.get('score', 0)
-                        source = result.get('metadata', {}).get('source', 'N/A')
-                        print(f"   Resultado {i+1}: score={score:.3f}, fuente={source}")
-                    print(f"   ✅ {len(context_chunks)} chunks pasaron el umbral de {min_score}")
-                    if len(context_chunks) == 0 and search_results:
-                        max_score = max(r.get('score', 0) for r in search_results)
-                        print(f"   ⚠️ Score más alto ({max_score:.3f}) está por debajo del umbral - pregunta probablemente no relacionada")
+            if response_data.get("success"):
+                ai_response = response_data.get("response", "")
+                sources = response_data.get("sources", [])
+                prompt_tokens = response_data.get("prompt_tokens")
+                if plan.remember:
+                    plan.remember(ai_response, sources, len(plan.context_chunks))
+            else:
+                ai_response = "Lo siento, hubo un error procesando tu consulta."
+                sources = []
                 
         except Exception as e:
-            print(f"Error en RAG para conversación: {str(e)}")
-    
-    # Obtener historial de la conversación para contexto
-    recent_messages = db.query(MessageModel).filter(
-        MessageModel.conversation_id == conversation.id
-    ).order_by(MessageModel.created_at.desc()).limit(6).all()  # Últimos 6 mensajes
-    
-    conversation_history = []
-    for msg in reversed(recent_messages[1:]):  # Excluir mensaje actual
-        conversation_history.append({
-            "sender": msg.sender,
-            "text": msg.text
-        })
-    
-    # Generar respuesta con Groq (ultrarrápido y confiable)
-    try:
-        # Verificar si el chatbot tiene documentos cargados
-        has_documents = False
-        if chatbot:
-            from models import ChatbotDocument
-            doc_count = db.query(ChatbotDocument).filter(
-                ChatbotDocument.chatbot_id == chatbot.id,
-                ChatbotDocument.is_processed == True
-            ).count()
-            has_documents = doc_count > 0
-        
-        response_data = await groq_service.generate_response(
-            user_question=user_text,
-            context_chunks=context_chunks,
-            chatbot_name=chatbot_name,
-            conversation_history=conversation_history,
-            has_documents=has_documents
-        )
-        
-        if response_data.get("success"):
-            ai_response = response_data.get("response", "")
-            sources = response_data.get("sources", [])
-        else:
-            ai_response = "Lo siento, hubo un error procesando tu consulta."
+            print(f"Error generando respuesta: {str(e)}")
+            ai_response = "Lo siento, no pude procesar tu mensaje."
             sources = []
-            
-    except Exception as e:
-        print(f"Error generando respuesta: {str(e)}")
-        ai_response = "Lo siento, no pude procesar tu mensaje."
-        sources = []
     
     # Guardar respuesta de la IA
     ai_msg = MessageModel(
@@ -539,13 +819,205 @@ async def send_message_to_conversation(
     
     # Actualizar timestamp de conversación
     conversation.updated_at = datetime.utcnow()
+    title_pending = conversation.title_status == TITLE_AUTO
+    if title_pending:
+        conversation.title_status = TITLE_PENDING
     db.commit()
     
+    # Los mensajes que salen de la ventana reciente se resumen en segundo plano,
+    # y el título de una conversación nueva se genera sin demorar la respuesta
+    conversation_summarizer.schedule(conversation_id)
+    if title_pending:
+        conversation_titler.schedule(conversation_id, user_text)
+    
+    total = time.perf_counter() - turn_started
+    metrics.observe("chat_turn_seconds", total, endpoint="conversation_message")
+    print(f"⏱️ Conversación {conversation_id}: {total:.3f}s {timings}")
+    
     return ChatResponse(
         response=ai_response,
         sources=sources,
         chatbot_used=chatbot_name,
-        context_chunks=len(context_chunks)
+        context_chunks=plan.context_count,
+        cached=plan.cached is not None,
+        prompt_tokens=prompt_tokens,
+        title_pending=title_pending
+    )
+
+
+@router.post("/conversations/{conversation_id}/messages/stream")
+async def stream_message_to_conversation(
+    payload: MessageCreate,
+    current_user: Annotated[UserModel, Depends(get_current_user)],
+    conversation_id: int = Path(..., ge=1),
+    db: Session = Depends(get_db)
+):
+    """
+    Enviar mensaje a una conversación y recibir la respuesta por SSE
+    
+    Las fuentes se envían antes de generar; la respuesta completa se guarda
+    en la conversación al terminar el stream.
+    """
+    
+    # Verificar que la conversación existe y el usuario tiene acceso
+    conversation = db.query(ConversationModel).filter(
+        ConversationModel.id == conversation_id
+    ).first()
+    
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversación no encontrada")
+    
+    if conversation.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="No tiene acceso a esta conversación")
+    
+    user_text = payload.text.strip()
+    if not user_text:
+        raise HTTPException(status_code=400, detail="Mensaje vacío")
+    
+    chatbot = None
+    chatbot_name = "Asistente General"
+    if conversation.chatbot_id:
+        chatbot = await verify_chatbot_access(conversation.chatbot_id, current_user, db)
+        chatbot_name = chatbot.title
+    
+    # Solo el primer mensaje de la conversación usa la caché (ver has_prior_messages)
+    use_cache = not has_prior_messages(db, conversation.id)
+    
+    # Guardar mensaje del usuario
+    db.add(MessageModel(
+        conversation_id=conversation.id,
+        sender="user",
+        text=user_text
+    ))
+    title_pending = conversation.title_status == TITLE_AUTO
+    if title_pending:
+        conversation.title_status = TITLE_PENDING
+    db.commit()
+    
+    plan = await plan_answer(
+        db, chatbot, user_text, f" (conversación {conversation_id})", use_cache=use_cache, user_id=current_user.id
+    )
+    messages = None
+    if not plan.reply:
+        history = conversation_history(db, conversation.id)
+        messages = groq_service.build_messages(
+            user_text,
+            plan.context_chunks,
+            chatbot_name,
+            conversation_history=history.messages,
+            has_documents=plan.has_documents,
+            conversation_summary=history.summary
+        )
+    
+    return _stream_chat(
+        plan=plan,
+        messages=messages,
+        chatbot_name=chatbot_name,
+        conversation_id=conversation.id,
+        title_message=user_text if title_pending else None
+    )
+
+
+def _stream_chat(
+    plan: AnswerPlan,
+    messages: Optional[List[dict]],
+    chatbot_name: Optional[str],
+    conversation_id: Optional[int] = None,
+    title_message: Optional[str] = None
+) -> StreamingResponse:
+    """
+    Respuesta SSE: fuentes, fragmentos de texto a medida que llegan y evento
+    final. Si hay conversación, la respuesta completa se guarda al terminar
+    (con una sesión propia, ya que el stream sigue después del request).
+    Con title_message, el título de la conversación se genera después.
+    Una respuesta sin LLM (saludo, caché o plantilla) se envía en un solo
+    fragmento; la generada se guarda en la caché si el stream termina bien.
+    Si el cliente se desconecta, se guarda lo generado hasta ese momento y
+    se programan igual el resumen y el título.
+    """
+    persisted = False
+    
+    def persist(ai_response: str) -> Optional[int]:
+        """
+        Guarda la respuesta y programa resumen y título. No hace await, así
+        que también corre completo dentro de un stream cancelado.
+        """
+        nonlocal persisted
+        persisted = True
+        if conversation_id is None:
+            return None
+        message_id = None
+        if ai_response:
+            db = SessionLocal()
+            try:
+                ai_msg = MessageModel(
+                    conversation_id=conversation_id,
+                    sender="ai",
+                    text=ai_response
+                )
+                db.add(ai_msg)
+                db.query(ConversationModel).filter(
+                    ConversationModel.id == conversation_id
+                ).update({ConversationModel.updated_at: datetime.utcnow()})
+                db.commit()
+                message_id = ai_msg.id
+            finally:
+                db.close()
+        conversation_summarizer.schedule(conversation_id)
+        if title_message:
+            conversation_titler.schedule(conversation_id, title_message)
+        return message_id
+    
+    async def events():
+        sources = plan.sources
+        parts = []
+        failed = False
+        try:
+            yield sse_event("sources", {
+                "sources": sources,
+                "chatbot_used": chatbot_name,
+                "context_chunks": plan.context_count,
+                "cached": plan.cached is not None
+            })
+            
+            prompt_tokens = groq_service.count_prompt_tokens(messages) if messages else None
+            if plan.reply:
+                parts.append(plan.reply)
+                yield sse_event("token", {"text": plan.reply})
+            else:
+                try:
+                    async for text in groq_service.stream_response(messages):
+                        parts.append(text)
+                        yield sse_event("token", {"text": text})
+                except Exception as e:
+                    print(f"Error generando respuesta en streaming: {str(e)}")
+                    failed = True
+                    if not parts:
+                        parts.append("Lo siento, no pude procesar tu mensaje.")
+                    yield sse_event("error", {"detail": "Error generando respuesta"})
+            
+            ai_response = "".join(parts).strip()
+            if plan.remember and not failed:
+                plan.remember(ai_response, sources, len(plan.context_chunks))
+            message_id = persist(ai_response)
+            
+            yield sse_event("done", {
+                "message_id": message_id,
+                "response": ai_response,
+                "sources": sources,
+                "complete": not failed,
+                "prompt_tokens": prompt_tokens,
+                "title_pending": title_message is not None
+            })
+        finally:
+            # Cliente desconectado antes del final: guardar la respuesta parcial
+            if not persisted:
+                persist("".join(parts).strip())
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 
@@ -705,6 +1177,35 @@ async def check_conversation_exists(
     return {"exists": conversation is not None}
 
 
+@router.get("/conversations/{conversation_id}/title", response_model=ConversationTitleOut)
+async def get_conversation_title(
+    current_user: Annotated[UserModel, Depends(get_current_user)],
+    conversation_id: int = Path(..., ge=1),
+    db: Session = Depends(get_db)
+):
+    """
+    Título de la conversación, para consultar cuándo está listo el generado
+    tras el primer mensaje (title_status pasa de 'pending' a 'ready')
+    """
+    
+    conversation = db.query(ConversationModel).filter(
+        ConversationModel.id == conversation_id,
+        ConversationModel.user_id == current_user.id
+    ).first()
+    
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversación no encontrada")
+    
+    # Pendiente pero no encolado (p. ej. tras un reinicio): volver a encolar
+    conversation_titler.resume(db, conversation)
+    
+    return ConversationTitleOut(
+        id=conversation.id,
+        title=conversation.title,
+        title_status=conversation.title_status
+    )
+
+
 @router.patch("/conversations/{conversation_id}")
 async def update_conversation(
     payload: dict,
@@ -726,6 +1227,8 @@ async def update_conversation(
     # Actualizar título si se proporciona
     if "title" in payload:
         conversation.title = payload["title"]
+        # Un título manual no se reemplaza por el generado
+        conversation.title_status = None
         conversation.updated_at = datetime.utcnow()
         db.commit()
         db.refresh(conversation)
@@ -1,17 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Path, Form, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Query, Response, Form, UploadFile, File
+from sqlalchemy import func, or_, and_, select
 from sqlalchemy.orm import Session
-from typing import Annotated, List, Optional
+from typing import Annotated, List, Literal, Optional
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import os
 import shutil
 import logging
 from pathlib import Path as FilePath
 
 from database import get_db
-from models import User as UserModel, CustomChatbot, ChatbotAccess, AccessLevel
+from models import User as UserModel, CustomChatbot, ChatbotAccess, ChatbotDocument, ChatbotSettings, AccessLevel
 from auth import get_current_user
 from services.pinecone_service import pinecone_service
+from services.embedding_service_pinecone import embedding_service
+from services.answer_cache import answer_cache
+from services.response_policy import response_policy
 
 router = APIRouter(prefix="/api/chatbots", tags=["Chatbots"])
 logger = logging.getLogger(__name__)
@@ -38,6 +42,31 @@ class ChatbotOut(BaseModel):
     documents_count: int = 0
     users_count: int = 0
 
+PolicyAction = Literal["template", "widen", "llm"]
+
+class ChatbotSettingsUpdate(BaseModel):
+    quick_replies_enabled: Optional[bool] = None
+    no_hits_action: Optional[PolicyAction] = None
+    low_score_action: Optional[PolicyAction] = None
+    widen_min_score: Optional[float] = Field(None, ge=0, le=1)
+    widen_top_k: Optional[int] = Field(None, ge=1, le=50)
+    no_context_template: Optional[str] = None
+    # None vuelve a los valores globales (TOP_K_RESULTS / RAG_MIN_SCORE)
+    top_k: Optional[int] = Field(None, ge=1, le=50)
+    min_score: Optional[float] = Field(None, ge=0, le=1)
+
+class ChatbotSettingsOut(BaseModel):
+    chatbot_id: int
+    quick_replies_enabled: bool
+    no_hits_action: str
+    low_score_action: str
+    widen_min_score: float
+    widen_top_k: int
+    no_context_template: Optional[str]
+    top_k: int
+    min_score: float
+    calibrated_at: Optional[datetime]
+
 class UserAccessCreate(BaseModel):
     user_ids: List[int]
     access_level: AccessLevel = AccessLevel.READ
@@ -78,7 +107,9 @@ async def create_chatbot(
             title=payload.title.strip(),
             description=payload.description,
             created_by=current_user.id,
-            pinecone_index_name=index_name
+            pinecone_index_name=index_name,
+            embedding_model=embedding_service.model_name,
+            embedding_dimension=pinecone_service.dimension
         )
         
         db.add(chatbot)
@@ -91,18 +122,7 @@ async def create_chatbot(
         
         logger.info(f"Chatbot {chatbot.id} creado exitosamente con índice {index_name}")
         
-        return ChatbotOut(
-            id=chatbot.id,
-            title=chatbot.title,
-            description=chatbot.description,
-            created_by=chatbot.created_by,
-            pinecone_index_name=chatbot.pinecone_index_name,
-            is_active=chatbot.is_active,
-            created_at=chatbot.created_at,
-            updated_at=chatbot.updated_at,
-            documents_count=0,
-            users_count=0
-        )
+        return _chatbot_out(chatbot, documents_count=0, users_count=0)
         
     except HTTPException:
         # Re-lanzar HTTPExceptions sin modificar
@@ -119,59 +139,105 @@ async def create_chatbot(
         )
 
 
+# Conteos por chatbot como subconsultas correlacionadas: se resuelven en la
+# misma consulta que los chatbots, con los índices por chatbot_id
+DOCUMENTS_COUNT = select(func.count(ChatbotDocument.id)).where(
+    ChatbotDocument.chatbot_id == CustomChatbot.id
+).correlate(CustomChatbot).scalar_subquery()
+
+PROCESSED_DOCUMENTS_COUNT = select(func.count(ChatbotDocument.id)).where(
+    ChatbotDocument.chatbot_id == CustomChatbot.id,
+    ChatbotDocument.is_processed == True
+).correlate(CustomChatbot).scalar_subquery()
+
+USERS_COUNT = select(func.count(ChatbotAccess.id)).where(
+    ChatbotAccess.chatbot_id == CustomChatbot.id
+).correlate(CustomChatbot).scalar_subquery()
+
+CHATBOT_SORT_COLUMNS = {
+    "updated_at": CustomChatbot.updated_at,
+    "created_at": CustomChatbot.created_at,
+    "title": CustomChatbot.title
+}
+
+
+def _chatbot_out(chatbot: CustomChatbot, documents_count: int, users_count: int) -> ChatbotOut:
+    return ChatbotOut(
+        id=chatbot.id,
+        title=chatbot.title,
+        description=chatbot.description,
+        created_by=chatbot.created_by,
+        pinecone_index_name=chatbot.pinecone_index_name,
+        is_active=chatbot.is_active,
+        created_at=chatbot.created_at,
+        updated_at=chatbot.updated_at,
+        documents_count=documents_count,
+        users_count=users_count
+    )
+
+
+def _chatbot_with_counts(db: Session, chatbot_id: int):
+    """(chatbot, documentos, documentos procesados, usuarios) en una sola consulta, o None"""
+    return db.query(
+        CustomChatbot, DOCUMENTS_COUNT, PROCESSED_DOCUMENTS_COUNT, USERS_COUNT
+    ).filter(CustomChatbot.id == chatbot_id).first()
+
+
+def _has_access(db: Session, chatbot: CustomChatbot, user: UserModel) -> bool:
+    return (
+        chatbot.created_by == user.id or
+        db.query(ChatbotAccess.id).filter(
+            ChatbotAccess.chatbot_id == chatbot.id,
+            ChatbotAccess.user_id == user.id
+        ).first() is not None
+    )
+
+
 @router.get("/", response_model=List[ChatbotOut])
 async def list_user_chatbots(
     current_user: Annotated[UserModel, Depends(get_current_user)],
+    response: Response,
+    sort: Literal["updated_at", "created_at", "title"] = "updated_at",
+    order: Literal["asc", "desc"] = "desc",
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    offset: int = Query(0, ge=0),
     db: Session = Depends(get_db)
 ):
-    """Listar chatbots accesibles para el usuario actual"""
-    
-    # Chatbots creados por el usuario
-    owned_chatbots = db.query(CustomChatbot).filter(
-        CustomChatbot.created_by == current_user.id
-    ).all()
-    
-    # Chatbots con acceso otorgado
-    access_records = db.query(ChatbotAccess).filter(
-        ChatbotAccess.user_id == current_user.id
-    ).all()
-    
-    accessible_ids = [access.chatbot_id for access in access_records]
-    accessible_chatbots = db.query(CustomChatbot).filter(
-        CustomChatbot.id.in_(accessible_ids),
-        CustomChatbot.is_active == True
-    ).all() if accessible_ids else []
-    
-    # Combinar y eliminar duplicados
-    all_chatbots = {cb.id: cb for cb in owned_chatbots + accessible_chatbots}.values()
-    
-    # Agregar conteos
-    result = []
-    for chatbot in all_chatbots:
-        # Contar documentos
-        docs_count = db.query(ChatbotDocument).filter(
-            ChatbotDocument.chatbot_id == chatbot.id
-        ).count()
-        
-        # Contar usuarios con acceso
-        users_count = db.query(ChatbotAccess).filter(
-            ChatbotAccess.chatbot_id == chatbot.id
-        ).count()
-        
-        result.append(ChatbotOut(
-            id=chatbot.id,
-            title=chatbot.title,
-            description=chatbot.description,
-            created_by=chatbot.created_by,
-            pinecone_index_name=chatbot.pinecone_index_name,
-            is_active=chatbot.is_active,
-            created_at=chatbot.created_at,
-            updated_at=chatbot.updated_at,
-            documents_count=docs_count,
-            users_count=users_count
-        ))
-    
-    return sorted(result, key=lambda x: x.updated_at, reverse=True)
+    """
+    Listar chatbots accesibles para el usuario actual: los propios y los
+    activos con acceso otorgado, con sus conteos de documentos y usuarios
+
+    Una sola consulta, ordenada y paginada en la BD. Con limit, el total de
+    chatbots accesibles se informa en el header X-Total-Count.
+    """
+    accessible = or_(
+        CustomChatbot.created_by == current_user.id,
+        and_(
+            CustomChatbot.is_active == True,
+            CustomChatbot.id.in_(
+                select(ChatbotAccess.chatbot_id).where(ChatbotAccess.user_id == current_user.id)
+            )
+        )
+    )
+
+    sort_column = CHATBOT_SORT_COLUMNS[sort]
+    sort_column = sort_column.asc() if order == "asc" else sort_column.desc()
+    query = db.query(CustomChatbot, DOCUMENTS_COUNT, USERS_COUNT).filter(accessible).order_by(
+        sort_column, CustomChatbot.id.asc() if order == "asc" else CustomChatbot.id.desc()
+    )
+
+    if limit is not None:
+        response.headers["X-Total-Count"] = str(
+            db.query(func.count(CustomChatbot.id)).filter(accessible).scalar()
+        )
+        query = query.offset(offset).limit(limit)
+    elif offset:
+        query = query.offset(offset)
+
+    return [
+        _chatbot_out(chatbot, documents_count, users_count)
+        for chatbot, documents_count, users_count in query.all()
+    ]
 
 
 @router.get("/{chatbot_id}", response_model=ChatbotOut)
@@ -182,46 +248,15 @@ async def get_chatbot(
 ):
     """Obtener detalles de un chatbot específico"""
     
-    chatbot = db.query(CustomChatbot).filter(
-        CustomChatbot.id == chatbot_id
-    ).first()
-    
-    if not chatbot:
+    row = _chatbot_with_counts(db, chatbot_id)
+    if not row:
         raise HTTPException(status_code=404, detail="Chatbot no encontrado")
     
-    # Verificar acceso
-    has_access = (
-        chatbot.created_by == current_user.id or
-        db.query(ChatbotAccess).filter(
-            ChatbotAccess.chatbot_id == chatbot_id,
-            ChatbotAccess.user_id == current_user.id
-        ).first() is not None
-    )
-    
-    if not has_access:
+    chatbot, docs_count, _, users_count = row
+    if not _has_access(db, chatbot, current_user):
         raise HTTPException(status_code=403, detail="No tiene acceso a este chatbot")
     
-    # Contar documentos y usuarios
-    docs_count = db.query(ChatbotDocument).filter(
-        ChatbotDocument.chatbot_id == chatbot_id
-    ).count()
-    
-    users_count = db.query(ChatbotAccess).filter(
-        ChatbotAccess.chatbot_id == chatbot_id
-    ).count()
-    
-    return ChatbotOut(
-        id=chatbot.id,
-        title=chatbot.title,
-        description=chatbot.description,
-        created_by=chatbot.created_by,
-        pinecone_index_name=chatbot.pinecone_index_name,
-        is_active=chatbot.is_active,
-        created_at=chatbot.created_at,
-        updated_at=chatbot.updated_at,
-        documents_count=docs_count,
-        users_count=users_count
-    )
+    return _chatbot_out(chatbot, docs_count, users_count)
 
 
 @router.put("/{chatbot_id}", response_model=ChatbotOut)
@@ -264,29 +299,10 @@ async def update_chatbot(
     chatbot.updated_at = datetime.utcnow()
     
     db.commit()
-    db.refresh(chatbot)
-    
-    # Contar documentos y usuarios
-    docs_count = db.query(ChatbotDocument).filter(
-        ChatbotDocument.chatbot_id == chatbot_id
-    ).count()
     
-    users_count = db.query(ChatbotAccess).filter(
-        ChatbotAccess.chatbot_id == chatbot_id
-    ).count()
-    
-    return ChatbotOut(
-        id=chatbot.id,
-        title=chatbot.title,
-        description=chatbot.description,
-        created_by=chatbot.created_by,
-        pinecone_index_name=chatbot.pinecone_index_name,
-        is_active=chatbot.is_active,
-        created_at=chatbot.created_at,
-        updated_at=chatbot.updated_at,
-        documents_count=docs_count,
-        users_count=users_count
-    )
+    # Chatbot actualizado y sus conteos
+    chatbot, docs_count, _, users_count = _chatbot_with_counts(db, chatbot_id)
+    return _chatbot_out(chatbot, docs_count, users_count)
 
 
 @router.delete("/{chatbot_id}", status_code=204)
@@ -309,6 +325,8 @@ async def delete_chatbot(
         raise HTTPException(status_code=403, detail="Solo el propietario puede eliminar el chatbot")
     
     index_name = chatbot.pinecone_index_name
+    # Índice nuevo de un re-index en curso (si cambió la dimensión)
+    shadow_index_name = chatbot.shadow_index_name if chatbot.shadow_index_name != index_name else None
     
     try:
         logger.info(f"Eliminando chatbot {chatbot_id} con índice {index_name}")
@@ -328,6 +346,7 @@ async def delete_chatbot(
         db.delete(chatbot)
         db.commit()
         logger.info(f"Chatbot {chatbot_id} eliminado de la base de datos")
+        answer_cache.invalidate(chatbot_id)
         
         # Intentar eliminar índice de Pinecone (no crítico si falla)
         pinecone_success = await pinecone_service.delete_index(index_name)
@@ -335,6 +354,8 @@ async def delete_chatbot(
             logger.info(f"Índice {index_name} eliminado de Pinecone")
         else:
             logger.warning(f"No se pudo eliminar el índice {index_name} de Pinecone")
+        if shadow_index_name:
+            await pinecone_service.delete_index(shadow_index_name)
         
         # Eliminar archivos de uploads
         upload_dir = FilePath("uploads") / f"chatbot_{chatbot_id}"
@@ -524,15 +545,22 @@ async def revoke_user_access(
 
 
 # Importar modelos que faltan para los documentos
-from models import ChatbotDocument
+from models import ChatbotDocument, IngestionJob, JobStatus
+from services.job_queue import job_queue
 
-@router.post("/{chatbot_id}/recreate-index", status_code=200)
+@router.post("/{chatbot_id}/recreate-index", status_code=202)
 async def recreate_pinecone_index(
     current_user: Annotated[UserModel, Depends(get_current_user)],
     chatbot_id: int = Path(..., ge=1),
     db: Session = Depends(get_db)
 ):
-    """Recrear el índice de Pinecone para un chatbot (solo propietario)"""
+    """
+    Re-indexar el chatbot (solo propietario)
+    
+    Encola un re-index blue/green: los vectores se reconstruyen en un destino
+    sombra y el chatbot cambia a él solo cuando está completo, por lo que
+    sigue respondiendo durante todo el proceso.
+    """
     
     chatbot = db.query(CustomChatbot).filter(
         CustomChatbot.id == chatbot_id
@@ -545,30 +573,149 @@ async def recreate_pinecone_index(
     if chatbot.created_by != current_user.id:
         raise HTTPException(status_code=403, detail="Solo el propietario puede recrear el índice")
     
-    try:
-        logger.info(f"Recreando índice Pinecone para chatbot {chatbot_id}")
-        
-        # Intentar eliminar índice existente (si existe)
-        await pinecone_service.delete_index(chatbot.pinecone_index_name)
-        
-        # Crear nuevo índice
-        success = await pinecone_service.create_index(chatbot.pinecone_index_name)
-        
-        if success:
-            logger.info(f"Índice {chatbot.pinecone_index_name} recreado exitosamente")
-            return {"message": "Índice recreado exitosamente", "index_name": chatbot.pinecone_index_name}
-        else:
-            raise HTTPException(
-                status_code=500,
-                detail="No se pudo recrear el índice de Pinecone"
-            )
-            
-    except Exception as e:
-        logger.error(f"Error recreando índice para chatbot {chatbot_id}: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error recreando índice: {str(e)}"
-        )
+    # No duplicar un re-index que ya está en cola o en ejecución
+    active_job = db.query(IngestionJob).filter(
+        IngestionJob.chatbot_id == chatbot_id,
+        IngestionJob.job_type == "reindex_chatbot",
+        IngestionJob.status.in_([JobStatus.PENDING, JobStatus.RUNNING])
+    ).first()
+    
+    if active_job:
+        return {"message": "Ya hay un re-index en curso", "job_id": active_job.id, "index_name": chatbot.pinecone_index_name}
+    
+    job = job_queue.enqueue(db, "reindex_chatbot", chatbot_id)
+    db.commit()
+    
+    logger.info(f"Re-index encolado para chatbot {chatbot_id} (trabajo {job.id})")
+    return {"message": "Re-index iniciado", "job_id": job.id, "index_name": chatbot.pinecone_index_name}
+
+def _verify_admin_access(chatbot_id: int, user: UserModel, db: Session) -> CustomChatbot:
+    """Chatbot del que el usuario es propietario o administrador"""
+    chatbot = db.query(CustomChatbot).filter(CustomChatbot.id == chatbot_id).first()
+    if not chatbot:
+        raise HTTPException(status_code=404, detail="Chatbot no encontrado")
+    
+    has_admin_access = (
+        chatbot.created_by == user.id or
+        db.query(ChatbotAccess).filter(
+            ChatbotAccess.chatbot_id == chatbot_id,
+            ChatbotAccess.user_id == user.id,
+            ChatbotAccess.access_level == AccessLevel.ADMIN
+        ).first() is not None
+    )
+    if not has_admin_access:
+        raise HTTPException(status_code=403, detail="Sin permisos para configurar este chatbot")
+    
+    return chatbot
+
+
+# Campos de la configuración que aceptan None (volver al valor por defecto)
+NULLABLE_SETTINGS = {"no_context_template", "top_k", "min_score"}
+
+
+def _settings_out(settings: ChatbotSettings) -> ChatbotSettingsOut:
+    top_k, min_score = response_policy.retrieval_params(settings)
+    return ChatbotSettingsOut(
+        chatbot_id=settings.chatbot_id,
+        quick_replies_enabled=settings.quick_replies_enabled,
+        no_hits_action=settings.no_hits_action,
+        low_score_action=settings.low_score_action,
+        widen_min_score=settings.widen_min_score,
+        widen_top_k=settings.widen_top_k,
+        no_context_template=settings.no_context_template,
+        top_k=top_k,
+        min_score=min_score,
+        calibrated_at=settings.calibrated_at
+    )
+
+
+@router.get("/{chatbot_id}/settings", response_model=ChatbotSettingsOut)
+async def get_chatbot_settings(
+    current_user: Annotated[UserModel, Depends(get_current_user)],
+    chatbot_id: int = Path(..., ge=1),
+    db: Session = Depends(get_db)
+):
+    """Política de respuesta del chatbot (valores por defecto si nunca se configuró)"""
+    
+    chatbot = _verify_admin_access(chatbot_id, current_user, db)
+    return _settings_out(chatbot.settings or ChatbotSettings.with_defaults(chatbot_id))
+
+
+@router.put("/{chatbot_id}/settings", response_model=ChatbotSettingsOut)
+async def update_chatbot_settings(
+    payload: ChatbotSettingsUpdate,
+    current_user: Annotated[UserModel, Depends(get_current_user)],
+    chatbot_id: int = Path(..., ge=1),
+    db: Session = Depends(get_db)
+):
+    """
+    Actualizar la política de respuesta del chatbot (propietario o admin)
+    
+    Define cuándo se responde con una plantilla, cuándo se amplía la búsqueda
+    y cuándo se llama al LLM si ningún chunk pasa el umbral de relevancia.
+    Fijar top_k o min_score a mano descarta la calibración automática.
+    """
+    
+    chatbot = _verify_admin_access(chatbot_id, current_user, db)
+    
+    settings = chatbot.settings
+    if settings is None:
+        settings = ChatbotSettings.with_defaults(chatbot_id)
+        db.add(settings)
+    
+    changes = payload.model_dump(exclude_unset=True)
+    for field_name, value in changes.items():
+        if value is None and field_name not in NULLABLE_SETTINGS:
+            continue
+        setattr(settings, field_name, value)
+    
+    if "top_k" in changes or "min_score" in changes:
+        settings.calibrated_at = None
+        settings.calibration_stats = None
+    
+    db.commit()
+    db.refresh(settings)
+    
+    logger.info(f"Política de respuesta actualizada para chatbot {chatbot_id}")
+    return _settings_out(settings)
+
+
+@router.post("/{chatbot_id}/calibrate-retrieval", status_code=202)
+async def calibrate_retrieval(
+    current_user: Annotated[UserModel, Depends(get_current_user)],
+    chatbot_id: int = Path(..., ge=1),
+    allow_stricter: bool = Query(False),
+    db: Session = Depends(get_db)
+):
+    """
+    Calibrar top_k y umbral de score del chatbot (propietario o admin)
+    
+    Encola un trabajo que mide la distribución de scores del namespace con
+    preguntas sintéticas y guarda los parámetros en la configuración. Salvo
+    con allow_stricter, solo puede bajar el umbral y subir top_k respecto de
+    los valores por defecto.
+    """
+    
+    _verify_admin_access(chatbot_id, current_user, db)
+    
+    active_job = db.query(IngestionJob).filter(
+        IngestionJob.chatbot_id == chatbot_id,
+        IngestionJob.job_type == "calibrate_retrieval",
+        IngestionJob.status.in_([JobStatus.PENDING, JobStatus.RUNNING])
+    ).first()
+    
+    if active_job:
+        return {"message": "Ya hay una calibración en curso", "job_id": active_job.id}
+    
+    job = job_queue.enqueue(
+        db, "calibrate_retrieval", chatbot_id,
+        payload={"allow_stricter": True} if allow_stricter else None
+    )
+    db.commit()
+    
+    logger.info(f"Calibración de búsqueda encolada para chatbot {chatbot_id} (trabajo {job.id})")
+    return {"message": "Calibración iniciada", "job_id": job.id}
+
 
 @router.get("/debug/pinecone-status")
 async def get_pinecone_status(
@@ -607,39 +754,15 @@ async def get_chatbot_stats(
 ):
     """Obtener estadísticas del chatbot"""
     
-    chatbot = db.query(CustomChatbot).filter(
-        CustomChatbot.id == chatbot_id
-    ).first()
-    
-    if not chatbot:
+    # Chatbot y conteos en una sola consulta
+    row = _chatbot_with_counts(db, chatbot_id)
+    if not row:
         raise HTTPException(status_code=404, detail="Chatbot no encontrado")
     
-    # Verificar acceso
-    has_access = (
-        chatbot.created_by == current_user.id or
-        db.query(ChatbotAccess).filter(
-            ChatbotAccess.chatbot_id == chatbot_id,
-            ChatbotAccess.user_id == current_user.id
-        ).first() is not None
-    )
-    
-    if not has_access:
+    chatbot, docs_count, processed_docs, users_count = row
+    if not _has_access(db, chatbot, current_user):
         raise HTTPException(status_code=403, detail="No tiene acceso a este chatbot")
     
-    # Obtener estadísticas
-    docs_count = db.query(ChatbotDocument).filter(
-        ChatbotDocument.chatbot_id == chatbot_id
-    ).count()
-    
-    processed_docs = db.query(ChatbotDocument).filter(
-        ChatbotDocument.chatbot_id == chatbot_id,
-        ChatbotDocument.is_processed == True
-    ).count()
-    
-    users_count = db.query(ChatbotAccess).filter(
-        ChatbotAccess.chatbot_id == chatbot_id
-    ).count()
-    
     # Estadísticas de Pinecone
     pinecone_stats = await pinecone_service.get_index_stats(chatbot.pinecone_index_name)
     
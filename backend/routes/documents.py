@@ -1,22 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Path, UploadFile, File, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Query, UploadFile, File
 from sqlalchemy.orm import Session
-from typing import Annotated, List, Optional
+from typing import Annotated, Dict, List, Optional
 from datetime import datetime
 from pydantic import BaseModel
 import os
+import asyncio
+import zipfile
 import aiofiles
-from pathlib import Path as FilePath
+from pathlib import Path as FilePath, PurePosixPath
 
 from database import get_db
-from models import User as UserModel, CustomChatbot, ChatbotDocument, ChatbotAccess, AccessLevel
+from models import (
+    User as UserModel,
+    CustomChatbot,
+    ChatbotDocument,
+    ChatbotAccess,
+    AccessLevel,
+    IngestionJob,
+    JobStatus,
+    DocumentProcessing
+)
 from auth import get_current_user
 from main import get_current_user
 from services.pinecone_service import pinecone_service
 from services.document_processor import document_processor
-from services.embedding_service_pinecone import embedding_service
+from services.job_queue import job_queue
+from services.chatbot_profile import chatbot_profiles
+from services import ingestion_progress
 
 router = APIRouter(prefix="/api/chatbots/{chatbot_id}/documents", tags=["Documents"])
 
+# Tamaño de bloque para escribir uploads a disco
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
 # Pydantic Models
 class DocumentOut(BaseModel):
     id: int
@@ -30,12 +46,63 @@ class DocumentOut(BaseModel):
     uploaded_at: datetime
     uploader_email: Optional[str] = None
 
+class ZipUploadOut(BaseModel):
+    documents: List[DocumentOut]
+    errors: List[str] = []
+    job_id: Optional[int] = None
+
 class ProcessingStatus(BaseModel):
     document_id: int
     filename: str
-    status: str  # 'pending', 'processing', 'completed', 'failed'
+    status: str  # 'pending', 'processing', 'retrying', 'completed', 'failed'
     chunks_created: int = 0
     error_message: Optional[str] = None
+    stage: Optional[str] = None  # 'extract', 'chunk', 'embed', 'upsert'
+    chunks_done: int = 0
+    chunks_total: Optional[int] = None
+    checkpoint_chunks: int = 0  # Chunks ya confirmados desde donde retoma un reintento
+    stage_timings: Dict[str, float] = {}
+    attempts: int = 0
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class ChatbotProcessingStatus(BaseModel):
+    chatbot_id: int
+    documents: int
+    by_status: Dict[str, int]
+    chunks_done: int
+    chunks_total: int
+    stage_seconds_total: Dict[str, float]
+    stage_seconds_avg: Dict[str, float]
+    slowest_stage: Optional[str] = None
+    failures: List[ProcessingStatus] = []
+
+class JobOut(BaseModel):
+    id: int
+    job_type: str
+    document_id: Optional[int]
+    status: JobStatus
+    attempts: int
+    max_attempts: int
+    run_after: datetime
+    last_error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+def _job_out(job: IngestionJob) -> JobOut:
+    return JobOut(
+        id=job.id,
+        job_type=job.job_type,
+        document_id=job.document_id,
+        status=job.status,
+        attempts=job.attempts,
+        max_attempts=job.max_attempts,
+        run_after=job.run_after,
+        last_error=job.last_error,
+        created_at=job.created_at,
+        finished_at=job.finished_at
+    )
 
 
 async def verify_chatbot_access(
@@ -78,7 +145,6 @@ async def verify_chatbot_access(
 
 @router.post("/upload", response_model=List[DocumentOut], status_code=201)
 async def upload_documents(
-    background_tasks: BackgroundTasks,
     current_user: Annotated[UserModel, Depends(get_current_user)],
     chatbot_id: int = Path(..., ge=1),
     files: List[UploadFile] = File(...),
@@ -108,20 +174,29 @@ async def upload_documents(
                 errors.append(f"{file.filename}: Tipo de archivo no soportado")
                 continue
             
-            # Leer contenido para verificar tamaño
-            content = await file.read()
-            if len(content) > max_file_size:
-                errors.append(f"{file.filename}: Archivo demasiado grande (máximo {max_file_size // (1024*1024)}MB)")
-                continue
-            
             # Generar nombre único para evitar colisiones
             file_extension = FilePath(file.filename).suffix
             unique_filename = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
             file_path = upload_dir / unique_filename
             
-            # Guardar archivo
+            # Guardar archivo por bloques, verificando el tamaño sin cargarlo completo en memoria
+            file_size = 0
+            too_large = False
             async with aiofiles.open(file_path, 'wb') as f:
-                await f.write(content)
+                while True:
+                    block = await file.read(UPLOAD_BLOCK_SIZE)
+                    if not block:
+                        break
+                    file_size += len(block)
+                    if file_size > max_file_size:
+                        too_large = True
+                        break
+                    await f.write(block)
+            
+            if too_large:
+                file_path.unlink(missing_ok=True)
+                errors.append(f"{file.filename}: Archivo demasiado grande (máximo {max_file_size // (1024*1024)}MB)")
+                continue
             
             # Crear registro en base de datos
             doc_record = ChatbotDocument(
@@ -129,7 +204,7 @@ async def upload_documents(
                 filename=unique_filename,
                 original_filename=file.filename,
                 file_path=str(file_path),
-                file_size=len(content),
+                file_size=file_size,
                 file_type=file_extension.lower(),
                 uploaded_by=current_user.id
             )
@@ -137,12 +212,9 @@ async def upload_documents(
             db.add(doc_record)
             db.flush()  # Para obtener el ID
             
-            # Programar procesamiento en background
-            background_tasks.add_task(
-                process_document_background,
-                doc_record.id,
-                chatbot_id
-            )
+            # Encolar procesamiento (se confirma en la misma transacción que el documento)
+            job_queue.enqueue(db, "process_document", chatbot_id, document_id=doc_record.id)
+            ingestion_progress.mark_queued(db, doc_record)
             
             uploaded_docs.append(DocumentOut(
                 id=doc_record.id,
@@ -175,6 +247,177 @@ async def upload_documents(
     return uploaded_docs
 
 
+def _extract_zip_entries(
+    archive_file,
+    upload_dir: FilePath,
+    max_file_size: int,
+    max_files: int,
+    max_total_size: int
+):
+    """
+    Descomprime las entradas válidas de un ZIP a disco, una a la vez y por
+    bloques, sin cargar ningún archivo completo en memoria
+
+    Los límites se verifican sobre los bytes realmente descomprimidos, no sobre
+    los tamaños declarados en el ZIP.
+
+    Returns:
+        Tuple con la lista de archivos guardados (nombre único, nombre original,
+        ruta, tamaño) y la lista de errores
+    """
+    saved = []
+    errors = []
+    total_size = 0
+    timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+
+    with zipfile.ZipFile(archive_file) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+
+            # Solo el nombre base: evita rutas fuera del directorio de uploads
+            original_filename = PurePosixPath(info.filename.replace("\\", "/")).name
+            if not original_filename or original_filename.startswith(".") or info.filename.startswith("__MACOSX/"):
+                continue
+
+            if not document_processor.is_valid_file_type(original_filename):
+                errors.append(f"{info.filename}: Tipo de archivo no soportado")
+                continue
+
+            if len(saved) >= max_files:
+                errors.append(f"El ZIP supera el máximo de {max_files} archivos; se omitieron los restantes")
+                break
+
+            if info.file_size > max_file_size:
+                errors.append(f"{info.filename}: Archivo demasiado grande (máximo {max_file_size // (1024*1024)}MB)")
+                continue
+
+            unique_filename = f"{timestamp}_{len(saved):04d}_{original_filename}"
+            file_path = upload_dir / unique_filename
+            file_size = 0
+            error = None
+
+            try:
+                with archive.open(info) as source, open(file_path, 'wb') as target:
+                    while True:
+                        block = source.read(UPLOAD_BLOCK_SIZE)
+                        if not block:
+                            break
+                        file_size += len(block)
+                        if file_size > max_file_size:
+                            error = f"Archivo demasiado grande (máximo {max_file_size // (1024*1024)}MB)"
+                            break
+                        if total_size + file_size > max_total_size:
+                            error = f"El contenido del ZIP supera {max_total_size // (1024*1024)}MB"
+                            break
+                        target.write(block)
+            except (zipfile.BadZipFile, RuntimeError, OSError) as e:
+                error = f"Error descomprimiendo archivo - {str(e)}"
+
+            if error:
+                file_path.unlink(missing_ok=True)
+                errors.append(f"{info.filename}: {error}")
+                if total_size + file_size > max_total_size:
+                    break
+                continue
+
+            total_size += file_size
+            saved.append((unique_filename, original_filename, file_path, file_size))
+
+    return saved, errors
+
+
+@router.post("/upload-zip", response_model=ZipUploadOut, status_code=201)
+async def upload_zip_archive(
+    current_user: Annotated[UserModel, Depends(get_current_user)],
+    chatbot_id: int = Path(..., ge=1),
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Subir un ZIP con documentos al chatbot
+
+    Las entradas se descomprimen una a una a disco, los documentos se crean
+    con un solo insert y se procesan en un único trabajo por lotes.
+    """
+    
+    # Verificar acceso de escritura
+    chatbot = await verify_chatbot_access(chatbot_id, current_user, db, AccessLevel.WRITE)
+    
+    if not file.filename or not file.filename.lower().endswith(".zip"):
+        raise HTTPException(status_code=400, detail="Debe proporcionar un archivo .zip")
+    
+    max_file_size = int(os.getenv("MAX_FILE_SIZE_MB", "50")) * 1024 * 1024
+    max_files = int(os.getenv("MAX_ZIP_FILES", "500"))
+    max_total_size = int(os.getenv("MAX_ZIP_TOTAL_SIZE_MB", "1024")) * 1024 * 1024
+    
+    # Crear directorio de uploads
+    upload_dir = FilePath("uploads") / f"chatbot_{chatbot_id}"
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    
+    # El archivo subido ya está en un temporal en disco; la descompresión corre en un hilo
+    try:
+        saved, errors = await asyncio.to_thread(
+            _extract_zip_entries, file.file, upload_dir, max_file_size, max_files, max_total_size
+        )
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="El archivo no es un ZIP válido")
+    
+    if not saved:
+        raise HTTPException(
+            status_code=400,
+            detail={"uploaded": [], "errors": errors or ["El ZIP no contiene documentos soportados"]}
+        )
+    
+    try:
+        doc_records = [
+            ChatbotDocument(
+                chatbot_id=chatbot_id,
+                filename=unique_filename,
+                original_filename=original_filename,
+                file_path=str(file_path),
+                file_size=file_size,
+                file_type=FilePath(original_filename).suffix.lower(),
+                uploaded_by=current_user.id
+            )
+            for unique_filename, original_filename, file_path, file_size in saved
+        ]
+        db.add_all(doc_records)
+        db.flush()  # Un solo INSERT para todos los documentos
+        
+        ingestion_progress.create_queued_records(db, doc_records)
+        job = job_queue.enqueue(
+            db, "process_batch", chatbot_id,
+            payload={"document_ids": [doc.id for doc in doc_records]}
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        for _, _, file_path, _ in saved:
+            file_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=500, detail=f"Error registrando documentos: {str(e)}")
+    
+    return ZipUploadOut(
+        documents=[
+            DocumentOut(
+                id=doc.id,
+                filename=doc.filename,
+                original_filename=doc.original_filename,
+                file_size=doc.file_size,
+                file_type=doc.file_type,
+                chunks_count=0,
+                is_processed=False,
+                processed_at=None,
+                uploaded_at=doc.uploaded_at,
+                uploader_email=current_user.email
+            )
+            for doc in doc_records
+        ],
+        errors=errors,
+        job_id=job.id
+    )
+
+
 @router.get("/", response_model=List[DocumentOut])
 async def list_documents(
     current_user: Annotated[UserModel, Depends(get_current_user)],
@@ -233,23 +476,29 @@ async def delete_document(
         raise HTTPException(status_code=404, detail="Documento no encontrado")
     
     try:
-        # Eliminar vectores de Pinecone si el documento fue procesado
-        if document.is_processed and document.chunks_count > 0:
+        # Eliminar vectores de Pinecone del documento procesado (o los que dejó un checkpoint)
+        chunks_in_pinecone = document.chunks_count if document.is_processed else (
+            document.processing.checkpoint_chunks if document.processing else 0
+        )
+        if chunks_in_pinecone:
             # Generar IDs de vectores basados en el documento
-            vector_ids = [f"doc_{document.id}_chunk_{i}" for i in range(document.chunks_count)]
-            await pinecone_service.delete_vectors(
-                chatbot.pinecone_index_name,
-                vector_ids,
-                namespace=f"chatbot_{chatbot_id}"
-            )
+            vector_ids = [f"doc_{document.id}_chunk_{i}" for i in range(chunks_in_pinecone)]
+            # Incluye el destino sombra si hay un re-index en curso
+            for index_name, namespace in chatbot.vector_targets():
+                await pinecone_service.delete_vectors(index_name, vector_ids, namespace=namespace)
         
-        # Eliminar archivo físico
+        # Eliminar archivo físico y su cache de extracción
         file_path = FilePath(document.file_path)
         if file_path.exists():
             file_path.unlink()
+        document_processor.delete_extraction_cache(document.file_path)
         
-        # Eliminar de base de datos
+        # Eliminar de base de datos; el perfil del chatbot se recalcula sin el documento
+        was_processed = document.is_processed
         db.delete(document)
+        if was_processed:
+            chatbot_profiles.invalidate(db, chatbot_id)
+            chatbot_profiles.schedule(db, chatbot_id)
         db.commit()
         
     except Exception as e:
@@ -262,12 +511,18 @@ async def delete_document(
 
 @router.post("/process", status_code=202)
 async def process_all_documents(
-    background_tasks: BackgroundTasks,
     current_user: Annotated[UserModel, Depends(get_current_user)],
     chatbot_id: int = Path(..., ge=1),
+    mode: str = Query("batch", pattern="^(batch|per_document)$"),
     db: Session = Depends(get_db)
 ):
-    """Procesar todos los documentos pendientes del chatbot"""
+    """
+    Procesar todos los documentos pendientes del chatbot
+    
+    En modo 'batch' los documentos se agrupan en trabajos por lotes que
+    empaquetan los chunks de varios archivos en llamadas de embeddings y
+    upserts completas; 'per_document' encola un trabajo por documento.
+    """
     
     # Verificar acceso de escritura
     chatbot = await verify_chatbot_access(chatbot_id, current_user, db, AccessLevel.WRITE)
@@ -276,25 +531,113 @@ async def process_all_documents(
     pending_docs = db.query(ChatbotDocument).filter(
         ChatbotDocument.chatbot_id == chatbot_id,
         ChatbotDocument.is_processed == False
-    ).all()
+    ).order_by(ChatbotDocument.id.asc()).all()
     
     if not pending_docs:
         return {"message": "No hay documentos pendientes de procesar"}
     
-    # Programar procesamiento en background
-    for doc in pending_docs:
-        background_tasks.add_task(
-            process_document_background,
-            doc.id,
-            chatbot_id
-        )
+    # Encolar procesamiento, sin duplicar documentos que ya tienen un trabajo activo
+    already_queued = set(job_queue.active_document_ids(db, [doc.id for doc in pending_docs]))
+    to_queue = [doc for doc in pending_docs if doc.id not in already_queued]
+    jobs = []
+    
+    if mode == "batch":
+        max_documents = int(os.getenv("INGESTION_BATCH_MAX_DOCUMENTS", "100"))
+        for i in range(0, len(to_queue), max_documents):
+            batch = to_queue[i:i + max_documents]
+            jobs.append(job_queue.enqueue(
+                db, "process_batch", chatbot_id,
+                payload={"document_ids": [doc.id for doc in batch]}
+            ))
+    else:
+        for doc in to_queue:
+            jobs.append(job_queue.enqueue(db, "process_document", chatbot_id, document_id=doc.id))
+    
+    for doc in to_queue:
+        ingestion_progress.mark_queued(db, doc)
+    db.commit()
     
     return {
         "message": f"Procesamiento iniciado para {len(pending_docs)} documentos",
-        "document_ids": [doc.id for doc in pending_docs]
+        "mode": mode,
+        "document_ids": [doc.id for doc in pending_docs],
+        "job_ids": [job.id for job in jobs]
     }
 
 
+@router.get("/jobs", response_model=List[JobOut])
+async def list_ingestion_jobs(
+    current_user: Annotated[UserModel, Depends(get_current_user)],
+    chatbot_id: int = Path(..., ge=1),
+    status_filter: Optional[JobStatus] = None,
+    db: Session = Depends(get_db)
+):
+    """Listar trabajos de ingesta del chatbot (incluye dead-letter)"""
+    
+    # Verificar acceso de escritura
+    chatbot = await verify_chatbot_access(chatbot_id, current_user, db, AccessLevel.WRITE)
+    
+    query = db.query(IngestionJob).filter(IngestionJob.chatbot_id == chatbot_id)
+    if status_filter is not None:
+        query = query.filter(IngestionJob.status == status_filter)
+    
+    jobs = query.order_by(IngestionJob.created_at.desc()).limit(200).all()
+    return [_job_out(job) for job in jobs]
+
+
+@router.post("/jobs/{job_id}/retry", response_model=JobOut)
+async def retry_ingestion_job(
+    current_user: Annotated[UserModel, Depends(get_current_user)],
+    chatbot_id: int = Path(..., ge=1),
+    job_id: int = Path(..., ge=1),
+    db: Session = Depends(get_db)
+):
+    """Reencolar un trabajo en dead-letter"""
+    
+    # Verificar acceso de escritura
+    chatbot = await verify_chatbot_access(chatbot_id, current_user, db, AccessLevel.WRITE)
+    
+    job = db.query(IngestionJob).filter(
+        IngestionJob.id == job_id,
+        IngestionJob.chatbot_id == chatbot_id
+    ).first()
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    
+    if job.status != JobStatus.DEAD:
+        raise HTTPException(status_code=400, detail="Solo se pueden reintentar trabajos en dead-letter")
+    
+    return _job_out(job_queue.requeue(db, job))
+
+
+@router.get("/status", response_model=ChatbotProcessingStatus)
+async def get_chatbot_processing_status(
+    current_user: Annotated[UserModel, Depends(get_current_user)],
+    chatbot_id: int = Path(..., ge=1),
+    db: Session = Depends(get_db)
+):
+    """Obtener el estado de procesamiento agregado de los documentos del chatbot"""
+    
+    # Verificar acceso
+    chatbot = await verify_chatbot_access(chatbot_id, current_user, db, AccessLevel.READ)
+    
+    rows = db.query(DocumentProcessing, ChatbotDocument).join(
+        ChatbotDocument, ChatbotDocument.id == DocumentProcessing.document_id
+    ).filter(
+        DocumentProcessing.chatbot_id == chatbot_id
+    ).all()
+    
+    summary = ingestion_progress.summarize_chatbot([record for record, _ in rows])
+    failures = [
+        _processing_status(document, record)
+        for record, document in rows
+        if record.status in ("failed", "retrying")
+    ]
+    
+    return ChatbotProcessingStatus(chatbot_id=chatbot_id, failures=failures, **summary)
+
+
 @router.get("/{document_id}/status", response_model=ProcessingStatus)
 async def get_document_status(
     current_user: Annotated[UserModel, Depends(get_current_user)],
@@ -315,135 +658,40 @@ async def get_document_status(
     if not document:
         raise HTTPException(status_code=404, detail="Documento no encontrado")
     
-    # Determinar estado
-    if document.is_processed:
-        status = "completed"
-    elif document.processed_at is not None:
-        status = "failed"  # Procesado pero sin éxito
-    else:
-        status = "pending"
+    return _processing_status(document, document.processing)
+
+
+def _processing_status(document: ChatbotDocument, record: Optional[DocumentProcessing]) -> ProcessingStatus:
+    """Arma el estado de procesamiento a partir del registro de progreso"""
+    
+    if record is None:
+        # Documentos anteriores a los registros de progreso: inferir estado
+        if document.is_processed:
+            status = "completed"
+        elif document.processed_at is not None:
+            status = "failed"  # Procesado pero sin éxito
+        else:
+            status = "pending"
+        
+        return ProcessingStatus(
+            document_id=document.id,
+            filename=document.original_filename,
+            status=status,
+            chunks_created=document.chunks_count
+        )
     
     return ProcessingStatus(
         document_id=document.id,
         filename=document.original_filename,
-        status=status,
+        status=record.status,
         chunks_created=document.chunks_count,
-        error_message=None  # TODO: agregar campo de error en el modelo
+        error_message=record.error_message,
+        stage=record.stage,
+        chunks_done=record.chunks_done or 0,
+        chunks_total=record.chunks_total,
+        checkpoint_chunks=record.checkpoint_chunks or 0,
+        stage_timings=ingestion_progress.parse_timings(record),
+        attempts=record.attempts or 0,
+        started_at=record.started_at,
+        finished_at=record.finished_at
     )
-
-
-async def process_document_background(document_id: int, chatbot_id: int):
-    """Procesar documento en background"""
-    from database import SessionLocal
-    
-    db = SessionLocal()
-    try:
-        # Obtener documento y chatbot
-        document = db.query(ChatbotDocument).filter(
-            ChatbotDocument.id == document_id
-        ).first()
-        
-        if not document:
-            return
-        
-        chatbot = db.query(CustomChatbot).filter(
-            CustomChatbot.id == chatbot_id
-        ).first()
-        
-        if not chatbot:
-            return
-        
-        print(f"Procesando documento: {document.original_filename}")
-        
-        # Extraer texto del documento
-        extraction_result = await document_processor.extract_text_from_file(
-            document.file_path
-        )
-        
-        if not extraction_result.get("success"):
-            print(f"Error extrayendo texto: {extraction_result.get('error')}")
-            document.processed_at = datetime.utcnow()
-            db.commit()
-            return
-        
-        text_content = extraction_result.get("text", "")
-        if not text_content.strip():
-            print("Documento sin contenido de texto")
-            document.processed_at = datetime.utcnow()
-            db.commit()
-            return
-        
-        # Crear chunks del texto
-        metadata = {
-            "source": document.original_filename,
-            "chatbot_id": chatbot_id,
-            "document_id": document_id,
-            "file_type": document.file_type
-        }
-        
-        chunks = document_processor.create_text_chunks(text_content, metadata)
-        
-        if not chunks:
-            print("No se pudieron crear chunks del documento")
-            document.processed_at = datetime.utcnow()
-            db.commit()
-            return
-        
-        # Generar embeddings para cada chunk
-        chunk_texts = [chunk["text"] for chunk in chunks]
-        embeddings = await embedding_service.generate_embeddings(chunk_texts)
-        
-        if not embeddings or len(embeddings) != len(chunks):
-            print("Error generando embeddings")
-            document.processed_at = datetime.utcnow()
-            db.commit()
-            return
-        
-        # Preparar vectores para Pinecone
-        vectors = []
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            vector_id = f"doc_{document_id}_chunk_{i}"
-            
-            vector_metadata = {
-                **chunk["metadata"],
-                "text": chunk["text"],
-                "chunk_number": chunk["chunk_number"],
-                "char_count": chunk["char_count"],
-                "word_count": chunk["word_count"]
-            }
-            
-            vectors.append({
-                "id": vector_id,
-                "values": embedding,
-                "metadata": vector_metadata
-            })
-        
-        # Subir a Pinecone
-        success = await pinecone_service.upsert_vectors(
-            chatbot.pinecone_index_name,
-            vectors,
-            namespace=f"chatbot_{chatbot_id}"
-        )
-        
-        if success:
-            # Marcar como procesado
-            document.is_processed = True
-            document.chunks_count = len(chunks)
-            document.processed_at = datetime.utcnow()
-            
-            print(f"Documento procesado exitosamente: {len(chunks)} chunks creados")
-        else:
-            print("Error subiendo vectores a Pinecone")
-            document.processed_at = datetime.utcnow()
-        
-        db.commit()
-        
-    except Exception as e:
-        print(f"Error procesando documento {document_id}: {str(e)}")
-        # Marcar como intentado (para evitar reprocesamiento infinito)
-        if document:
-            document.processed_at = datetime.utcnow()
-            db.commit()
-        
-    finally:
-        db.close()
\ No newline at end of file
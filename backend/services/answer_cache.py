@@ -0,0 +1,181 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from models import ChatbotDocument
+from .metrics import metrics
+
+load_dotenv()
+
+
+@dataclass
+class CachedAnswer:
+    """Respuesta guardada junto con el embedding (normalizado) de su pregunta"""
+    question: str
+    embedding: List[float]
+    response: str
+    sources: List[str]
+    context_chunks: int
+    # Segundos que tomó generar la respuesta original (búsqueda + LLM)
+    generation_seconds: float
+    created_at: float = field(default_factory=time.monotonic)
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm else list(vector)
+
+
+def corpus_fingerprint(db: Session, chatbot_id: int) -> str:
+    """
+    Huella de los documentos procesados del chatbot (cantidad y último
+    procesamiento). Cambia al procesar, re-procesar o eliminar documentos.
+    """
+    count, last_processed = db.query(
+        func.count(ChatbotDocument.id),
+        func.max(ChatbotDocument.processed_at)
+    ).filter(
+        ChatbotDocument.chatbot_id == chatbot_id,
+        ChatbotDocument.is_processed == True
+    ).one()
+    return f"{count}:{last_processed.isoformat() if last_processed else ''}"
+
+
+class AnswerCache:
+    """
+    Caché semántica de respuestas por chatbot
+
+    Una pregunta nueva reutiliza la respuesta de una pregunta anterior si la
+    similitud coseno de sus embeddings supera el umbral. Las entradas de un
+    chatbot se descartan completas cuando cambia la huella de sus documentos,
+    y cada una vence por TTL; al llenarse se elimina la usada hace más tiempo.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.95,
+        ttl_seconds: float = 3600,
+        max_entries: int = 200,
+        enabled: bool = True
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries: Dict[int, "OrderedDict[int, CachedAnswer]"] = {}
+        self._fingerprints: Dict[int, str] = {}
+        self._next_key = 0
+
+    def _chatbot_entries(self, chatbot_id: int, fingerprint: str) -> "OrderedDict[int, CachedAnswer]":
+        """Entradas vigentes del chatbot (invalida si cambiaron los documentos)"""
+        if self._fingerprints.get(chatbot_id) != fingerprint:
+            if chatbot_id in self._entries:
+                metrics.increment("answer_cache_invalidations_total")
+            self._entries[chatbot_id] = OrderedDict()
+            self._fingerprints[chatbot_id] = fingerprint
+
+        entries = self._entries[chatbot_id]
+        now = time.monotonic()
+        for key in [key for key, entry in entries.items() if now - entry.created_at > self.ttl_seconds]:
+            del entries[key]
+        return entries
+
+    def lookup(self, chatbot_id: int, fingerprint: str, embedding: List[float]) -> Optional[CachedAnswer]:
+        """
+        Busca una respuesta para una pregunta similar
+
+        Returns:
+            CachedAnswer o None si no hay ninguna sobre el umbral
+        """
+        if not self.enabled or not embedding:
+            return None
+
+        query = _normalize(embedding)
+        with self._lock:
+            entries = self._chatbot_entries(chatbot_id, fingerprint)
+            best_key, best_score = None, self.similarity_threshold
+            for key, entry in entries.items():
+                score = sum(a * b for a, b in zip(query, entry.embedding))
+                if score >= best_score:
+                    best_key, best_score = key, score
+
+            if best_key is None:
+                metrics.increment("answer_cache_misses_total")
+                return None
+
+            entries.move_to_end(best_key)
+            entry = entries[best_key]
+
+        metrics.increment("answer_cache_hits_total")
+        metrics.increment("answer_cache_saved_seconds_total", entry.generation_seconds)
+        return entry
+
+    def store(
+        self,
+        chatbot_id: int,
+        fingerprint: str,
+        question: str,
+        embedding: List[float],
+        response: str,
+        sources: List[str],
+        context_chunks: int,
+        generation_seconds: float
+    ) -> None:
+        """Guarda una respuesta generada para reutilizarla en preguntas similares"""
+        if not self.enabled or not embedding:
+            return
+
+        entry = CachedAnswer(
+            question=question,
+            embedding=_normalize(embedding),
+            response=response,
+            sources=list(sources),
+            context_chunks=context_chunks,
+            generation_seconds=generation_seconds
+        )
+        with self._lock:
+            entries = self._chatbot_entries(chatbot_id, fingerprint)
+            self._next_key += 1
+            entries[self._next_key] = entry
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def invalidate(self, chatbot_id: int) -> None:
+        """Descarta todas las respuestas del chatbot"""
+        with self._lock:
+            self._entries.pop(chatbot_id, None)
+            self._fingerprints.pop(chatbot_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        """Tasa de aciertos, tiempo ahorrado y tamaño actual de la caché"""
+        snapshot = metrics.snapshot()["counters"]
+        hits = snapshot.get("answer_cache_hits_total", 0)
+        misses = snapshot.get("answer_cache_misses_total", 0)
+        with self._lock:
+            size = sum(len(entries) for entries in self._entries.values())
+        return {
+            "enabled": self.enabled,
+            "entries": size,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+            "saved_seconds": round(snapshot.get("answer_cache_saved_seconds_total", 0), 3)
+        }
+
+
+# Instancia global
+answer_cache = AnswerCache(
+    similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95")),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600")),
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "200")),
+    enabled=os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+)
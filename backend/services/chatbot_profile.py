@@ -0,0 +1,178 @@
+import os
+import json
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from models import ChatbotDocument, ChatbotProfile, CustomChatbot, IngestionJob, JobStatus
+from .pinecone_service import pinecone_service
+from .groq_service import groq_service
+from .answer_cache import corpus_fingerprint
+from .job_queue import job_queue
+from .ingestion import IngestionError
+from .metrics import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Trabajo de la cola que (re)calcula el perfil
+PROFILE_JOB = "build_chatbot_profile"
+# Largo máximo de un tema tomado del texto de un chunk
+TOPIC_MAX_CHARS = 100
+
+
+@dataclass
+class ProfileView:
+    """Perfil listo para el mensaje de bienvenida"""
+    documents: List[str] = field(default_factory=list)
+    topics: List[str] = field(default_factory=list)
+    suggested_questions: List[str] = field(default_factory=list)
+
+
+class ChatbotProfileService:
+    """
+    Perfil precalculado de cada chatbot: documentos, temas y preguntas sugeridas
+
+    Se calcula en la cola de ingesta al terminar de procesar documentos (una
+    sola vez por tanda) y se guarda junto con la huella de los documentos
+    procesados; si la huella cambió, el perfil deja de usarse hasta que se
+    recalcula. Así, crear una conversación no hace llamadas de embeddings
+    ni consultas a Pinecone.
+    """
+
+    def __init__(self, max_topics: int = 5, sample_chunks: int = 40, suggested_questions: int = 3):
+        self.max_topics = max_topics
+        self.sample_chunks = sample_chunks
+        self.suggested_questions = suggested_questions
+
+    def get(self, db: Session, chatbot_id: int) -> Optional[ProfileView]:
+        """
+        Perfil vigente del chatbot, o None si no hay o quedó desactualizado
+        (en ese caso se encola su recálculo)
+        """
+        fingerprint = corpus_fingerprint(db, chatbot_id)
+        profile = db.query(ChatbotProfile).filter(ChatbotProfile.chatbot_id == chatbot_id).first()
+        if profile and profile.fingerprint == fingerprint:
+            metrics.increment("chatbot_profile_lookups_total", outcome="hit")
+            return ProfileView(
+                documents=json.loads(profile.documents),
+                topics=json.loads(profile.topics),
+                suggested_questions=json.loads(profile.suggested_questions)
+            )
+
+        metrics.increment("chatbot_profile_lookups_total", outcome="stale" if profile else "missing")
+        if not fingerprint.startswith("0:"):
+            self.schedule(db, chatbot_id)
+            db.commit()
+        return None
+
+    def schedule(self, db: Session, chatbot_id: int) -> None:
+        """
+        Encola el recálculo del perfil (sin commit). No se encola si ya hay
+        uno pendiente, ni mientras queden documentos por procesar: el último
+        trabajo de la tanda lo encola al terminar.
+        """
+        pending_job = db.query(IngestionJob.job_type).filter(
+            IngestionJob.chatbot_id == chatbot_id,
+            IngestionJob.status == JobStatus.PENDING,
+            IngestionJob.job_type.in_([PROFILE_JOB, "process_document", "process_batch"])
+        ).first()
+        if pending_job is None:
+            job_queue.enqueue(db, PROFILE_JOB, chatbot_id)
+
+    def invalidate(self, db: Session, chatbot_id: int) -> None:
+        """Descarta el perfil (sin commit); se recalcula con el siguiente uso o ingesta"""
+        db.query(ChatbotProfile).filter(ChatbotProfile.chatbot_id == chatbot_id).delete(synchronize_session=False)
+
+    async def build(self, db: Session, chatbot_id: int) -> Optional[ChatbotProfile]:
+        """
+        Calcula y guarda el perfil del chatbot
+
+        Raises:
+            IngestionError: Si no se pudieron leer los chunks (el trabajo se reintenta)
+        """
+        chatbot = db.query(CustomChatbot).filter(CustomChatbot.id == chatbot_id).first()
+        if not chatbot:
+            return None
+
+        fingerprint = corpus_fingerprint(db, chatbot_id)
+        documents = db.query(ChatbotDocument).filter(
+            ChatbotDocument.chatbot_id == chatbot_id,
+            ChatbotDocument.is_processed == True
+        ).order_by(ChatbotDocument.original_filename.asc()).all()
+
+        names = [document.original_filename for document in documents]
+        topics = await self._topics(chatbot, documents)
+        questions = await groq_service.suggest_questions(names, topics, self.suggested_questions)
+        if not questions:
+            questions = [f"¿Qué dicen los documentos sobre {topic.rstrip('.')}?" for topic in topics[:self.suggested_questions]]
+
+        profile = db.query(ChatbotProfile).filter(ChatbotProfile.chatbot_id == chatbot_id).first()
+        if profile is None:
+            profile = ChatbotProfile(chatbot_id=chatbot_id)
+            db.add(profile)
+        profile.fingerprint = fingerprint
+        profile.documents = json.dumps(names, ensure_ascii=False)
+        profile.topics = json.dumps(topics, ensure_ascii=False)
+        profile.suggested_questions = json.dumps(questions, ensure_ascii=False)
+        db.commit()
+
+        metrics.increment("chatbot_profile_builds_total")
+        logger.info(f"Perfil del chatbot {chatbot_id}: {len(names)} documentos, {len(topics)} temas")
+        return profile
+
+    async def _topics(self, chatbot: CustomChatbot, documents: List[ChatbotDocument]) -> List[str]:
+        """
+        Temas principales a partir de una muestra de chunks leída por ID (sin
+        embeddings): las secciones más frecuentes y, si no alcanzan, la
+        primera oración del comienzo de cada documento
+        """
+        if not documents:
+            return []
+
+        # Muestra repartida entre documentos, a intervalos regulares en cada uno
+        per_document = max(1, self.sample_chunks // len(documents))
+        vector_ids = []
+        for document in documents:
+            chunks = document.chunks_count or 0
+            step = max(1, chunks // per_document)
+            vector_ids.extend(f"doc_{document.id}_chunk_{i}" for i in range(0, chunks, step)[:per_document])
+        vector_ids = vector_ids[:max(self.sample_chunks, len(documents))]
+
+        try:
+            stored = await pinecone_service.fetch_vectors(
+                chatbot.pinecone_index_name, vector_ids, namespace=chatbot.active_namespace
+            )
+        except Exception as e:
+            raise IngestionError(f"No se pudieron leer chunks del chatbot {chatbot.id} para el perfil: {str(e)}")
+
+        sections = Counter()
+        openings = []
+        for vector_id in vector_ids:
+            metadata = stored.get(vector_id, {}).get("metadata", {})
+            section = (metadata.get("section") or "").strip()
+            if section:
+                sections[section] += 1
+            if vector_id.endswith("_chunk_0") and metadata.get("text"):
+                text = " ".join(metadata["text"].split())
+                openings.append(text.split(". ")[0][:TOPIC_MAX_CHARS])
+
+        topics = [section for section, _ in sections.most_common(self.max_topics)]
+        for opening in openings:
+            if len(topics) >= self.max_topics:
+                break
+            if opening and opening not in topics:
+                topics.append(opening)
+        return topics
+
+
+# Instancia global
+chatbot_profiles = ChatbotProfileService(
+    max_topics=int(os.getenv("CHATBOT_PROFILE_TOPICS", "5")),
+    sample_chunks=int(os.getenv("CHATBOT_PROFILE_SAMPLE_CHUNKS", "40"))
+)
@@ -0,0 +1,190 @@
+import os
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .rate_limiter import estimate_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Solapamiento mínimo (caracteres) para considerar que dos chunks repiten texto
+MIN_OVERLAP_CHARS = 20
+
+
+class TokenCounter:
+    """
+    Cuenta tokens con el tokenizer del modelo de generación
+
+    PROMPT_TOKENIZER puede ser un ID de Hugging Face o la ruta a un
+    tokenizer.json compatible con el modelo de Groq. Si no está configurado o
+    no se puede cargar, se usa la estimación de ~4 caracteres por token.
+    """
+
+    def __init__(self, tokenizer_name: Optional[str] = None):
+        self.tokenizer_name = tokenizer_name
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return self._tokenizer
+            self._loaded = True
+            if not self.tokenizer_name:
+                return None
+            try:
+                from tokenizers import Tokenizer
+
+                if os.path.exists(self.tokenizer_name):
+                    self._tokenizer = Tokenizer.from_file(self.tokenizer_name)
+                else:
+                    self._tokenizer = Tokenizer.from_pretrained(self.tokenizer_name)
+                logger.info(f"Tokenizer cargado: {self.tokenizer_name}")
+            except Exception as e:
+                logger.warning(f"No se pudo cargar el tokenizer {self.tokenizer_name}, se usa una estimación: {str(e)}")
+                self._tokenizer = None
+            return self._tokenizer
+
+    @property
+    def exact(self) -> bool:
+        """Si el conteo usa el tokenizer real (y no la estimación)"""
+        return self._load() is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        tokenizer = self._load()
+        if tokenizer is None:
+            return estimate_tokens(text)
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        """Tokens de una lista de mensajes de chat (con ~4 de formato por mensaje)"""
+        return sum(self.count(msg.get("content", "")) + 4 for msg in messages)
+
+
+@dataclass
+class PackedContext:
+    """Chunks elegidos para el prompt y su costo en tokens"""
+    chunks: List[Dict[str, Any]] = field(default_factory=list)
+    tokens: int = 0
+    merged: int = 0
+    dropped: int = 0
+
+
+class ContextPacker:
+    """
+    Arma el contexto del prompt RAG dentro de un presupuesto de tokens
+
+    1. Une los chunks consecutivos de un mismo documento, quitando el texto
+       que se repite por el solapamiento del chunking.
+    2. Ordena por score y llena el presupuesto de forma greedy: un chunk que
+       no cabe se salta y se prueba con el siguiente. Si ni el mejor cabe, se
+       recorta para no quedar sin contexto.
+    """
+
+    def __init__(self, token_budget: int, max_overlap_chars: int, counter: TokenCounter):
+        self.token_budget = token_budget
+        self.max_overlap_chars = max_overlap_chars
+        self.counter = counter
+
+    def pack(self, chunks: List[Dict[str, Any]], token_budget: Optional[int] = None) -> PackedContext:
+        """
+        Args:
+            chunks: Resultados de Pinecone (con score y metadata)
+            token_budget: Presupuesto para este prompt (por defecto el configurado)
+        """
+        budget = token_budget or self.token_budget
+        merged = self.merge_adjacent(chunks)
+        ranked = sorted(merged, key=lambda chunk: chunk.get("score", 0), reverse=True)
+
+        packed = PackedContext(merged=len(chunks) - len(merged))
+        for chunk in ranked:
+            cost = self.chunk_tokens(chunk)
+            if packed.tokens + cost <= budget:
+                packed.chunks.append(chunk)
+                packed.tokens += cost
+            elif not packed.chunks:
+                truncated = self._truncate(chunk, budget)
+                packed.chunks.append(truncated)
+                packed.tokens += self.chunk_tokens(truncated)
+            else:
+                packed.dropped += 1
+
+        return packed
+
+    def chunk_tokens(self, chunk: Dict[str, Any]) -> int:
+        """Tokens del chunk tal como va en el prompt (encabezado de fuente + texto)"""
+        metadata = chunk.get("metadata", {})
+        header = f"[Fuente 00] {metadata.get('source', 'Documento')} (Página {metadata.get('page', 'N/A')}):\n"
+        return self.counter.count(header) + self.counter.count(metadata.get("text", ""))
+
+    def merge_adjacent(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Une chunks consecutivos (chunk_number n y n+1) del mismo documento"""
+        by_document: Dict[Any, List[Dict[str, Any]]] = {}
+        standalone = []
+        for chunk in chunks:
+            metadata = chunk.get("metadata", {})
+            if metadata.get("document_id") is None or metadata.get("chunk_number") is None:
+                standalone.append(chunk)
+            else:
+                by_document.setdefault(metadata["document_id"], []).append(chunk)
+
+        merged = list(standalone)
+        for document_chunks in by_document.values():
+            document_chunks.sort(key=lambda chunk: int(chunk["metadata"]["chunk_number"]))
+            current = document_chunks[0]
+            last_number = int(current["metadata"]["chunk_number"])
+            for chunk in document_chunks[1:]:
+                number = int(chunk["metadata"]["chunk_number"])
+                if number == last_number + 1:
+                    current = self._merge(current, chunk)
+                else:
+                    merged.append(current)
+                    current = chunk
+                last_number = number
+            merged.append(current)
+
+        return merged
+
+    def _merge(self, first: Dict[str, Any], second: Dict[str, Any]) -> Dict[str, Any]:
+        first_text = first["metadata"].get("text", "")
+        second_text = second["metadata"].get("text", "")
+        overlap = self._overlap_length(first_text, second_text)
+        text = first_text + second_text[overlap:] if overlap else f"{first_text}\n{second_text}"
+
+        return {
+            **first,
+            "score": max(first.get("score", 0), second.get("score", 0)),
+            "metadata": {**first["metadata"], "text": text}
+        }
+
+    def _overlap_length(self, first: str, second: str) -> int:
+        """Largo del mayor sufijo de first que es prefijo de second"""
+        longest = min(len(first), len(second), self.max_overlap_chars)
+        for length in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+            if first.endswith(second[:length]):
+                return length
+        return 0
+
+    def _truncate(self, chunk: Dict[str, Any], budget: int) -> Dict[str, Any]:
+        text = chunk.get("metadata", {}).get("text", "")
+        tokens = max(self.chunk_tokens(chunk), 1)
+        keep = int(len(text) * budget / tokens * 0.95)
+        return {**chunk, "metadata": {**chunk["metadata"], "text": text[:keep]}}
+
+
+# Instancias globales
+token_counter = TokenCounter(os.getenv("PROMPT_TOKENIZER") or None)
+context_packer = ContextPacker(
+    token_budget=int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "2500")),
+    # El solapamiento real es el del chunking; se deja margen por los recortes en espacios
+    max_overlap_chars=int(os.getenv("CHUNK_OVERLAP", "200")) * 2,
+    counter=token_counter
+)
@@ -0,0 +1,168 @@
+import os
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from database import SessionLocal
+from models import Conversation, Message
+from .groq_service import groq_service
+from .rate_limiter import estimate_tokens
+from .metrics import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PromptHistory:
+    """Contexto de la conversación para el prompt: resumen acumulado y últimos mensajes"""
+    summary: Optional[str] = None
+    messages: List[Dict[str, str]] = field(default_factory=list)
+
+
+class ConversationSummarizer:
+    """
+    Resumen acumulado por conversación para acotar el tamaño del prompt
+
+    El prompt lleva el resumen más los últimos mensajes (recent_messages),
+    dentro de un presupuesto fijo de tokens. Tras cada turno, los mensajes que
+    salen de esa ventana se incorporan al resumen con una llamada barata al
+    LLM, en segundo plano; las actualizaciones de una misma conversación se
+    agrupan en una sola.
+    """
+
+    def __init__(self):
+        self.recent_messages = int(os.getenv("CONVERSATION_RECENT_MESSAGES", "4"))
+        self.history_token_budget = int(os.getenv("CONVERSATION_HISTORY_TOKEN_BUDGET", "1200"))
+        self.summary_max_tokens = int(os.getenv("CONVERSATION_SUMMARY_MAX_TOKENS", "300"))
+        self._running: Set[int] = set()
+        self._dirty: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def prompt_history(self, db: Session, conversation_id: int) -> PromptHistory:
+        """
+        Resumen y mensajes posteriores a él, sin el mensaje actual del usuario,
+        recortados al presupuesto de tokens (se descartan primero los más antiguos)
+        """
+        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+        if not conversation:
+            return PromptHistory()
+
+        query = db.query(Message).filter(Message.conversation_id == conversation_id)
+        if conversation.summary_message_id:
+            query = query.filter(Message.id > conversation.summary_message_id)
+        recent = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(self.recent_messages + 1).all()
+
+        summary = conversation.summary
+        budget = self.history_token_budget - estimate_tokens(summary or "")
+        messages = []
+        for msg in recent[1:]:  # Excluir mensaje actual
+            tokens = estimate_tokens(msg.text)
+            if tokens > budget:
+                if not messages and budget > 0:
+                    # El mensaje más reciente se incluye aunque sea recortado
+                    messages.append({"sender": msg.sender, "text": msg.text[:budget * 4]})
+                break
+            messages.append({"sender": msg.sender, "text": msg.text})
+            budget -= tokens
+
+        return PromptHistory(summary=summary, messages=list(reversed(messages)))
+
+    def schedule(self, conversation_id: int) -> None:
+        """
+        Programa la actualización del resumen sin bloquear la respuesta. Si ya
+        hay una en curso para la conversación, se repite una vez al terminar.
+        """
+        if conversation_id in self._running:
+            self._dirty.add(conversation_id)
+            return
+
+        self._running.add(conversation_id)
+        task = asyncio.create_task(self._run(conversation_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, conversation_id: int) -> None:
+        try:
+            while True:
+                self._dirty.discard(conversation_id)
+                await self.update(conversation_id)
+                if conversation_id not in self._dirty:
+                    break
+        except Exception as e:
+            logger.error(f"Error actualizando resumen de la conversación {conversation_id}: {str(e)}")
+        finally:
+            self._running.discard(conversation_id)
+
+    async def update(self, conversation_id: int) -> bool:
+        """
+        Incorpora al resumen los mensajes que quedaron fuera de la ventana reciente
+
+        Returns:
+            bool: True si el resumen cambió
+        """
+        pending = await asyncio.to_thread(self._pending_messages, conversation_id)
+        if not pending:
+            return False
+        summary, messages = pending
+
+        new_summary = await groq_service.summarize_conversation(summary, messages, self.summary_max_tokens)
+        if not new_summary:
+            return False
+
+        await asyncio.to_thread(self._save_summary, conversation_id, new_summary, messages[-1]["id"])
+        metrics.increment("conversation_summaries_total")
+        logger.info(f"Resumen de la conversación {conversation_id} actualizado ({len(messages)} mensajes nuevos)")
+        return True
+
+    def _pending_messages(self, conversation_id: int):
+        """Resumen actual y mensajes aún no resumidos fuera de la ventana reciente"""
+        db = SessionLocal()
+        try:
+            conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+            if not conversation:
+                return None
+
+            query = db.query(Message).filter(Message.conversation_id == conversation_id)
+            if conversation.summary_message_id:
+                query = query.filter(Message.id > conversation.summary_message_id)
+            unsummarized = query.order_by(Message.created_at.asc(), Message.id.asc()).all()
+
+            to_fold = unsummarized[:-self.recent_messages] if self.recent_messages else unsummarized
+            if not to_fold:
+                return None
+            return conversation.summary, [
+                {"id": msg.id, "sender": msg.sender, "text": msg.text}
+                for msg in to_fold
+            ]
+        finally:
+            db.close()
+
+    def _save_summary(self, conversation_id: int, summary: str, last_message_id: int) -> None:
+        db = SessionLocal()
+        try:
+            # Solo avanza: una actualización atrasada no pisa un resumen más nuevo
+            db.query(Conversation).filter(
+                Conversation.id == conversation_id,
+                (Conversation.summary_message_id == None) | (Conversation.summary_message_id < last_message_id)
+            ).update(
+                {
+                    Conversation.summary: summary,
+                    Conversation.summary_message_id: last_message_id,
+                    # El resumen no cuenta como actividad de la conversación
+                    Conversation.updated_at: Conversation.updated_at
+                },
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+
+# Instancia global
+conversation_summarizer = ConversationSummarizer()
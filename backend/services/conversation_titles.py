@@ -0,0 +1,133 @@
+import os
+import asyncio
+import logging
+from typing import Dict, Optional, Set
+
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from database import SessionLocal
+from models import Conversation, Message
+from .groq_service import groq_service
+from .metrics import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Estados de Conversation.title_status
+TITLE_AUTO = "auto"        # Título por defecto, se genera con el primer mensaje
+TITLE_PENDING = "pending"  # Generación encolada o en curso
+TITLE_READY = "ready"      # Título generado
+
+
+def fallback_title(first_message: str, max_length: int = 50) -> str:
+    """Título a partir del propio mensaje, si el LLM no entregó uno"""
+    text = " ".join(first_message.split())
+    if len(text) > max_length:
+        text = text[:max_length-3].rstrip() + "..."
+    return text or "Nueva conversación"
+
+
+class ConversationTitler:
+    """
+    Genera los títulos de conversaciones nuevas fuera del request
+
+    La respuesta al primer mensaje no espera al título: la conversación queda
+    en 'pending' y el título se genera en segundo plano. Las conversaciones
+    que empiezan dentro de la misma ventana se titulan juntas, con una sola
+    llamada al LLM por lote, y una conversación ya encolada no se repite.
+    El cliente consulta el título con GET /api/chat/conversations/{id}/title.
+    """
+
+    def __init__(self, batch_size: int = 10, batch_window_seconds: float = 0.5, max_length: int = 50):
+        self.batch_size = batch_size
+        self.batch_window_seconds = batch_window_seconds
+        self.max_length = max_length
+        self._pending: Dict[int, str] = {}
+        self._in_flight: Set[int] = set()
+        self._flusher: Optional[asyncio.Task] = None
+
+    def is_scheduled(self, conversation_id: int) -> bool:
+        return conversation_id in self._pending or conversation_id in self._in_flight
+
+    def schedule(self, conversation_id: int, first_message: str) -> None:
+        """Encola la conversación para el próximo lote (sin bloquear)"""
+        if self.is_scheduled(conversation_id):
+            return
+
+        self._pending[conversation_id] = first_message
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while self._pending:
+            # Esperar a que se junten las conversaciones que empiezan a la vez
+            await asyncio.sleep(self.batch_window_seconds)
+            while self._pending:
+                batch = dict(list(self._pending.items())[:self.batch_size])
+                for conversation_id in batch:
+                    del self._pending[conversation_id]
+                self._in_flight.update(batch)
+                try:
+                    await self._generate(batch)
+                except Exception as e:
+                    logger.error(f"Error generando títulos de conversaciones {list(batch)}: {str(e)}")
+                finally:
+                    self._in_flight.difference_update(batch)
+
+    async def _generate(self, batch: Dict[int, str]) -> None:
+        conversation_ids = list(batch)
+        generated = await groq_service.generate_titles([batch[i] for i in conversation_ids], self.max_length)
+        titles = {
+            conversation_id: title or fallback_title(batch[conversation_id], self.max_length)
+            for conversation_id, title in zip(conversation_ids, generated)
+        }
+
+        await asyncio.to_thread(self._save_titles, titles)
+        metrics.increment("conversation_titles_total", len(titles))
+        metrics.observe("conversation_title_batch_size", len(titles))
+        logger.info(f"Títulos generados para {len(titles)} conversaciones")
+
+    def _save_titles(self, titles: Dict[int, str]) -> None:
+        db = SessionLocal()
+        try:
+            for conversation_id, title in titles.items():
+                # Solo si sigue pendiente: no pisar un título puesto por el usuario
+                db.query(Conversation).filter(
+                    Conversation.id == conversation_id,
+                    Conversation.title_status == TITLE_PENDING
+                ).update(
+                    {
+                        Conversation.title: title,
+                        Conversation.title_status: TITLE_READY,
+                        # El título no cuenta como actividad de la conversación
+                        Conversation.updated_at: Conversation.updated_at
+                    },
+                    synchronize_session=False
+                )
+            db.commit()
+        finally:
+            db.close()
+
+    def resume(self, db: Session, conversation: Conversation) -> None:
+        """
+        Vuelve a encolar una conversación pendiente que no está en memoria
+        (por ejemplo, tras reiniciar el proceso antes de generar su título)
+        """
+        if conversation.title_status != TITLE_PENDING or self.is_scheduled(conversation.id):
+            return
+
+        first_message = db.query(Message.text).filter(
+            Message.conversation_id == conversation.id,
+            Message.sender == "user"
+        ).order_by(Message.created_at.asc(), Message.id.asc()).first()
+        if first_message:
+            self.schedule(conversation.id, first_message[0])
+
+
+# Instancia global
+conversation_titler = ConversationTitler(
+    batch_size=int(os.getenv("TITLE_BATCH_SIZE", "10")),
+    batch_window_seconds=float(os.getenv("TITLE_BATCH_WINDOW_SECONDS", "0.5"))
+)
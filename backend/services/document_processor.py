@@ -1,10 +1,17 @@
 import os
+import csv
+import asyncio
+import glob
+import gzip
+import json
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Tuple
 from pathlib import Path
 import pypdf
 from docx import Document
-import markdown
+from docx.table import Table
+from docx.text.paragraph import Paragraph
 import re
 from datetime import datetime
 from dotenv import load_dotenv
@@ -14,14 +21,52 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 
+class ExtractionError(Exception):
+    """No se pudo extraer texto utilizable de un archivo"""
+
+
+# Versión de los extractores. Incrementar cada vez que cambie la forma de
+# extraer texto para invalidar los caches de extracción existentes.
+EXTRACTOR_VERSION = "3"
+
+# Sufijo de los archivos de cache de extracción (JSON lines comprimido con gzip)
+EXTRACTION_CACHE_SUFFIX = ".jsonl.gz"
+
+# Extensiones que se procesan fila a fila en lugar de como texto completo
+SPREADSHEET_EXTENSIONS = (".csv", ".xlsx")
+
+# Patrones Markdown (se procesa el texto fuente, sin renderizar a HTML)
+MD_ATX_HEADING = re.compile(r'^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$')
+MD_SETEXT_UNDERLINE = re.compile(r'^\s{0,3}(=+|-+)\s*$')
+MD_FENCE = re.compile(r'^\s{0,3}(```|~~~)')
+# Prefijos de línea: se quitan antes del marcado en línea, para que el "*"
+# de una viñeta no se confunda con el de una cursiva
+MD_LINE_PREFIX_PATTERNS = [
+    (re.compile(r'^\s{0,3}>\s?'), ''),                  # citas
+    (re.compile(r'^\s*([-*+]|\d+[.)])\s+'), '- '),       # listas
+]
+MD_INLINE_PATTERNS = [
+    (re.compile(r'!\[([^\]]*)\]\([^)]*\)'), r'\1'),     # imágenes
+    (re.compile(r'\[([^\]]+)\]\([^)]*\)'), r'\1'),      # enlaces
+    (re.compile(r'<[^<>]+?>'), ''),                     # HTML embebido
+    (re.compile(r'(\*\*|__)(.+?)\1'), r'\2'),           # negrita
+    (re.compile(r'(?<!\w)(\*|_)(.+?)\1(?!\w)'), r'\2'),   # cursiva
+    (re.compile(r'`([^`]+)`'), r'\1'),                  # código en línea
+]
+
+# Estilos de título en DOCX ("Heading 2", "Título 2", "Title")
+DOCX_HEADING_STYLE = re.compile(r'^(heading|t[ií]tulo)\s*(\d)$', re.IGNORECASE)
+
+
 class DocumentProcessor:
     def __init__(self):
         """Inicializa el procesador de documentos"""
         
         self.chunk_size = int(os.getenv("CHUNK_SIZE", "1000"))
         self.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "200"))
-        self.allowed_extensions = os.getenv("ALLOWED_EXTENSIONS", "pdf,docx,txt,md").split(",")
+        self.allowed_extensions = os.getenv("ALLOWED_EXTENSIONS", "pdf,docx,txt,md,csv,xlsx").split(",")
         self.upload_folder = os.getenv("UPLOAD_FOLDER", "./uploads")
+        self.extraction_cache_enabled = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
         
         # Crear carpeta de uploads si no existe
         Path(self.upload_folder).mkdir(exist_ok=True)
@@ -82,7 +127,6 @@ class DocumentProcessor:
                 reader = pypdf.PdfReader(file)
                 
                 text_pages = []
-                total_text = ""
                 
                 for page_num, page in enumerate(reader.pages, 1):
                     try:
@@ -92,23 +136,11 @@ class DocumentProcessor:
                                 "page": page_num,
                                 "text": page_text.strip()
                             })
-                            total_text += page_text + "\n\n"
                     except Exception as e:
                         logger.warning(f"Error extrayendo página {page_num}: {str(e)}")
                         continue
                 
-                return {
-                    "success": True,
-                    "text": total_text.strip(),
-                    "pages": text_pages,
-                    "total_pages": len(reader.pages),
-                    "extracted_pages": len(text_pages),
-                    "metadata": {
-                        "title": reader.metadata.get('/Title', '') if reader.metadata else '',
-                        "author": reader.metadata.get('/Author', '') if reader.metadata else '',
-                        "creator": reader.metadata.get('/Creator', '') if reader.metadata else ''
-                    }
-                }
+                return self._pdf_result(reader, text_pages)
                 
         except Exception as e:
             logger.error(f"Error extrayendo texto de PDF {file_path}: {str(e)}")
@@ -119,31 +151,72 @@ class DocumentProcessor:
                 "error": str(e)
             }
     
+    def _pdf_result(self, reader: Any, text_pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Arma el resultado de extracción de un PDF a partir de sus páginas con texto"""
+        return {
+            "success": True,
+            "text": "\n\n".join(page["text"] for page in text_pages),
+            "pages": text_pages,
+            "total_pages": len(reader.pages),
+            "extracted_pages": len(text_pages),
+            "metadata": {
+                "title": reader.metadata.get('/Title', '') if reader.metadata else '',
+                "author": reader.metadata.get('/Author', '') if reader.metadata else '',
+                "creator": reader.metadata.get('/Creator', '') if reader.metadata else ''
+            }
+        }
+    
     async def extract_text_from_docx(self, file_path: str) -> Dict[str, Any]:
         """
-        Extrae texto de un archivo DOCX
+        Extrae texto de un archivo DOCX conservando la estructura de títulos
+        
+        Recorre el cuerpo del documento una sola vez, en orden, incluyendo
+        tablas, y agrupa el contenido en secciones según los estilos de título.
         
         Args:
             file_path: Ruta del archivo DOCX
             
         Returns:
-            Dict: Texto extraído y metadatos
+            Dict: Texto extraído, secciones y metadatos
         """
         try:
             doc = Document(file_path)
             
             paragraphs = []
-            full_text = ""
+            builder = _SectionBuilder()
             
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    paragraphs.append(para.text.strip())
-                    full_text += para.text + "\n"
+            for block in doc.element.body.iterchildren():
+                tag = block.tag.rsplit('}', 1)[-1]
+                
+                if tag == 'p':
+                    para = Paragraph(block, doc)
+                    text = para.text.strip()
+                    if not text:
+                        continue
+                    level = self._docx_heading_level(para)
+                    if level:
+                        builder.heading(level, text)
+                    else:
+                        builder.add(text)
+                        builder.paragraph_break()
+                    paragraphs.append(text)
+                
+                elif tag == 'tbl':
+                    for row in Table(block, doc).rows:
+                        cells = [cell.text.strip() for cell in row.cells]
+                        if any(cells):
+                            row_text = " | ".join(cells)
+                            builder.add(row_text)
+                            paragraphs.append(row_text)
+                    builder.paragraph_break()
+            
+            sections = builder.finish()
             
             return {
                 "success": True,
-                "text": full_text.strip(),
+                "text": "\n".join(paragraphs),
                 "paragraphs": paragraphs,
+                "sections": sections,
                 "total_paragraphs": len(paragraphs),
                 "metadata": {
                     "title": doc.core_properties.title or '',
@@ -162,6 +235,14 @@ class DocumentProcessor:
                 "error": str(e)
             }
     
+    def _docx_heading_level(self, para: Any) -> int:
+        """Nivel de título de un párrafo DOCX según su estilo (0 si no es título)"""
+        style_name = (para.style.name if para.style is not None else '') or ''
+        if style_name.lower() in ('title', 'título', 'titulo'):
+            return 1
+        match = DOCX_HEADING_STYLE.match(style_name.strip())
+        return int(match.group(2)) if match else 0
+    
     async def extract_text_from_txt(self, file_path: str) -> Dict[str, Any]:
         """
         Extrae texto de un archivo TXT
@@ -208,30 +289,70 @@ class DocumentProcessor:
     
     async def extract_text_from_markdown(self, file_path: str) -> Dict[str, Any]:
         """
-        Extrae texto de un archivo Markdown
+        Extrae texto de un archivo Markdown agrupado por secciones
+        
+        Recorre las líneas una sola vez: detecta títulos ATX (#) y setext
+        (subrayados), respeta bloques de código y limpia el marcado en línea,
+        sin renderizar a HTML.
         
         Args:
             file_path: Ruta del archivo MD
             
         Returns:
-            Dict: Texto extraído
+            Dict: Texto extraído, secciones y metadatos
         """
         try:
             with open(file_path, 'r', encoding='utf-8') as file:
-                md_content = file.read()
+                lines = file.read().splitlines()
+            
+            builder = _SectionBuilder()
+            in_fence = False
+            pending_line = None  # Línea candidata a título setext
+            
+            for line in lines:
+                if MD_FENCE.match(line):
+                    in_fence = not in_fence
+                    if pending_line is not None:
+                        builder.add(pending_line)
+                        pending_line = None
+                    continue
+                
+                if in_fence:
+                    builder.add(line.rstrip())
+                    continue
+                
+                underline = MD_SETEXT_UNDERLINE.match(line)
+                if underline and pending_line is not None:
+                    builder.heading(1 if underline.group(1)[0] == '=' else 2, pending_line)
+                    pending_line = None
+                    continue
+                
+                if pending_line is not None:
+                    builder.add(pending_line)
+                    pending_line = None
+                
+                heading = MD_ATX_HEADING.match(line)
+                if heading:
+                    builder.heading(len(heading.group(1)), self._clean_markdown_inline(heading.group(2)))
+                elif not line.strip():
+                    builder.paragraph_break()
+                elif underline:
+                    # Regla horizontal
+                    builder.paragraph_break()
+                else:
+                    pending_line = self._clean_markdown_inline(line)
+            
+            if pending_line is not None:
+                builder.add(pending_line)
             
-            # Convertir Markdown a texto plano
-            html = markdown.markdown(md_content)
-            # Remover tags HTML básicos
-            text = re.sub('<[^<]+?>', '', html)
-            # Limpiar espacios extra
-            text = re.sub(r'\n\s*\n', '\n\n', text)
+            sections = builder.finish()
+            text = "\n\n".join(section["text"] for section in sections)
             
             return {
                 "success": True,
                 "text": text.strip(),
-                "original_markdown": md_content,
-                "lines": len(md_content.splitlines()),
+                "sections": sections,
+                "lines": len(lines),
                 "metadata": {}
             }
             
@@ -243,12 +364,20 @@ class DocumentProcessor:
                 "error": str(e)
             }
     
-    async def extract_text_from_file(self, file_path: str) -> Dict[str, Any]:
+    def _clean_markdown_inline(self, line: str) -> str:
+        """Elimina el marcado Markdown en línea conservando el texto"""
+        for pattern, replacement in MD_LINE_PREFIX_PATTERNS + MD_INLINE_PATTERNS:
+            line = pattern.sub(replacement, line)
+        return line.strip()
+    
+    async def extract_text_from_file(self, file_path: str, use_cache: bool = True) -> Dict[str, Any]:
         """
-        Extrae texto de un archivo según su extensión
+        Extrae texto de un archivo según su extensión, reutilizando el cache
+        de extracción si existe uno válido para el contenido actual del archivo
         
         Args:
             file_path: Ruta del archivo
+            use_cache: Si leer/escribir el cache de extracción
             
         Returns:
             Dict: Texto extraído y metadatos
@@ -257,8 +386,109 @@ class DocumentProcessor:
         if not file_info.get("exists"):
             return {"success": False, "error": "Archivo no encontrado"}
         
-        extension = file_info.get("extension", "").lower()
+        use_cache = use_cache and self.extraction_cache_enabled
+        file_hash = None
+        
+        if use_cache:
+            try:
+                file_hash = self.compute_file_hash(file_path)
+                cached = self.load_extraction_cache(file_path, file_hash)
+                if cached is not None:
+                    logger.info(f"Extracción leída desde cache para {file_info.get('filename')}")
+                    return cached
+            except Exception as e:
+                logger.warning(f"No se pudo leer el cache de extracción de {file_path}: {str(e)}")
+        
+        result = await self._extract_uncached(file_path, file_info.get("extension", "").lower())
+        
+        if use_cache and file_hash and result.get("success"):
+            try:
+                self.save_extraction_cache(file_path, file_hash, result)
+            except Exception as e:
+                logger.warning(f"No se pudo guardar el cache de extracción de {file_path}: {str(e)}")
+        
+        return result
+    
+    async def iter_text_segments(self, file_path: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Entrega el texto de un archivo por segmentos a medida que se extrae
+        
+        Los PDF sin cache se extraen página a página en un hilo aparte, de modo
+        que las etapas siguientes pueden avanzar con las primeras páginas
+        mientras se extraen las demás. El resto de formatos (o un PDF con
+        cache) se extrae completo, también en un hilo aparte, y se entrega por
+        secciones o páginas.
+        
+        Yields:
+            Dict: {"text": ..., "page": n} o {"text": ..., "heading_path": [...]}
+            
+        Raises:
+            ExtractionError: Si el archivo no tiene texto extraíble
+        """
+        extension = Path(file_path).suffix.lower()
+        
+        if extension == ".pdf":
+            file_hash = None
+            if self.extraction_cache_enabled:
+                file_hash = await asyncio.to_thread(self.compute_file_hash, file_path)
+                cached = self.load_extraction_cache(file_path, file_hash)
+                if cached is not None:
+                    for segment in self._result_segments(cached):
+                        yield segment
+                    return
+            
+            async for segment in self._stream_pdf_pages(file_path, file_hash):
+                yield segment
+            return
+        
+        # Los extractores no hacen await: en el hilo solo bloquean el loop propio
+        result = await asyncio.to_thread(asyncio.run, self.extract_text_from_file(file_path))
+        if not result.get("success"):
+            raise ExtractionError(f"Error extrayendo texto: {result.get('error')}")
         
+        segments = self._result_segments(result)
+        if not segments:
+            raise ExtractionError("Documento sin contenido de texto")
+        for segment in segments:
+            yield segment
+    
+    async def _stream_pdf_pages(self, file_path: str, file_hash: Optional[str]) -> AsyncIterator[Dict[str, Any]]:
+        """Extrae un PDF página a página en un hilo y guarda el cache al terminar"""
+        with open(file_path, 'rb') as file:
+            reader = await asyncio.to_thread(pypdf.PdfReader, file)
+            text_pages = []
+            
+            for page_num, page in enumerate(reader.pages, 1):
+                try:
+                    page_text = await asyncio.to_thread(page.extract_text)
+                except Exception as e:
+                    logger.warning(f"Error extrayendo página {page_num}: {str(e)}")
+                    continue
+                if page_text.strip():
+                    segment = {"page": page_num, "text": page_text.strip()}
+                    text_pages.append(segment)
+                    yield segment
+            
+            if not text_pages:
+                raise ExtractionError("Documento sin contenido de texto")
+            
+            if file_hash:
+                try:
+                    self.save_extraction_cache(file_path, file_hash, self._pdf_result(reader, text_pages))
+                except Exception as e:
+                    logger.warning(f"No se pudo guardar el cache de extracción de {file_path}: {str(e)}")
+    
+    def _result_segments(self, result: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Divide un resultado de extracción en segmentos (secciones, páginas o texto completo)"""
+        if result.get("sections"):
+            return [section for section in result["sections"] if section.get("text", "").strip()]
+        if result.get("pages"):
+            return [page for page in result["pages"] if page.get("text", "").strip()]
+        text = result.get("text", "")
+        return [{"text": text}] if text.strip() else []
+    
+    async def _extract_uncached(self, file_path: str, extension: str) -> Dict[str, Any]:
+        """Ejecuta el extractor correspondiente a la extensión, sin cache"""
         if extension == ".pdf":
             return await self.extract_text_from_pdf(file_path)
         elif extension == ".docx":
@@ -273,6 +503,270 @@ class DocumentProcessor:
                 "error": f"Tipo de archivo no soportado: {extension}"
             }
     
+    # --------------- Cache de extracción ------------------
+    
+    def compute_file_hash(self, file_path: str) -> str:
+        """Calcula el SHA-256 del archivo leyendo por bloques"""
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+        return sha.hexdigest()
+    
+    def get_extraction_cache_path(self, file_path: str, file_hash: str) -> Path:
+        """
+        Ruta del cache de extracción, junto al archivo subido
+        
+        El nombre incluye el hash del archivo y la versión del extractor, de modo
+        que un cambio en cualquiera de los dos apunta a un cache distinto.
+        """
+        path_obj = Path(file_path)
+        cache_name = f"{path_obj.name}.extract.{file_hash[:16]}.v{EXTRACTOR_VERSION}{EXTRACTION_CACHE_SUFFIX}"
+        return path_obj.with_name(cache_name)
+    
+    def load_extraction_cache(self, file_path: str, file_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Lee el resultado de extracción cacheado
+        
+        Formato: JSON lines comprimido. Cada línea es {"meta": {...}} con campos
+        escalares del resultado, o {"f": campo, "v": valor} con el texto o un
+        elemento de una lista (páginas, párrafos, ...).
+        
+        Returns:
+            Dict con el resultado de extracción, o None si no hay cache válido
+        """
+        cache_path = self.get_extraction_cache_path(file_path, file_hash)
+        if not cache_path.exists():
+            return None
+        
+        result: Dict[str, Any] = {}
+        with gzip.open(cache_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if "meta" in record:
+                    result.update(record["meta"])
+                    continue
+                field, value = record["f"], record["v"]
+                if field == "text":
+                    result["text"] = value
+                else:
+                    result.setdefault(field, []).append(value)
+        
+        header = result.pop("_cache", {})
+        if header.get("extractor_version") != EXTRACTOR_VERSION or header.get("file_hash") != file_hash:
+            return None
+        for field in header.get("list_fields", []):
+            result.setdefault(field, [])
+        
+        result.setdefault("text", "")
+        result["from_cache"] = True
+        return result
+    
+    def save_extraction_cache(self, file_path: str, file_hash: str, result: Dict[str, Any]) -> Path:
+        """
+        Guarda el resultado de extracción junto al archivo y elimina los caches
+        anteriores del mismo archivo (otra versión del extractor u otro contenido)
+        """
+        cache_path = self.get_extraction_cache_path(file_path, file_hash)
+        tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+        
+        meta = {k: v for k, v in result.items() if k != "text" and not isinstance(v, list)}
+        meta["_cache"] = {
+            "extractor_version": EXTRACTOR_VERSION,
+            "file_hash": file_hash,
+            "list_fields": [k for k, v in result.items() if isinstance(v, list)]
+        }
+        
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps({"meta": meta}, ensure_ascii=False, default=str) + "\n")
+            f.write(json.dumps({"f": "text", "v": result.get("text", "")}, ensure_ascii=False) + "\n")
+            for field, value in result.items():
+                if isinstance(value, list):
+                    for item in value:
+                        f.write(json.dumps({"f": field, "v": item}, ensure_ascii=False, default=str) + "\n")
+        
+        # Reemplazo atómico para no dejar caches a medio escribir
+        os.replace(tmp_path, cache_path)
+        self.delete_extraction_cache(file_path, keep=cache_path)
+        return cache_path
+    
+    def delete_extraction_cache(self, file_path: str, keep: Optional[Path] = None) -> int:
+        """
+        Elimina los caches de extracción de un archivo
+        
+        Args:
+            file_path: Ruta del archivo original
+            keep: Cache que no debe eliminarse (el recién escrito)
+            
+        Returns:
+            int: Número de archivos de cache eliminados
+        """
+        path_obj = Path(file_path)
+        removed = 0
+        for cache_file in path_obj.parent.glob(f"{glob.escape(path_obj.name)}.extract.*"):
+            if keep is not None and cache_file == keep:
+                continue
+            try:
+                cache_file.unlink()
+                removed += 1
+            except OSError as e:
+                logger.warning(f"No se pudo eliminar cache {cache_file}: {str(e)}")
+        return removed
+    
+    # --------------- Hojas de cálculo (streaming) ------------------
+    
+    def is_spreadsheet(self, file_path: str) -> bool:
+        """Indica si el archivo es una hoja de cálculo (CSV/XLSX)"""
+        return Path(file_path).suffix.lower() in SPREADSHEET_EXTENSIONS
+    
+    def _detect_csv_format(self, file_path: str) -> Tuple[str, Any]:
+        """
+        Detecta encoding y dialecto de un CSV leyendo solo una muestra inicial
+        
+        Returns:
+            Tuple: (encoding, dialecto csv)
+        """
+        with open(file_path, 'rb') as f:
+            sample_bytes = f.read(64 * 1024)
+        
+        encoding = 'latin-1'
+        for candidate in ['utf-8-sig', 'cp1252']:
+            try:
+                sample_bytes.decode(candidate)
+                encoding = candidate
+                break
+            except UnicodeDecodeError:
+                continue
+        
+        sample = sample_bytes.decode(encoding, errors='ignore')
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel
+        return encoding, dialect
+    
+    def iter_csv_rows(self, file_path: str) -> Iterator[Tuple[str, List[Any]]]:
+        """
+        Itera las filas de un CSV sin cargar el archivo completo en memoria
+        
+        Yields:
+            Tuple: (nombre de hoja, valores de la fila)
+        """
+        encoding, dialect = self._detect_csv_format(file_path)
+        sheet_name = Path(file_path).stem
+        with open(file_path, 'r', encoding=encoding, errors='replace', newline='') as f:
+            for row in csv.reader(f, dialect):
+                yield sheet_name, row
+    
+    def iter_xlsx_rows(self, file_path: str) -> Iterator[Tuple[str, List[Any]]]:
+        """
+        Itera las filas de todas las hojas de un XLSX en modo read-only
+        (openpyxl carga las filas bajo demanda, sin materializar el libro)
+        
+        Yields:
+            Tuple: (nombre de hoja, valores de la fila)
+        """
+        from openpyxl import load_workbook
+        
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for worksheet in workbook.worksheets:
+                for row in worksheet.iter_rows(values_only=True):
+                    yield worksheet.title, list(row)
+        finally:
+            workbook.close()
+    
+    def _format_cell(self, value: Any) -> str:
+        """Convierte un valor de celda a texto legible"""
+        if value is None:
+            return ""
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        if isinstance(value, datetime):
+            return value.isoformat(sep=' ')
+        return str(value).strip()
+    
+    def iter_spreadsheet_chunks(
+        self,
+        file_path: str,
+        metadata: Dict[str, Any] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Agrupa las filas de una hoja de cálculo en chunks con el encabezado
+        como prefijo, de tamaño acotado por chunk_size
+        
+        La primera fila no vacía de cada hoja se toma como encabezado. Solo se
+        mantiene en memoria el grupo de filas del chunk en construcción.
+        
+        Args:
+            file_path: Ruta del archivo CSV o XLSX
+            metadata: Metadatos adicionales para cada chunk
+            
+        Yields:
+            Dict: Chunk con el mismo formato que create_text_chunks
+        """
+        metadata = metadata or {}
+        extension = Path(file_path).suffix.lower()
+        rows = self.iter_xlsx_rows(file_path) if extension == ".xlsx" else self.iter_csv_rows(file_path)
+        
+        chunk_num = 1
+        current_sheet = None
+        header_text = ""
+        group: List[str] = []
+        group_len = 0
+        row_start = row_end = 0
+        row_index = 0
+        
+        def flush() -> Dict[str, Any]:
+            chunk_text = header_text + "\n" + "\n".join(group)
+            return self._create_chunk_dict(chunk_text, chunk_num, {
+                **metadata,
+                "sheet": current_sheet,
+                "row_start": row_start,
+                "row_end": row_end
+            })
+        
+        for sheet_name, row in rows:
+            if sheet_name != current_sheet:
+                if group:
+                    yield flush()
+                    chunk_num += 1
+                current_sheet = sheet_name
+                header_text = ""
+                group, group_len = [], 0
+                row_index = 0
+            
+            row_index += 1
+            cells = [self._format_cell(value) for value in row]
+            if not any(cells):
+                continue
+            
+            if not header_text:
+                header_text = f"Hoja: {sheet_name}\nColumnas: " + " | ".join(cells)
+                continue
+            
+            row_text = " | ".join(cells)
+            # Una fila más larga que el chunk se trunca para mantener el límite
+            max_row_len = max(self.chunk_size - len(header_text) - 1, 100)
+            if len(row_text) > max_row_len:
+                row_text = row_text[:max_row_len]
+            
+            if group and len(header_text) + group_len + len(row_text) + 1 > self.chunk_size:
+                yield flush()
+                chunk_num += 1
+                group, group_len = [], 0
+            
+            if not group:
+                row_start = row_index
+            group.append(row_text)
+            group_len += len(row_text) + 1
+            row_end = row_index
+        
+        if group:
+            yield flush()
+    
     def create_text_chunks(
         self,
         text: str,
@@ -358,6 +852,73 @@ class DocumentProcessor:
         logger.info(f"Texto dividido en {len(chunks)} chunks")
         return chunks
     
+    def create_section_chunks(
+        self,
+        sections: List[Dict[str, Any]],
+        metadata: Dict[str, Any] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Divide un documento en chunks que no cruzan límites de sección
+        
+        Cada chunk lleva la ruta de títulos de su sección en los metadatos
+        (heading_path y section) y como primera línea del texto.
+        
+        Args:
+            sections: Secciones con heading_path y text (ver extractores MD/DOCX)
+            metadata: Metadatos adicionales
+            
+        Returns:
+            List[Dict]: Lista de chunks con metadatos
+        """
+        metadata = metadata or {}
+        chunks = []
+        
+        for section in sections:
+            heading_path = section.get("heading_path") or []
+            section_name = " > ".join(heading_path)
+            section_metadata = {**metadata, "heading_path": heading_path, "section": section_name}
+            
+            for chunk in self.create_text_chunks(section.get("text", ""), section_metadata):
+                if section_name:
+                    chunk["text"] = f"{section_name}\n\n{chunk['text']}"
+                    chunk["char_count"] = len(chunk["text"])
+                    chunk["word_count"] = len(chunk["text"].split())
+                chunk["chunk_number"] = len(chunks) + 1
+                chunks.append(chunk)
+        
+        logger.info(f"Documento dividido en {len(chunks)} chunks por sección")
+        return chunks
+    
+    def create_segment_chunks(
+        self,
+        segment: Dict[str, Any],
+        metadata: Dict[str, Any] = None,
+        start_number: int = 1
+    ) -> List[Dict[str, Any]]:
+        """
+        Divide un segmento de iter_text_segments en chunks, conservando su
+        página o sección en los metadatos
+        
+        Args:
+            segment: Segmento con text y opcionalmente page o heading_path
+            metadata: Metadatos adicionales
+            start_number: Número del primer chunk (numeración global del documento)
+            
+        Returns:
+            List[Dict]: Lista de chunks con metadatos
+        """
+        metadata = metadata or {}
+        if "heading_path" in segment:
+            chunks = self.create_section_chunks([segment], metadata)
+        elif "page" in segment:
+            chunks = self.create_text_chunks(segment["text"], {**metadata, "page": segment["page"]})
+        else:
+            chunks = self.create_text_chunks(segment["text"], metadata)
+        
+        for offset, chunk in enumerate(chunks):
+            chunk["chunk_number"] = start_number + offset
+        return chunks
+    
     def _split_large_text(self, text: str) -> List[str]:
         """Divide texto largo en chunks respetando palabras"""
         if len(text) <= self.chunk_size:
@@ -412,5 +973,51 @@ class DocumentProcessor:
         return self.allowed_extensions.copy()
 
 
+
+class _SectionBuilder:
+    """Acumula bloques de texto en secciones según la jerarquía de títulos"""
+    
+    def __init__(self):
+        self.sections: List[Dict[str, Any]] = []
+        self.heading_path: List[str] = []
+        self.levels: List[int] = []
+        self.paragraphs: List[str] = []
+        self.current: List[str] = []
+    
+    def heading(self, level: int, title: str):
+        """Cierra la sección actual y abre una nueva bajo el título dado"""
+        self._close_section()
+        while self.levels and self.levels[-1] >= level:
+            self.levels.pop()
+            self.heading_path.pop()
+        self.levels.append(level)
+        self.heading_path.append(title)
+    
+    def add(self, line: str):
+        """Agrega una línea al párrafo en curso"""
+        self.current.append(line)
+    
+    def paragraph_break(self):
+        """Cierra el párrafo en curso"""
+        if self.current:
+            self.paragraphs.append("\n".join(self.current).strip())
+            self.current = []
+    
+    def finish(self) -> List[Dict[str, Any]]:
+        """Cierra la última sección y retorna todas las secciones con contenido"""
+        self._close_section()
+        return self.sections
+    
+    def _close_section(self):
+        self.paragraph_break()
+        text = "\n\n".join(p for p in self.paragraphs if p)
+        if text.strip():
+            self.sections.append({
+                "heading_path": list(self.heading_path),
+                "text": text.strip()
+            })
+        self.paragraphs = []
+
+
 # Instancia global del servicio
-document_processor = DocumentProcessor()
\ No newline at end of file
+document_processor = DocumentProcessor()
@@ -1,9 +1,12 @@
 import os
+import asyncio
 import logging
 from typing import List
 from pinecone import Pinecone
 from dotenv import load_dotenv
 
+from .rate_limiter import pinecone_embed_limiter, estimate_tokens, BULK, INTERACTIVE
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -24,17 +27,26 @@ class EmbeddingServicePinecone:
         self.pc = Pinecone(api_key=api_key)
         
         # Usar el modelo de Pinecone (gratis, no consume RAM local)
-        self.model_name = "multilingual-e5-large"
+        self.model_name = os.getenv("PINECONE_EMBEDDING_MODEL", "multilingual-e5-large")
         self.dimension = 384  # Dimensión del modelo
+        # Máximo de textos por llamada a la Inference API (límite del modelo: 96)
+        self.batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "96"))
         
         logger.info(f"EmbeddingServicePinecone inicializado con modelo: {self.model_name}")
     
-    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+    async def generate_embeddings(
+        self,
+        texts: List[str],
+        priority: str = BULK,
+        input_type: str = "passage"
+    ) -> List[List[float]]:
         """
         Genera embeddings usando Pinecone Inference API
         
         Args:
             texts: Lista de textos
+            priority: Prioridad ante el límite de la API (por defecto ingesta masiva)
+            input_type: 'passage' para chunks, 'query' para preguntas
             
         Returns:
             Lista de vectores de embeddings
@@ -43,15 +55,22 @@ class EmbeddingServicePinecone:
             if not texts:
                 return []
             
-            # Usar Pinecone Inference API
-            embeddings = self.pc.inference.embed(
-                model=self.model_name,
-                inputs=texts,
-                parameters={"input_type": "passage"}
-            )
-            
-            # Extraer los vectores
-            vectors = [embedding['values'] for embedding in embeddings]
+            # Usar Pinecone Inference API, en lotes de batch_size textos
+            vectors = []
+            for i in range(0, len(texts), self.batch_size):
+                batch = texts[i:i + self.batch_size]
+                await pinecone_embed_limiter.acquire(sum(estimate_tokens(text) for text in batch), priority)
+                
+                # En un hilo aparte para no bloquear el event loop durante la llamada HTTP
+                embeddings = await asyncio.to_thread(
+                    self.pc.inference.embed,
+                    model=self.model_name,
+                    inputs=batch,
+                    parameters={"input_type": input_type}
+                )
+                
+                # Extraer los vectores
+                vectors.extend(embedding['values'] for embedding in embeddings)
             
             logger.info(f"Generados {len(vectors)} embeddings usando Pinecone Inference")
             return vectors
@@ -71,8 +90,11 @@ class EmbeddingServicePinecone:
             Vector de embedding
         """
         try:
-            # Usar Pinecone Inference API con input_type query
-            embeddings = self.pc.inference.embed(
+            await pinecone_embed_limiter.acquire(estimate_tokens(query), INTERACTIVE)
+            
+            # Usar Pinecone Inference API con input_type query (en un hilo, para no bloquear el event loop)
+            embeddings = await asyncio.to_thread(
+                self.pc.inference.embed,
                 model=self.model_name,
                 inputs=[query],
                 parameters={"input_type": "query"}
@@ -1,9 +1,17 @@
 import os
+import re
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional
-from groq import Groq
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import httpx
+from groq import AsyncGroq
 from dotenv import load_dotenv
 
+from .rate_limiter import groq_limiter, estimate_tokens, BULK, INTERACTIVE
+from .context_packer import token_counter
+from .metrics import metrics
+from .llm_router import llm_router, RoutedResult, COMPLETION, FIRST_TOKEN
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -27,12 +35,23 @@ class GroqService:
         # Log para verificar que la key se está cargando (solo primeros y últimos caracteres por seguridad)
         logger.info(f"API Key cargada: {api_key[:10]}...{api_key[-10:] if len(api_key) > 20 else 'corta'}")
         
-        # Inicializar cliente Groq
-        self.client = Groq(api_key=api_key)
+        # Cliente async de Groq: se crea al primer uso, dentro del event loop
+        self.api_key = api_key
+        self._client: Optional[AsyncGroq] = None
+        self._client_loop = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        
+        # Timeout por llamada, conexiones HTTP reutilizables y generaciones simultáneas
+        self.timeout_seconds = float(os.getenv("GROQ_TIMEOUT_SECONDS", "30"))
+        self.max_connections = int(os.getenv("GROQ_MAX_CONNECTIONS", "20"))
+        self.max_concurrency = int(os.getenv("GROQ_MAX_CONCURRENCY", "8"))
         
         self.model_name = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
         logger.info(f"Modelo Groq configurado: {self.model_name}")
         
+        # Modelo barato para tareas de fondo (resúmenes de conversación)
+        self.summary_model_name = os.getenv("GROQ_SUMMARY_MODEL", "llama-3.1-8b-instant")
+        
         try:
             # Test básico del modelo
             logger.info("Servicio Groq inicializado correctamente")
@@ -76,11 +95,13 @@ class GroqService:
                 text = metadata.get('text', '')
                 source = metadata.get('source', 'Documento')
                 page = metadata.get('page', 'N/A')
+                section = metadata.get('section', '')
                 
                 if source not in sources_list:
                     sources_list.append(source)
                 
-                context_text += f"[Fuente {i}] {source} (Página {page}):\n{text}\n\n"
+                location = f"Sección: {section}" if section else f"Página {page}"
+                context_text += f"[Fuente {i}] {source} ({location}):\n{text}\n\n"
         
         # Lista de archivos para el prompt
         files_text = ", ".join(sources_list) if sources_list else "documentos cargados"
@@ -117,37 +138,83 @@ Pregunta: {user_question}"""
 
         return prompt
     
-    async def generate_response(
+    @property
+    def client(self) -> AsyncGroq:
+        """Cliente AsyncGroq compartido (ver _ensure_client)"""
+        return self._ensure_client()
+    
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """Limita las generaciones simultáneas del proceso"""
+        self._ensure_client()
+        return self._semaphore
+    
+    def _ensure_client(self) -> AsyncGroq:
+        """
+        Crea el cliente AsyncGroq con un pool de conexiones httpx compartido
+        
+        Las conexiones quedan ligadas al event loop que las abrió, así que el
+        cliente (y su semáforo) se recrean si cambia el loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                timeout=httpx.Timeout(self.timeout_seconds, connect=5.0)
+            )
+            # Los reintentos y el fallback entre modelos los maneja llm_router
+            self._client = AsyncGroq(
+                api_key=self.api_key,
+                http_client=http_client,
+                timeout=self.timeout_seconds,
+                max_retries=0
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._client_loop = loop
+        return self._client
+    
+    async def aclose(self) -> None:
+        """Cierra el pool de conexiones del cliente"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            self._client_loop = None
+    
+    def build_messages(
         self,
         user_question: str,
         context_chunks: List[Dict[str, Any]] = None,
         chatbot_name: str = "Asistente",
         conversation_history: List[Dict[str, str]] = None,
-        has_documents: bool = None  # Nuevo: indica si el chatbot tiene documentos cargados
-    ) -> Dict[str, Any]:
+        has_documents: bool = None,
+        conversation_summary: Optional[str] = None
+    ) -> List[Dict[str, str]]:
         """
-        Genera una respuesta usando Groq/Llama3 con contexto RAG
+        Arma los mensajes del chat (system, resumen, historial y prompt RAG)
         
         Args:
             user_question: Pregunta del usuario
             context_chunks: Chunks de contexto relevante de Pinecone
             chatbot_name: Nombre del chatbot personalizado
-            conversation_history: Historial de conversación (opcional)
+            conversation_history: Últimos mensajes de la conversación (opcional, ya acotados)
             has_documents: Si el chatbot tiene documentos cargados
+            conversation_summary: Resumen de los mensajes anteriores (opcional)
             
         Returns:
-            Dict con la respuesta y metadatos
+            List[Dict]: Mensajes para la API de chat
         """
-        try:
-            # Determinar si hay documentos
-            has_docs = has_documents if has_documents is not None else bool(context_chunks)
-            
-            # Crear prompt con contexto RAG
-            if context_chunks:
-                prompt = self.create_rag_prompt(user_question, context_chunks, chatbot_name)
-            elif has_docs:
-                # ✅ Hay documentos pero no se encontró contexto suficientemente relevante
-                prompt = f"""Eres {chatbot_name}, un asistente especializado que SOLO responde sobre documentos específicos.
+        # Determinar si hay documentos
+        has_docs = has_documents if has_documents is not None else bool(context_chunks)
+        
+        # Crear prompt con contexto RAG
+        if context_chunks:
+            prompt = self.create_rag_prompt(user_question, context_chunks, chatbot_name)
+        elif has_docs:
+            # ✅ Hay documentos pero no se encontró contexto suficientemente relevante
+            prompt = f"""Eres {chatbot_name}, un asistente especializado que SOLO responde sobre documentos específicos.
 
 **SITUACIÓN**: Tienes documentos cargados pero NO encontraste información relevante para esta pregunta.
 
@@ -160,44 +227,90 @@ Pregunta: {user_question}"""
 Pregunta: {user_question}
 
 Respuesta (siguiendo las instrucciones estrictas):"""
-            else:
-                # Fallback sin contexto ni documentos
-                prompt = f"""Eres {chatbot_name}, un asistente útil.
+        else:
+            # Fallback sin contexto ni documentos
+            prompt = f"""Eres {chatbot_name}, un asistente útil.
 
 Pregunta: {user_question}
 
 Responde de manera clara y educativa."""
 
-            # Preparar mensajes para el chat
-            messages = [
-                {
-                    "role": "system",
-                    "content": "Eres un asistente especializado RAG. SOLO respondes basándote en documentos proporcionados. PROHIBIDO inventar información o usar conocimiento previo cuando trabajas con documentos. Si no tienes la información en los documentos, di claramente que no la encontraste."
-                }
-            ]
-
-            # Agregar historial de conversación si existe
-            if conversation_history:
-                for msg in conversation_history[-3:]:  # Solo últimos 3 mensajes
-                    role = "user" if msg.get("sender") == "user" else "assistant"
-                    messages.append({
-                        "role": role,
-                        "content": msg.get("text", "")
-                    })
-            
-            # Agregar pregunta actual
+        # Preparar mensajes para el chat
+        messages = [
+            {
+                "role": "system",
+                "content": "Eres un asistente especializado RAG. SOLO respondes basándote en documentos proporcionados. PROHIBIDO inventar información o usar conocimiento previo cuando trabajas con documentos. Si no tienes la información en los documentos, di claramente que no la encontraste."
+            }
+        ]
+
+        # Resumen de la parte de la conversación que ya no va textual
+        if conversation_summary:
             messages.append({
-                "role": "user",
-                "content": prompt
+                "role": "system",
+                "content": f"Resumen de la conversación hasta ahora:\n{conversation_summary}"
             })
+        
+        # Agregar historial de conversación si existe
+        if conversation_history:
+            for msg in conversation_history:
+                role = "user" if msg.get("sender") == "user" else "assistant"
+                messages.append({
+                    "role": role,
+                    "content": msg.get("text", "")
+                })
+        
+        # Agregar pregunta actual
+        messages.append({
+            "role": "user",
+            "content": prompt
+        })
+        
+        return messages
+    
+    async def generate_response(
+        self,
+        user_question: str,
+        context_chunks: List[Dict[str, Any]] = None,
+        chatbot_name: str = "Asistente",
+        conversation_history: List[Dict[str, str]] = None,
+        has_documents: bool = None,  # Nuevo: indica si el chatbot tiene documentos cargados
+        conversation_summary: Optional[str] = None,
+        time_budget: Optional[float] = None,
+        priority: str = INTERACTIVE
+    ) -> Dict[str, Any]:
+        """
+        Genera una respuesta usando Groq/Llama3 con contexto RAG
+        
+        Args:
+            user_question: Pregunta del usuario
+            context_chunks: Chunks de contexto relevante de Pinecone
+            chatbot_name: Nombre del chatbot personalizado
+            conversation_history: Historial de conversación (opcional)
+            has_documents: Si el chatbot tiene documentos cargados
+            conversation_summary: Resumen de los mensajes anteriores (opcional)
+            time_budget: Segundos que quedan del turno (por defecto LLM_TURN_BUDGET_SECONDS)
+            priority: Prioridad ante el límite de la API (BULK para lotes de preguntas)
             
-            # Generar respuesta
-            response = await self._generate_with_retry(messages)
+        Returns:
+            Dict con la respuesta y metadatos
+        """
+        try:
+            messages = self.build_messages(
+                user_question, context_chunks, chatbot_name, conversation_history, has_documents,
+                conversation_summary
+            )
+            
+            prompt_tokens = self.count_prompt_tokens(messages)
+            
+            # Generar respuesta (con fallback y hedging entre modelos)
+            routed = await self._generate_routed(messages, priority=priority, time_budget=time_budget)
             
             return {
                 "success": True,
-                "response": response,
-                "model_used": self.model_name,
+                "response": routed.value,
+                "prompt_tokens": prompt_tokens,
+                "model_used": routed.model,
+                "hedged": routed.hedged,
                 "context_used": len(context_chunks) if context_chunks else 0,
                 "sources": [chunk.get('metadata', {}).get('source', 'Desconocido') 
                            for chunk in context_chunks] if context_chunks else []
@@ -214,108 +327,385 @@ Responde de manera clara y educativa."""
                 "sources": []
             }
     
-    async def _generate_with_retry(self, messages: List[Dict[str, str]], max_retries: int = 3) -> str:
+    def count_prompt_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """Tokens del prompt con el tokenizer del modelo (se registran en las métricas)"""
+        tokens = token_counter.count_messages(messages)
+        metrics.observe("chat_prompt_tokens", tokens)
+        return tokens
+    
+    async def _generate_routed(
+        self,
+        messages: List[Dict[str, str]],
+        priority: str = INTERACTIVE,
+        time_budget: Optional[float] = None
+    ) -> RoutedResult:
         """
-        Genera respuesta con reintentos en caso de error
+        Genera la respuesta con el modelo que elija llm_router
+        
+        El router reintenta con otro modelo (backoff con jitter) y lanza una
+        copia a un modelo más rápido si la llamada tarda más que su p95, sin
+        exceder el tiempo del turno. Cada solicitud a Groq espera su cuota en
+        el limitador (ver _rate_limited) y la copia comparte el cupo del
+        semáforo con la llamada original.
         
         Args:
             messages: Lista de mensajes para el chat
-            max_retries: Número máximo de reintentos
+            priority: Prioridad ante el límite de la API
+            time_budget: Segundos disponibles para la generación
             
         Returns:
-            str: Respuesta generada
+            RoutedResult: Texto generado y modelo que respondió
+        """
+        estimated_tokens = sum(estimate_tokens(msg["content"]) for msg in messages)
+        
+        async def call(model: str) -> str:
+            chat_completion = await self.client.chat.completions.create(
+                messages=messages,
+                model=model,
+                temperature=self.generation_config['temperature'],
+                max_tokens=self.generation_config['max_tokens'],
+                top_p=self.generation_config['top_p']
+            )
+            groq_limiter.settle(estimated_tokens, _total_tokens(chat_completion))
+            
+            if chat_completion.choices and chat_completion.choices[0].message.content:
+                return chat_completion.choices[0].message.content.strip()
+            return "Lo siento, no pude generar una respuesta adecuada."
+        
+        async with self.semaphore:
+            return await llm_router.run(_rate_limited(call, estimated_tokens, priority), COMPLETION, time_budget)
+    
+    async def stream_response(
+        self,
+        messages: List[Dict[str, str]],
+        priority: str = INTERACTIVE,
+        time_budget: Optional[float] = None
+    ) -> AsyncIterator[str]:
         """
-        for attempt in range(max_retries):
+        Genera una respuesta en streaming, entregando el texto a medida que
+        Groq lo produce
+        
+        El router elige el modelo hasta el primer fragmento: si no llega a
+        tiempo se abre un stream con otro modelo y se sigue con el primero
+        que responda. Una tarea aparte lee el stream de Groq hacia una cola y
+        suelta el cupo del semáforo apenas termina la generación, sin esperar
+        a que el cliente consuma los fragmentos. Si el consumidor deja de
+        leer, la tarea se cancela y se cierra el stream.
+        
+        Args:
+            messages: Mensajes del chat (ver build_messages)
+            priority: Prioridad ante el límite de la API
+            time_budget: Segundos disponibles hasta el primer fragmento
+            
+        Yields:
+            str: Fragmentos de texto de la respuesta
+        """
+        estimated_tokens = sum(estimate_tokens(msg["content"]) for msg in messages)
+        
+        async def open_stream(model: str):
+            stream = await self.client.chat.completions.create(
+                messages=messages,
+                model=model,
+                temperature=self.generation_config['temperature'],
+                max_tokens=self.generation_config['max_tokens'],
+                top_p=self.generation_config['top_p'],
+                stream=True
+            )
+            chunks = stream.__aiter__()
             try:
-                chat_completion = self.client.chat.completions.create(
-                    messages=messages,
-                    model=self.model_name,
-                    temperature=self.generation_config['temperature'],
-                    max_tokens=self.generation_config['max_tokens'],
-                    top_p=self.generation_config['top_p']
-                )
-                
-                if chat_completion.choices and chat_completion.choices[0].message.content:
-                    return chat_completion.choices[0].message.content.strip()
-                else:
-                    return "Lo siento, no pude generar una respuesta adecuada."
-                    
+                async for chunk in chunks:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        return stream, chunks, chunk.choices[0].delta.content
+            except BaseException:
+                await stream.close()
+                raise
+            return stream, chunks, None
+        
+        async def close_stream(opened) -> None:
+            await opened[0].close()
+        
+        # Fragmentos de texto; None marca el fin y una excepción, el error
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def pump() -> None:
+            try:
+                async with self.semaphore:
+                    routed = await llm_router.run(
+                        _rate_limited(open_stream, estimated_tokens, priority),
+                        FIRST_TOKEN, time_budget, discard=close_stream
+                    )
+                    stream, chunks, first_text = routed.value
+                    try:
+                        if first_text:
+                            queue.put_nowait(first_text)
+                        async for chunk in chunks:
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                queue.put_nowait(chunk.choices[0].delta.content)
+                    finally:
+                        await stream.close()
             except Exception as e:
-                logger.warning(f"Intento {attempt + 1} falló: {str(e)}")
-                if attempt == max_retries - 1:
-                    raise e
-                
-        return "Error generando respuesta después de múltiples intentos."
+                queue.put_nowait(e)
+            else:
+                queue.put_nowait(None)
+        
+        producer = asyncio.create_task(pump())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            producer.cancel()
     
-    async def generate_title_for_conversation(
+    async def generate_titles(
         self,
-        first_message: str,
+        first_messages: List[str],
         max_length: int = 50
-    ) -> str:
+    ) -> List[Optional[str]]:
         """
-        Genera un título conciso para una conversación basado en el primer mensaje
+        Genera los títulos de varias conversaciones en una sola llamada
         
         Args:
-            first_message: Primer mensaje de la conversación
-            max_length: Longitud máxima del título
+            first_messages: Primer mensaje de cada conversación
+            max_length: Longitud máxima de cada título
             
         Returns:
-            str: Título generado
+            List: Un título por mensaje, en el mismo orden (None si no se obtuvo)
         """
-        try:
-            messages = [
-                {
-                    "role": "system",
-                    "content": "Eres un experto en crear títulos concisos y descriptivos."
-                },
-                {
-                    "role": "user", 
-                    "content": f"""Genera un título conciso y descriptivo para una conversación que comienza con esta pregunta:
-
-"{first_message}"
-
-El título debe:
+        if not first_messages:
+            return []
+        
+        numbered = "\n".join(
+            f"{i}. {' '.join(message.split())[:300]}"
+            for i, message in enumerate(first_messages, start=1)
+        )
+        messages = [
+            {
+                "role": "system",
+                "content": "Eres un experto en crear títulos concisos y descriptivos."
+            },
+            {
+                "role": "user",
+                "content": f"""Genera un título para cada conversación, según la pregunta con que comienza:
+
+{numbered}
+
+Cada título debe:
 - Ser máximo {max_length} caracteres
 - Describir el tema principal
-- Ser claro y específico
 - No incluir comillas
 
-TÍTULO:"""
-                }
-            ]
+Responde solo con una línea por conversación, con su mismo número: "1. Título"
 
-            chat_completion = self.client.chat.completions.create(
-                messages=messages,
-                model=self.model_name,
-                temperature=0.3,  # Más determinístico para títulos
-                max_tokens=20,
-                top_p=0.8
-            )
+TÍTULOS:"""
+            }
+        ]
+        max_tokens = 20 * len(first_messages)
+        titles: List[Optional[str]] = [None] * len(first_messages)
+        
+        try:
+            # Los títulos no compiten con la cuota reservada al chat
+            estimated_tokens = sum(estimate_tokens(msg["content"]) for msg in messages) + max_tokens
+            await groq_limiter.acquire(estimated_tokens, BULK)
+            async with self.semaphore:
+                chat_completion = await self.client.chat.completions.create(
+                    messages=messages,
+                    model=self.summary_model_name,
+                    temperature=0.3,
+                    max_tokens=max_tokens
+                )
+            groq_limiter.settle(estimated_tokens, _total_tokens(chat_completion))
+            
+            content = chat_completion.choices[0].message.content if chat_completion.choices else None
+            for line in (content or "").splitlines():
+                match = re.match(r"^\s*(\d+)[.):-]\s*(.+)$", line)
+                if match and 1 <= int(match.group(1)) <= len(titles):
+                    titles[int(match.group(1)) - 1] = _clean_title(match.group(2), max_length) or None
+            
+        except Exception as e:
+            logger.error(f"Error generando títulos: {str(e)}")
+        
+        return titles
+    
+    async def suggest_questions(
+        self,
+        documents: List[str],
+        topics: List[str],
+        count: int = 3
+    ) -> List[str]:
+        """
+        Sugiere preguntas de ejemplo sobre los documentos de un chatbot
+        
+        Args:
+            documents: Nombres de los documentos
+            topics: Temas principales (títulos de sección o fragmentos)
+            count: Cantidad de preguntas
+            
+        Returns:
+            List[str]: Preguntas sugeridas (vacía si falla)
+        """
+        if not documents and not topics:
+            return []
+        
+        messages = [
+            {
+                "role": "system",
+                "content": "Sugieres preguntas breves y concretas que un usuario haría sobre un conjunto de documentos."
+            },
+            {
+                "role": "user",
+                "content": f"""Documentos:
+{chr(10).join(f"- {name}" for name in documents[:20])}
+
+Temas:
+{chr(10).join(f"- {topic}" for topic in topics[:10])}
+
+Escribe {count} preguntas que se puedan responder con estos documentos, una por línea, sin numeración ni comillas.
+
+PREGUNTAS:"""
+            }
+        ]
+        max_tokens = 40 * count
+        
+        try:
+            # Las sugerencias no compiten con la cuota reservada al chat
+            estimated_tokens = sum(estimate_tokens(msg["content"]) for msg in messages) + max_tokens
+            await groq_limiter.acquire(estimated_tokens, BULK)
+            async with self.semaphore:
+                chat_completion = await self.client.chat.completions.create(
+                    messages=messages,
+                    model=self.summary_model_name,
+                    temperature=0.5,
+                    max_tokens=max_tokens
+                )
+            groq_limiter.settle(estimated_tokens, _total_tokens(chat_completion))
+            
+            content = chat_completion.choices[0].message.content if chat_completion.choices else None
+            questions = []
+            for line in (content or "").splitlines():
+                question = re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip().strip('"').strip()
+                if question:
+                    questions.append(question)
+            return questions[:count]
+            
+        except Exception as e:
+            logger.error(f"Error sugiriendo preguntas: {str(e)}")
+            return []
+    
+    async def summarize_conversation(
+        self,
+        previous_summary: Optional[str],
+        new_messages: List[Dict[str, Any]],
+        max_tokens: int = 300
+    ) -> Optional[str]:
+        """
+        Actualiza el resumen de una conversación con mensajes nuevos
+        
+        Args:
+            previous_summary: Resumen actual (None si aún no hay)
+            new_messages: Mensajes a incorporar, en orden ({"sender", "text"})
+            max_tokens: Largo máximo del resumen
+            
+        Returns:
+            str: Resumen actualizado, o None si falla
+        """
+        transcript = "\n".join(
+            f"{'Usuario' if msg.get('sender') == 'user' else 'Asistente'}: {msg.get('text', '')[:2000]}"
+            for msg in new_messages
+        )
+        messages = [
+            {
+                "role": "system",
+                "content": "Resumes conversaciones de forma breve y fiel, sin agregar información."
+            },
+            {
+                "role": "user",
+                "content": f"""Resumen actual de la conversación:
+{previous_summary or "(vacío)"}
+
+Mensajes nuevos:
+{transcript}
+
+Escribe el resumen actualizado incorporando los mensajes nuevos. Conserva las preguntas del usuario, los datos concretos y las conclusiones de las respuestas. Máximo {max_tokens * 3 // 4} palabras, sin introducción.
+
+RESUMEN:"""
+            }
+        ]
+        
+        try:
+            # Los resúmenes no compiten con la cuota reservada al chat
+            estimated_tokens = sum(estimate_tokens(msg["content"]) for msg in messages) + max_tokens
+            await groq_limiter.acquire(estimated_tokens, BULK)
+            async with self.semaphore:
+                chat_completion = await self.client.chat.completions.create(
+                    messages=messages,
+                    model=self.summary_model_name,
+                    temperature=0.2,
+                    max_tokens=max_tokens
+                )
+            groq_limiter.settle(estimated_tokens, _total_tokens(chat_completion))
             
             if chat_completion.choices and chat_completion.choices[0].message.content:
-                title = chat_completion.choices[0].message.content.strip().strip('"').strip("'")
-                
-                # Truncar si es necesario
-                if len(title) > max_length:
-                    title = title[:max_length-3] + "..."
-                    
-                return title if title else "Nueva conversación"
-            else:
-                return "Nueva conversación"
+                return chat_completion.choices[0].message.content.strip()
+            return None
             
         except Exception as e:
-            logger.error(f"Error generando título: {str(e)}")
-            return "Nueva conversación"
+            logger.error(f"Error generando resumen de conversación: {str(e)}")
+            return None
     
     def get_model_info(self) -> Dict[str, Any]:
         """Retorna información sobre el modelo configurado"""
         return {
             "model_name": self.model_name,
+            "fallback_models": llm_router.fallback_models,
             "temperature": self.generation_config.get('temperature'),
             "max_tokens": self.generation_config.get('max_tokens'),
             "provider": "Groq (Llama3)"
         }
 
 
+def _clean_title(title: str, max_length: int) -> str:
+    """Título sin comillas ni espacios sobrantes, truncado a max_length"""
+    title = title.strip().strip('"').strip("'").strip()
+    if len(title) > max_length:
+        title = title[:max_length-3] + "..."
+    return title
+
+
+def _rate_limited(
+    call: Callable[[str], Awaitable[Any]],
+    estimated_tokens: int,
+    priority: str
+) -> Callable[[str], Awaitable[Any]]:
+    """
+    Envuelve la llamada del router para que cada solicitud a Groq (reintentos
+    y copias incluidos) espere su cuota en groq_limiter. La que se lanza
+    mientras otra del mismo turno sigue en curso es una copia (hedge) y va
+    como BULK, para no gastar la cuota reservada al chat.
+    """
+    in_flight = 0
+    
+    async def limited(model: str) -> Any:
+        nonlocal in_flight
+        request_priority = BULK if in_flight else priority
+        in_flight += 1
+        try:
+            await groq_limiter.acquire(estimated_tokens, request_priority)
+            return await call(model)
+        finally:
+            in_flight -= 1
+    
+    return limited
+
+
+def _total_tokens(chat_completion) -> Optional[int]:
+    """Tokens consumidos según la respuesta de Groq, si los informa"""
+    usage = getattr(chat_completion, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage else None
+
+
 # Instancia global del servicio
 groq_service = GroqService()
\ No newline at end of file
@@ -0,0 +1,541 @@
+import os
+import time
+import asyncio
+import itertools
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from database import SessionLocal
+from models import ChatbotDocument, CustomChatbot, IngestionJob, JobStatus
+from .pinecone_service import pinecone_service
+from .document_processor import document_processor, ExtractionError, EXTRACTOR_VERSION
+from .embedding_service_pinecone import embedding_service
+from .job_queue import job_queue
+from . import ingestion_progress
+from .ingestion_progress import ProgressTracker, STAGES
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionError(Exception):
+    """Error de procesamiento que puede resolverse reintentando"""
+
+
+class PermanentIngestionError(IngestionError):
+    """Error de procesamiento que no se resuelve reintentando (archivo inválido, sin texto, ...)"""
+
+
+# Marca de fin de stream entre etapas del pipeline
+_END = object()
+
+
+def build_chunk_vectors(chunks: List[dict], embeddings: List[List[float]]) -> List[dict]:
+    """
+    Arma los vectores de Pinecone para una lista de chunks
+
+    El ID de cada vector se deriva del documento y número de chunk de su
+    metadata, por lo que un mismo lote puede mezclar chunks de varios documentos.
+    """
+    vectors = []
+    for chunk, embedding in zip(chunks, embeddings):
+        vector_metadata = {
+            **chunk["metadata"],
+            "text": chunk["text"],
+            "chunk_number": chunk["chunk_number"],
+            "char_count": chunk["char_count"],
+            "word_count": chunk["word_count"]
+        }
+
+        vectors.append({
+            "id": f"doc_{chunk['metadata']['document_id']}_chunk_{chunk['chunk_number'] - 1}",
+            "values": embedding,
+            "metadata": vector_metadata
+        })
+    return vectors
+
+
+class _DocumentRun:
+    """Estado de un documento dentro de un pipeline de ingesta"""
+
+    def __init__(self, db: Session, document: ChatbotDocument):
+        self.db = db
+        self.document = document
+        self.metadata = {
+            "source": document.original_filename,
+            "chatbot_id": document.chatbot_id,
+            "document_id": document.id,
+            "file_type": document.file_type
+        }
+        self.tracker = ProgressTracker(db, document)
+        self.busy: Dict[str, float] = {}
+        self.next_number = 1
+        self.total: Optional[int] = None  # Se conoce al terminar de dividir el documento
+        self.resume_from = 0  # Chunks ya confirmados por un intento anterior
+        self.uploaded = 0
+        self.finished = False
+        self.error: Optional[str] = None
+
+    def record_time(self, stage: str, seconds: float):
+        self.busy[stage] = self.busy.get(stage, 0.0) + seconds
+
+    def advance(self, stage: str):
+        # La etapa visible es la más avanzada que ya recibió trabajo
+        current = self.tracker.record.stage
+        if current not in STAGES or STAGES.index(stage) > STAGES.index(current):
+            self.tracker.record.stage = stage
+
+    def fail(self, error: str):
+        self.error = error
+        logger.error(f"Error procesando {self.document.original_filename}: {error}")
+
+    def finish_if_done(self):
+        """
+        Marca el documento como procesado cuando todos sus chunks están en
+        Pinecone. Progreso y documento se confirman en una sola transacción.
+        """
+        if self.finished or self.error or self.total is None or self.uploaded < self.total:
+            return
+        self.finished = True
+        self.tracker.add_timings(self.busy, commit=False)
+        self.tracker.complete()
+        self.document.is_processed = True
+        self.document.chunks_count = self.total
+        self.document.processed_at = datetime.utcnow()
+        self.db.commit()
+        logger.info(f"Documento procesado exitosamente: {self.document.original_filename}, {self.total} chunks creados")
+
+
+def _load_chatbot(db: Session, chatbot_id: int) -> CustomChatbot:
+    chatbot = db.query(CustomChatbot).filter(
+        CustomChatbot.id == chatbot_id
+    ).first()
+
+    if not chatbot:
+        raise PermanentIngestionError(f"Chatbot {chatbot_id} no encontrado")
+    return chatbot
+
+
+async def process_document(db: Session, document_id: int, chatbot_id: int) -> int:
+    """
+    Extrae, divide, embebe y sube a Pinecone un documento
+
+    Args:
+        db: Sesión de base de datos
+        document_id: ID del documento
+        chatbot_id: ID del chatbot
+
+    Returns:
+        int: Número de chunks creados
+
+    Raises:
+        PermanentIngestionError: Si el documento no puede procesarse
+        IngestionError: Si falla un paso que puede reintentarse
+    """
+    document = db.query(ChatbotDocument).filter(
+        ChatbotDocument.id == document_id
+    ).first()
+
+    if not document:
+        raise PermanentIngestionError(f"Documento {document_id} no encontrado")
+
+    chatbot = _load_chatbot(db, chatbot_id)
+
+    logger.info(f"Procesando documento: {document.original_filename}")
+
+    run = _DocumentRun(db, document)
+    await _run_pipeline(chatbot, [run])
+
+    if run.error:
+        raise PermanentIngestionError(run.error)
+
+    return run.total
+
+
+async def process_documents_batch(db: Session, document_ids: List[int], chatbot_id: int) -> Dict[str, Any]:
+    """
+    Procesa varios documentos en un solo pipeline, compartiendo los lotes de
+    embeddings y upserts entre archivos
+
+    Los documentos ya procesados (p. ej. en un intento anterior del mismo
+    trabajo) se omiten. Un documento inválido se marca como fallido sin
+    detener al resto; un error reintentable detiene el lote y el reintento
+    continúa con los documentos que no alcanzaron a completarse.
+
+    Args:
+        db: Sesión de base de datos
+        document_ids: IDs de los documentos
+        chatbot_id: ID del chatbot
+
+    Returns:
+        Dict con los IDs completados y los fallidos con su error
+    """
+    chatbot = _load_chatbot(db, chatbot_id)
+
+    documents = db.query(ChatbotDocument).filter(
+        ChatbotDocument.id.in_(document_ids),
+        ChatbotDocument.chatbot_id == chatbot_id,
+        ChatbotDocument.is_processed == False
+    ).order_by(ChatbotDocument.id.asc()).all()
+
+    if not documents:
+        return {"completed": [], "failed": {}}
+
+    logger.info(f"Procesando lote de {len(documents)} documentos del chatbot {chatbot_id}")
+
+    runs = [_DocumentRun(db, document) for document in documents]
+    await _run_pipeline(chatbot, runs)
+
+    failed = {}
+    for run in runs:
+        if run.error:
+            failed[run.document.id] = run.error
+            ingestion_progress.mark_failed(db, run.document.id, run.error, will_retry=False)
+
+    return {
+        "completed": [run.document.id for run in runs if run.finished],
+        "failed": failed
+    }
+
+
+async def _run_pipeline(chatbot: CustomChatbot, runs: List[_DocumentRun]) -> None:
+    """
+    Procesa documentos como un pipeline de etapas concurrentes conectadas
+    por colas acotadas: extract -> chunk -> embed -> upsert
+
+    Mientras se extraen las páginas siguientes ya se embeben los primeros
+    chunks, y los upserts se solapan con los embeddings, por lo que el tiempo
+    total tiende al de la etapa más lenta. Las colas acotadas limitan la
+    memoria: una etapa rápida espera a la siguiente en lugar de acumular.
+
+    Los documentos se extraen uno tras otro, pero sus chunks se empaquetan en
+    lotes completos sin importar a qué documento pertenecen; cada documento se
+    marca como procesado en cuanto su último chunk llega a Pinecone. Las hojas
+    de cálculo se saltan la división (la lectura de filas ya produce chunks).
+
+    Un documento inválido queda con error en su _DocumentRun sin detener a
+    los demás; los errores reintentables se propagan. Si un intento anterior
+    dejó un checkpoint válido, el documento se vuelve a extraer y dividir
+    (la extracción suele venir del cache) pero solo se embeben y suben los
+    chunks posteriores al checkpoint.
+    """
+    queue_size = int(os.getenv("INGESTION_QUEUE_SIZE", "4"))
+    batch_size = embedding_service.batch_size
+    segments_q: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    chunks_q: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    vectors_q: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def share_time(stage: str, batch: List[tuple], seconds: float):
+        # El tiempo de un lote compartido se reparte según los chunks de cada documento
+        for run, count in _count_by_run(batch).items():
+            run.record_time(stage, seconds * count / len(batch))
+
+    async def extract_document(run: _DocumentRun):
+        if document_processor.is_spreadsheet(run.document.file_path):
+            rows = document_processor.iter_spreadsheet_chunks(run.document.file_path, run.metadata)
+            while True:
+                started = time.perf_counter()
+                chunks = await asyncio.to_thread(lambda: list(itertools.islice(rows, batch_size)))
+                run.record_time("extract", time.perf_counter() - started)
+                if not chunks:
+                    break
+                await segments_q.put(("chunks", run, chunks))
+            return
+
+        segments = document_processor.iter_text_segments(run.document.file_path)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    segment = await segments.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    run.record_time("extract", time.perf_counter() - started)
+                await segments_q.put(("segment", run, segment))
+        finally:
+            await segments.aclose()
+
+    async def extract_stage():
+        for run in runs:
+            run.advance("extract")
+            try:
+                signature = await asyncio.to_thread(_processing_signature, run.document.file_path)
+                run.resume_from = run.uploaded = run.tracker.resume_checkpoint(signature)
+                await extract_document(run)
+            except (ExtractionError, FileNotFoundError) as e:
+                run.fail(str(e))
+            await segments_q.put(("end", run, None))
+        await segments_q.put(_END)
+
+    async def chunk_stage():
+        batch: List[tuple] = []
+        while (item := await segments_q.get()) is not _END:
+            kind, run, payload = item
+            if kind == "end":
+                run.total = run.next_number - 1
+                run.tracker.set_total(run.total)
+                if not run.total and not run.error:
+                    run.fail("No se pudieron crear chunks del documento")
+                run.finish_if_done()
+                continue
+
+            if kind == "segment":
+                run.advance("chunk")
+                started = time.perf_counter()
+                chunks = document_processor.create_segment_chunks(payload, run.metadata, start_number=run.next_number)
+                run.record_time("chunk", time.perf_counter() - started)
+            else:
+                chunks = payload
+            run.next_number += len(chunks)
+
+            for chunk in chunks:
+                if chunk["chunk_number"] <= run.resume_from:
+                    continue  # Ya está en Pinecone según el checkpoint
+                batch.append((run, chunk))
+                if len(batch) >= batch_size:
+                    await chunks_q.put(batch)
+                    batch = []
+        if batch:
+            await chunks_q.put(batch)
+        await chunks_q.put(_END)
+
+    async def embed_stage():
+        while (batch := await chunks_q.get()) is not _END:
+            for run in _count_by_run(batch):
+                run.advance("embed")
+            chunks = [chunk for _, chunk in batch]
+            started = time.perf_counter()
+            embeddings = await embedding_service.generate_embeddings([chunk["text"] for chunk in chunks])
+            share_time("embed", batch, time.perf_counter() - started)
+            if len(embeddings) != len(chunks):
+                raise IngestionError("Error generando embeddings")
+            await vectors_q.put((batch, build_chunk_vectors(chunks, embeddings)))
+        await vectors_q.put(_END)
+
+    async def upsert_stage():
+        while (item := await vectors_q.get()) is not _END:
+            batch, vectors = item
+            counts = _count_by_run(batch)
+            for run in counts:
+                run.advance("upsert")
+            started = time.perf_counter()
+            # Releer el chatbot: un re-index en curso agrega su destino sombra
+            runs[0].db.refresh(chatbot)
+            for index_name, namespace in chatbot.vector_targets():
+                success = await pinecone_service.upsert_vectors(index_name, vectors, namespace=namespace)
+                if not success:
+                    raise IngestionError("Error subiendo vectores a Pinecone")
+            share_time("upsert", batch, time.perf_counter() - started)
+            for run, count in counts.items():
+                run.uploaded += count
+                run.tracker.add_done(count)
+                run.finish_if_done()
+
+    wall_started = time.perf_counter()
+    try:
+        await _run_stages([extract_stage(), chunk_stage(), embed_stage(), upsert_stage()])
+    finally:
+        # Los documentos que no terminaron conservan los tiempos del intento
+        for run in runs:
+            if not run.finished:
+                run.tracker.add_timings(run.busy)
+
+    uploaded = sum(run.uploaded for run in runs)
+    logger.info(
+        f"Pipeline de {len(runs)} documento(s): {uploaded} chunks en "
+        f"{time.perf_counter() - wall_started:.2f}s"
+    )
+
+    for run in runs:
+        if not run.finished and not run.error:
+            raise IngestionError(f"Procesamiento incompleto de {run.document.original_filename}")
+
+
+def _processing_signature(file_path: str) -> str:
+    """
+    Identifica el contenido del archivo y la configuración que determinan los
+    chunks y sus vectores; un checkpoint solo es válido con la misma firma
+    """
+    return ":".join([
+        document_processor.compute_file_hash(file_path)[:16],
+        f"v{EXTRACTOR_VERSION}",
+        str(document_processor.chunk_size),
+        str(document_processor.chunk_overlap),
+        embedding_service.model_name
+    ])
+
+
+def _count_by_run(batch: List[tuple]) -> Dict[_DocumentRun, int]:
+    """Cuenta los chunks de cada documento dentro de un lote (run, chunk)"""
+    counts: Dict[_DocumentRun, int] = {}
+    for run, _ in batch:
+        counts[run] = counts.get(run, 0) + 1
+    return counts
+
+
+async def _run_stages(stages: List[Awaitable[None]]) -> None:
+    """Ejecuta las etapas concurrentemente; si una falla, cancela las demás y propaga el error"""
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+# --------------- Handlers de trabajos ------------------
+
+async def handle_process_document(db: Session, job: IngestionJob) -> None:
+    """Handler del trabajo 'process_document'"""
+    await process_document(db, job.document_id, job.chatbot_id)
+    _schedule_profile(db, job.chatbot_id)
+
+
+async def handle_process_batch(db: Session, job: IngestionJob) -> None:
+    """Handler del trabajo 'process_batch' (payload: document_ids)"""
+    result = await process_documents_batch(db, job_document_ids(job), job.chatbot_id)
+    logger.info(
+        f"Lote del trabajo {job.id}: {len(result['completed'])} completados, "
+        f"{len(result['failed'])} fallidos"
+    )
+    if result["completed"]:
+        _schedule_profile(db, job.chatbot_id)
+
+
+def _schedule_profile(db: Session, chatbot_id: int) -> None:
+    """Recalcula el perfil del chatbot al terminar la tanda de documentos"""
+    from .chatbot_profile import chatbot_profiles
+    chatbot_profiles.schedule(db, chatbot_id)
+    db.commit()
+
+
+def job_document_ids(job: IngestionJob) -> List[int]:
+    """Documentos que cubre un trabajo (el propio o los del payload de un lote)"""
+    if job.document_id is not None:
+        return [job.document_id]
+    return list(job_queue.get_payload(job).get("document_ids", []))
+
+
+async def handle_reindex_chatbot(db: Session, job: IngestionJob) -> None:
+    """Handler del trabajo 'reindex_chatbot'"""
+    from .reindex import reindex_chatbot
+    await reindex_chatbot(db, job.chatbot_id)
+
+
+async def handle_calibrate_retrieval(db: Session, job: IngestionJob) -> None:
+    """Handler del trabajo 'calibrate_retrieval'"""
+    from .retrieval_calibration import retrieval_calibrator
+    allow_stricter = job_queue.get_payload(job).get("allow_stricter", False)
+    await retrieval_calibrator.calibrate(db, job.chatbot_id, allow_stricter=allow_stricter)
+
+
+async def handle_build_chatbot_profile(db: Session, job: IngestionJob) -> None:
+    """Handler del trabajo 'build_chatbot_profile'"""
+    from .chatbot_profile import chatbot_profiles
+    await chatbot_profiles.build(db, job.chatbot_id)
+
+
+JOB_HANDLERS: Dict[str, Callable[[Session, IngestionJob], Awaitable[None]]] = {
+    "process_document": handle_process_document,
+    "process_batch": handle_process_batch,
+    "reindex_chatbot": handle_reindex_chatbot,
+    "calibrate_retrieval": handle_calibrate_retrieval,
+    "build_chatbot_profile": handle_build_chatbot_profile,
+}
+
+
+async def run_next_job(worker_id: str) -> bool:
+    """
+    Toma y ejecuta un trabajo de la cola
+
+    Returns:
+        bool: True si se ejecutó un trabajo, False si la cola estaba vacía
+    """
+    db = SessionLocal()
+    try:
+        job = job_queue.claim(db, worker_id)
+        if not job:
+            return False
+
+        if job.status == JobStatus.DEAD:
+            # Abandonado por un worker caído y sin intentos: no se ejecuta
+            for document_id in job_document_ids(job):
+                ingestion_progress.mark_failed(db, document_id, job.last_error, will_retry=False)
+            return True
+
+        handler = JOB_HANDLERS.get(job.job_type)
+        if handler is None:
+            job_queue.fail(db, job, f"Tipo de trabajo desconocido: {job.job_type}", permanent=True)
+            return True
+
+        logger.info(f"[{worker_id}] Ejecutando trabajo {job.id} ({job.job_type}), intento {job.attempts}")
+        heartbeat = asyncio.ensure_future(_heartbeat(job.id, worker_id))
+        try:
+            await handler(db, job)
+        except Exception as e:
+            db.rollback()
+            error = str(e) or e.__class__.__name__
+            permanent = isinstance(e, PermanentIngestionError)
+            dead = job_queue.fail(db, job, error, permanent=permanent)
+            # Los documentos fallidos siguen pendientes (is_processed=False) y
+            # pueden volver a encolarse; un reintento retoma desde su checkpoint
+            for document_id in job_document_ids(job):
+                ingestion_progress.mark_failed(db, document_id, error, will_retry=not dead)
+        else:
+            job_queue.complete(db, job)
+        finally:
+            heartbeat.cancel()
+        return True
+
+    finally:
+        db.close()
+
+
+async def _heartbeat(job_id: int, worker_id: str) -> None:
+    """Renueva periódicamente el bloqueo del trabajo en curso (lotes largos)"""
+    interval = max(job_queue.lock_timeout_seconds / 3, 1)
+    while True:
+        await asyncio.sleep(interval)
+        db = SessionLocal()
+        try:
+            job_queue.heartbeat(db, job_id, worker_id)
+        except Exception as e:
+            logger.warning(f"[{worker_id}] No se pudo renovar el bloqueo del trabajo {job_id}: {str(e)}")
+        finally:
+            db.close()
+
+
+async def run_worker_loop(worker_id: str, stop_event: Optional[asyncio.Event] = None) -> None:
+    """
+    Consume la cola de ingesta hasta que se active stop_event
+
+    Args:
+        worker_id: Identificador del worker (aparece en locked_by)
+        stop_event: Evento para detener el loop de forma ordenada
+    """
+    poll_interval = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "2"))
+    stop_event = stop_event or asyncio.Event()
+    logger.info(f"Worker de ingesta {worker_id} iniciado")
+
+    while not stop_event.is_set():
+        try:
+            ran_job = await run_next_job(worker_id)
+        except Exception as e:
+            logger.error(f"[{worker_id}] Error en el loop del worker: {str(e)}")
+            ran_job = False
+
+        if not ran_job:
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    logger.info(f"Worker de ingesta {worker_id} detenido")
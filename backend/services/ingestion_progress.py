@@ -0,0 +1,231 @@
+import json
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy.orm import Session
+
+from models import ChatbotDocument, DocumentProcessing
+
+logger = logging.getLogger(__name__)
+
+# Etapas del procesamiento, en orden
+STAGES = ("extract", "chunk", "embed", "upsert")
+
+
+def get_or_create_record(db: Session, document: ChatbotDocument) -> DocumentProcessing:
+    """Obtiene el registro de procesamiento del documento, creándolo si no existe"""
+    record = db.query(DocumentProcessing).filter(
+        DocumentProcessing.document_id == document.id
+    ).first()
+    if record is None:
+        record = DocumentProcessing(
+            document_id=document.id,
+            chatbot_id=document.chatbot_id,
+            status="pending",
+            chunks_done=0,
+            checkpoint_chunks=0,
+            attempts=0
+        )
+        db.add(record)
+        db.flush()
+    return record
+
+
+def mark_queued(db: Session, document: ChatbotDocument) -> DocumentProcessing:
+    """Deja el documento en estado 'pending' (sin commit, junto con el encolado)"""
+    record = get_or_create_record(db, document)
+    record.status = "pending"
+    record.stage = None
+    record.error_message = None
+    record.finished_at = None
+    return record
+
+
+def create_queued_records(db: Session, documents: List[ChatbotDocument]) -> None:
+    """Crea en un solo insert los registros 'pending' de documentos recién creados (sin commit)"""
+    db.add_all([
+        DocumentProcessing(
+            document_id=document.id,
+            chatbot_id=document.chatbot_id,
+            status="pending",
+            chunks_done=0,
+            checkpoint_chunks=0,
+            attempts=0
+        )
+        for document in documents
+    ])
+    db.flush()
+
+
+def mark_failed(db: Session, document_id: int, error: str, will_retry: bool) -> None:
+    """
+    Registra el fallo de un intento de procesamiento
+
+    La etapa se conserva para saber dónde falló.
+
+    Args:
+        db: Sesión de base de datos
+        document_id: ID del documento
+        error: Motivo del fallo
+        will_retry: Si la cola volverá a intentarlo
+    """
+    record = db.query(DocumentProcessing).filter(
+        DocumentProcessing.document_id == document_id
+    ).first()
+    if record is None or record.status == "completed":
+        return
+    record.status = "retrying" if will_retry else "failed"
+    record.error_message = error[:4000]
+    if not will_retry:
+        record.finished_at = datetime.utcnow()
+    db.commit()
+
+
+def parse_timings(record: Optional[DocumentProcessing]) -> Dict[str, float]:
+    """Deserializa los tiempos por etapa de un registro"""
+    if record is None or not record.stage_timings:
+        return {}
+    return json.loads(record.stage_timings)
+
+
+class ProgressTracker:
+    """
+    Registra etapa actual, chunks avanzados y duración por etapa de un
+    procesamiento. Cada cambio se confirma de inmediato para que sea visible
+    desde la API mientras el worker sigue trabajando.
+
+    Una etapa puede ejecutarse varias veces (p. ej. embed por lotes); su
+    duración se acumula.
+
+    Tras cada lote subido se guarda un checkpoint con los chunks ya confirmados
+    en Pinecone; un nuevo intento sobre el mismo archivo y con la misma
+    configuración retoma desde ahí.
+    """
+
+    def __init__(self, db: Session, document: ChatbotDocument):
+        self.db = db
+        self.record = get_or_create_record(db, document)
+        self.timings: Dict[str, float] = {}
+
+        self.record.status = "processing"
+        self.record.stage = None
+        self.record.chunks_done = 0
+        self.record.chunks_total = None
+        self.record.stage_timings = None
+        self.record.error_message = None
+        self.record.attempts = (self.record.attempts or 0) + 1
+        self.record.started_at = datetime.utcnow()
+        self.record.finished_at = None
+        self.db.commit()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Marca la etapa como actual y acumula su duración al salir"""
+        self.record.stage = name
+        self.db.commit()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.perf_counter() - started)
+
+    def add_timing(self, name: str, seconds: float) -> None:
+        """Acumula segundos a una etapa y los persiste"""
+        self.timings[name] = round(self.timings.get(name, 0.0) + seconds, 3)
+        self.record.stage_timings = json.dumps(self.timings)
+        self.db.commit()
+
+    def add_timings(self, timings: Dict[str, float], commit: bool = True) -> None:
+        """Acumula varios tiempos por etapa de una vez"""
+        for name, seconds in timings.items():
+            self.timings[name] = round(self.timings.get(name, 0.0) + seconds, 3)
+        self.record.stage_timings = json.dumps(self.timings)
+        if commit:
+            self.db.commit()
+
+    def resume_checkpoint(self, signature: str) -> int:
+        """
+        Retoma el checkpoint del intento anterior si fue generado con la misma
+        firma; si no, lo descarta
+
+        Returns:
+            int: Chunks iniciales que no hace falta volver a procesar
+        """
+        if self.record.checkpoint_signature == signature and (self.record.checkpoint_chunks or 0) > 0:
+            resume_from = self.record.checkpoint_chunks
+            logger.info(f"Retomando documento {self.record.document_id} desde el chunk {resume_from + 1}")
+        else:
+            resume_from = 0
+            self.record.checkpoint_chunks = 0
+            self.record.checkpoint_signature = signature
+            self.record.checkpoint_at = None
+        self.record.chunks_done = resume_from
+        self.db.commit()
+        return resume_from
+
+    def set_total(self, chunks_total: int) -> None:
+        """Registra el total de chunks esperados"""
+        self.record.chunks_total = chunks_total
+        self.db.commit()
+
+    def add_done(self, chunks: int) -> None:
+        """
+        Suma chunks subidos a Pinecone y avanza el checkpoint
+
+        Los lotes de un documento se suben en orden, por lo que los chunks
+        confirmados siempre forman un prefijo contiguo 1..chunks_done.
+        """
+        self.record.chunks_done = (self.record.chunks_done or 0) + chunks
+        self.record.checkpoint_chunks = self.record.chunks_done
+        self.record.checkpoint_at = datetime.utcnow()
+        self.db.commit()
+
+    def complete(self) -> None:
+        """Marca el procesamiento como completado (sin commit, junto con el documento)"""
+        self.record.status = "completed"
+        self.record.stage = None
+        self.record.chunks_total = self.record.chunks_done
+        self.record.checkpoint_chunks = 0
+        self.record.checkpoint_signature = None
+        self.record.finished_at = datetime.utcnow()
+
+
+def summarize_chatbot(records: List[DocumentProcessing]) -> Dict[str, Any]:
+    """
+    Agrega los registros de procesamiento de un chatbot
+
+    Returns:
+        Dict con conteos por estado, avance de chunks, tiempos por etapa
+        (total y promedio por documento) y la etapa más lenta
+    """
+    by_status: Dict[str, int] = {}
+    stage_totals: Dict[str, float] = {}
+    stage_counts: Dict[str, int] = {}
+    chunks_done = 0
+    chunks_total = 0
+
+    for record in records:
+        by_status[record.status] = by_status.get(record.status, 0) + 1
+        chunks_done += record.chunks_done or 0
+        chunks_total += record.chunks_total or 0
+        for stage, seconds in parse_timings(record).items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+            stage_counts[stage] = stage_counts.get(stage, 0) + 1
+
+    stage_averages = {
+        stage: round(total / stage_counts[stage], 3)
+        for stage, total in stage_totals.items()
+    }
+
+    return {
+        "documents": len(records),
+        "by_status": by_status,
+        "chunks_done": chunks_done,
+        "chunks_total": chunks_total,
+        "stage_seconds_total": {stage: round(total, 3) for stage, total in stage_totals.items()},
+        "stage_seconds_avg": stage_averages,
+        "slowest_stage": max(stage_totals, key=stage_totals.get) if stage_totals else None
+    }
@@ -0,0 +1,225 @@
+import os
+import json
+import random
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+from dotenv import load_dotenv
+
+from models import IngestionJob, JobStatus
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """
+    Cola de trabajos de ingesta persistida en Postgres
+
+    Los workers toman trabajos con SELECT ... FOR UPDATE SKIP LOCKED, de modo
+    que varios procesos pueden consumir la cola sin bloquearse entre sí. Los
+    trabajos fallidos se reprograman con backoff exponencial y pasan al estado
+    DEAD al agotar sus intentos.
+
+    Mientras un trabajo corre, el worker renueva locked_at (heartbeat); un
+    trabajo RUNNING sin renovar por lock_timeout_seconds se considera
+    abandonado (worker caído) y otro worker lo retoma, contando un intento.
+    """
+
+    def __init__(self):
+        """Inicializa la configuración de reintentos y bloqueos"""
+        self.max_attempts = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+        self.retry_base_seconds = float(os.getenv("JOB_RETRY_BASE_SECONDS", "30"))
+        self.retry_max_seconds = float(os.getenv("JOB_RETRY_MAX_SECONDS", "1800"))
+        # Un trabajo RUNNING sin terminar pasado este tiempo se considera abandonado
+        self.lock_timeout_seconds = int(os.getenv("JOB_LOCK_TIMEOUT_SECONDS", "900"))
+
+    def enqueue(
+        self,
+        db: Session,
+        job_type: str,
+        chatbot_id: int,
+        document_id: Optional[int] = None,
+        payload: Optional[Dict[str, Any]] = None
+    ) -> IngestionJob:
+        """
+        Agrega un trabajo a la cola sin hacer commit, para que quede en la misma
+        transacción que los registros que lo originan
+
+        Args:
+            db: Sesión de base de datos
+            job_type: Tipo de trabajo (ver JOB_HANDLERS en services.ingestion)
+            chatbot_id: Chatbot al que pertenece el trabajo
+            document_id: Documento asociado (opcional)
+            payload: Parámetros adicionales serializables a JSON
+
+        Returns:
+            IngestionJob: Trabajo creado (con ID asignado)
+        """
+        job = IngestionJob(
+            job_type=job_type,
+            chatbot_id=chatbot_id,
+            document_id=document_id,
+            payload=json.dumps(payload) if payload else None,
+            status=JobStatus.PENDING,
+            max_attempts=self.max_attempts
+        )
+        db.add(job)
+        db.flush()
+        return job
+
+    def claim(self, db: Session, worker_id: str) -> Optional[IngestionJob]:
+        """
+        Toma el siguiente trabajo disponible y lo marca como RUNNING
+
+        También recupera trabajos RUNNING cuyo bloqueo expiró (worker caído).
+        Si ese trabajo ya agotó sus intentos (por ejemplo, un documento que
+        tumba al worker cada vez) no se vuelve a ejecutar: se mueve a DEAD y
+        se devuelve en ese estado, para que quien llama registre el fallo.
+
+        Args:
+            db: Sesión de base de datos
+            worker_id: Identificador del worker que toma el trabajo
+
+        Returns:
+            IngestionJob (RUNNING, o DEAD si era un abandonado sin intentos)
+            o None si no hay trabajos disponibles
+        """
+        stale_before = func.now() - timedelta(seconds=self.lock_timeout_seconds)
+
+        job = db.query(IngestionJob).filter(
+            or_(
+                and_(IngestionJob.status == JobStatus.PENDING, IngestionJob.run_after <= func.now()),
+                and_(IngestionJob.status == JobStatus.RUNNING, IngestionJob.locked_at < stale_before)
+            )
+        ).order_by(
+            IngestionJob.run_after.asc(),
+            IngestionJob.id.asc()
+        ).with_for_update(skip_locked=True).first()
+
+        if not job:
+            db.rollback()
+            return None
+
+        if job.status == JobStatus.RUNNING:
+            if (job.attempts or 0) >= job.max_attempts:
+                job.status = JobStatus.DEAD
+                job.last_error = (
+                    f"Abandonado por {job.locked_by} sin terminar (intento {job.attempts}/{job.max_attempts})"
+                )
+                job.locked_by = None
+                job.finished_at = func.now()
+                db.commit()
+                db.refresh(job)
+                logger.error(f"Trabajo {job.id} ({job.job_type}) movido a dead-letter: {job.last_error}")
+                return job
+            logger.warning(f"Recuperando trabajo {job.id} abandonado por {job.locked_by}")
+
+        job.status = JobStatus.RUNNING
+        job.attempts = (job.attempts or 0) + 1
+        job.locked_by = worker_id
+        job.locked_at = func.now()
+        db.commit()
+        db.refresh(job)
+        return job
+
+    def complete(self, db: Session, job: IngestionJob):
+        """Marca un trabajo como terminado exitosamente"""
+        job.status = JobStatus.SUCCEEDED
+        job.last_error = None
+        job.locked_by = None
+        job.finished_at = func.now()
+        db.commit()
+
+    def fail(self, db: Session, job: IngestionJob, error: str, permanent: bool = False) -> bool:
+        """
+        Registra un fallo: reprograma con backoff o mueve a dead-letter
+
+        Args:
+            db: Sesión de base de datos
+            job: Trabajo fallido
+            error: Descripción del error
+            permanent: Si el error no se resuelve reintentando
+
+        Returns:
+            bool: True si el trabajo quedó en estado DEAD
+        """
+        job.last_error = error[:4000]
+        job.locked_by = None
+
+        if permanent or job.attempts >= job.max_attempts:
+            job.status = JobStatus.DEAD
+            job.finished_at = func.now()
+            logger.error(f"Trabajo {job.id} ({job.job_type}) movido a dead-letter: {error}")
+        else:
+            delay = self.retry_delay(job.attempts)
+            job.status = JobStatus.PENDING
+            job.run_after = func.now() + timedelta(seconds=delay)
+            logger.warning(
+                f"Trabajo {job.id} ({job.job_type}) falló (intento {job.attempts}/{job.max_attempts}), "
+                f"reintento en {delay:.0f}s: {error}"
+            )
+
+        db.commit()
+        return job.status == JobStatus.DEAD
+
+    def retry_delay(self, attempts: int) -> float:
+        """Backoff exponencial con jitter para el intento dado"""
+        delay = min(self.retry_base_seconds * (2 ** max(attempts - 1, 0)), self.retry_max_seconds)
+        return delay * random.uniform(0.5, 1.0)
+
+    def requeue(self, db: Session, job: IngestionJob) -> IngestionJob:
+        """Devuelve un trabajo DEAD a la cola con sus intentos reiniciados"""
+        job.status = JobStatus.PENDING
+        job.attempts = 0
+        job.run_after = func.now()
+        job.finished_at = None
+        db.commit()
+        db.refresh(job)
+        return job
+
+    def heartbeat(self, db: Session, job_id: int, worker_id: str) -> None:
+        """Renueva el bloqueo de un trabajo largo para que no se considere abandonado"""
+        db.query(IngestionJob).filter(
+            IngestionJob.id == job_id,
+            IngestionJob.status == JobStatus.RUNNING,
+            IngestionJob.locked_by == worker_id
+        ).update({IngestionJob.locked_at: func.now()}, synchronize_session=False)
+        db.commit()
+
+    def active_document_ids(self, db: Session, document_ids: List[int]) -> List[int]:
+        """
+        IDs de documentos que ya tienen un trabajo pendiente o en ejecución,
+        propio o como parte de un lote
+        """
+        if not document_ids:
+            return []
+        jobs = db.query(IngestionJob).filter(
+            IngestionJob.status.in_([JobStatus.PENDING, JobStatus.RUNNING]),
+            or_(
+                IngestionJob.document_id.in_(document_ids),
+                IngestionJob.job_type == "process_batch"
+            )
+        ).all()
+
+        wanted = set(document_ids)
+        active = set()
+        for job in jobs:
+            if job.document_id is not None:
+                active.add(job.document_id)
+            else:
+                active.update(wanted.intersection(self.get_payload(job).get("document_ids", [])))
+        return sorted(active & wanted)
+
+    def get_payload(self, job: IngestionJob) -> Dict[str, Any]:
+        """Deserializa el payload JSON de un trabajo"""
+        return json.loads(job.payload) if job.payload else {}
+
+
+# Instancia global del servicio
+job_queue = JobQueue()
@@ -0,0 +1,300 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .metrics import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Tipos de llamada: la latencia de una respuesta completa y la del primer
+# token de un stream no son comparables, se miden por separado
+COMPLETION = "completion"
+FIRST_TOKEN = "first_token"
+
+
+class LLMBudgetExceeded(Exception):
+    """Se agotó el tiempo total del turno sin obtener respuesta"""
+    pass
+
+
+@dataclass
+class RoutedResult:
+    """Resultado de una llamada enrutada: valor, modelo que respondió y cómo"""
+    value: Any
+    model: str
+    attempts: int
+    hedged: bool = False
+
+
+class ModelStats:
+    """Ventana móvil de latencias y errores por (modelo, tipo de llamada)"""
+
+    def __init__(self, window: int = 50):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[Tuple[str, str], Deque[Tuple[float, bool]]] = {}
+
+    def record(self, model: str, kind: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            samples = self._samples.setdefault((model, kind), deque(maxlen=self.window))
+            samples.append((seconds, ok))
+
+    def p95(self, model: str, kind: str, min_samples: int = 5) -> Optional[float]:
+        """p95 de la latencia de las llamadas exitosas (None con pocas muestras)"""
+        with self._lock:
+            latencies = sorted(seconds for seconds, ok in self._samples.get((model, kind), ()) if ok)
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def error_rate(self, model: str, min_samples: int = 5) -> Optional[float]:
+        """Fracción de llamadas fallidas, de todos los tipos (None con pocas muestras)"""
+        with self._lock:
+            outcomes = [ok for (sample_model, _), samples in self._samples.items()
+                        if sample_model == model for _, ok in samples]
+        if len(outcomes) < min_samples:
+            return None
+        return outcomes.count(False) / len(outcomes)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            keys = list(self._samples)
+        return {
+            f"{model}:{kind}": {
+                "samples": len(self._samples[(model, kind)]),
+                "p95": round(self.p95(model, kind, min_samples=1) or 0.0, 3),
+                "error_rate": round(self.error_rate(model, min_samples=1) or 0.0, 3)
+            }
+            for model, kind in keys
+        }
+
+
+class LLMRouter:
+    """
+    Elige el modelo de cada llamada al LLM según su latencia y errores recientes
+
+    - Orden: el modelo principal y luego los de respaldo, en el orden
+      configurado. Un modelo con tasa de errores sobre max_error_rate pasa al
+      final hasta que se recupere.
+    - Hedging: si la llamada no respondió al llegar al p95 de su modelo, se
+      lanza una copia al modelo de respaldo más rápido y se usa la primera
+      respuesta; la otra se cancela.
+    - Reintentos: tras un error se pasa al siguiente modelo, con backoff
+      exponencial con jitter.
+    - Presupuesto: ningún reintento ni espera excede el tiempo total del turno.
+
+    Las decisiones se cuentan en llm_router_decisions_total{decision,model}.
+    """
+
+    def __init__(
+        self,
+        primary_model: str,
+        fallback_models: List[str],
+        turn_budget_seconds: float = 20.0,
+        max_attempts: int = 3,
+        backoff_base_seconds: float = 1.0,
+        backoff_max_seconds: float = 4.0,
+        hedge_enabled: bool = True,
+        hedge_default_seconds: float = 4.0,
+        hedge_min_seconds: float = 0.5,
+        max_error_rate: float = 0.5,
+        stats: Optional[ModelStats] = None
+    ):
+        self.primary_model = primary_model
+        self.fallback_models = [model for model in fallback_models if model and model != primary_model]
+        self.turn_budget_seconds = turn_budget_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.hedge_enabled = hedge_enabled
+        self.hedge_default_seconds = hedge_default_seconds
+        self.hedge_min_seconds = hedge_min_seconds
+        self.max_error_rate = max_error_rate
+        self.stats = stats or ModelStats()
+
+    @property
+    def models(self) -> List[str]:
+        return [self.primary_model] + self.fallback_models
+
+    def order(self) -> List[str]:
+        """Modelos en orden de preferencia, con los que están fallando al final"""
+        healthy, failing = [], []
+        for model in self.models:
+            error_rate = self.stats.error_rate(model)
+            (failing if error_rate is not None and error_rate >= self.max_error_rate else healthy).append(model)
+        return healthy + failing
+
+    def hedge_deadline(self, model: str, kind: str) -> float:
+        """Segundos de espera antes de lanzar la copia (p95 del modelo)"""
+        p95 = self.stats.p95(model, kind)
+        return max(p95 if p95 is not None else self.hedge_default_seconds, self.hedge_min_seconds)
+
+    def hedge_model(self, model: str, kind: str) -> Optional[str]:
+        """Modelo de respaldo más rápido, distinto de model (None si no hay)"""
+        if not self.hedge_enabled:
+            return None
+        candidates = [candidate for candidate in self.order() if candidate != model]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda candidate: self.hedge_deadline(candidate, kind))
+
+    def backoff(self, attempt: int) -> float:
+        """Espera antes del reintento attempt (1, 2, ...): exponencial con jitter"""
+        delay = min(self.backoff_max_seconds, self.backoff_base_seconds * (2 ** (attempt - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def run(
+        self,
+        call: Callable[[str], Awaitable[Any]],
+        kind: str = COMPLETION,
+        time_budget: Optional[float] = None,
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None
+    ) -> RoutedResult:
+        """
+        Ejecuta call(modelo) con fallback, hedging, backoff y presupuesto
+
+        Args:
+            call: Hace la llamada con el modelo indicado
+            kind: COMPLETION o FIRST_TOKEN (define qué latencias se comparan)
+            time_budget: Segundos disponibles (por defecto turn_budget_seconds)
+            discard: Libera el resultado de una copia que terminó pero no se usó
+
+        Raises:
+            LLMBudgetExceeded: Si se agota el presupuesto
+            Exception: El último error si fallan todos los intentos
+        """
+        deadline = time.monotonic() + (time_budget if time_budget is not None else self.turn_budget_seconds)
+        order = self.order()
+        last_error: Optional[BaseException] = None
+
+        for attempt in range(1, self.max_attempts + 1):
+            model = order[(attempt - 1) % len(order)]
+            decision = "primary" if model == self.primary_model else "fallback"
+            self._record_decision("retry" if attempt > 1 else decision, model)
+
+            try:
+                value, used_model, hedged = await self._hedged(call, model, kind, deadline, discard)
+                return RoutedResult(value, used_model, attempt, hedged)
+            except LLMBudgetExceeded:
+                self._record_decision("budget_exhausted", model)
+                raise
+            except Exception as e:
+                last_error = e
+                logger.warning(f"LLM {model} falló (intento {attempt}): {str(e)}")
+
+            if attempt == self.max_attempts:
+                break
+            delay = self.backoff(attempt)
+            if time.monotonic() + delay >= deadline:
+                self._record_decision("budget_exhausted", model)
+                raise LLMBudgetExceeded(f"Sin tiempo para reintentar tras: {last_error}") from last_error
+            await asyncio.sleep(delay)
+
+        raise last_error
+
+    async def _hedged(
+        self,
+        call: Callable[[str], Awaitable[Any]],
+        model: str,
+        kind: str,
+        deadline: float,
+        discard: Optional[Callable[[Any], Awaitable[None]]]
+    ) -> Tuple[Any, str, bool]:
+        """Llamada a model con una copia a otro modelo si no responde a tiempo"""
+        tasks: Dict[asyncio.Task, str] = {asyncio.ensure_future(self._timed(call, model, kind)): model}
+        hedged = False
+        try:
+            remaining = deadline - time.monotonic()
+            hedge_model = self.hedge_model(model, kind)
+            wait = min(self.hedge_deadline(model, kind), remaining) if hedge_model else remaining
+            done, _ = await asyncio.wait(tasks, timeout=max(wait, 0))
+
+            if not done and hedge_model and deadline - time.monotonic() > 0:
+                self._record_decision("hedge", hedge_model)
+                tasks[asyncio.ensure_future(self._timed(call, hedge_model, kind))] = hedge_model
+                hedged = True
+
+            # Primera respuesta exitosa; si una copia falla se espera a la otra
+            last_error: Optional[BaseException] = None
+            while tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LLMBudgetExceeded(f"Sin respuesta de {', '.join(tasks.values())} dentro del presupuesto")
+                done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    used_model = tasks.pop(task)
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    if hedged:
+                        self._record_decision("hedge_win", used_model)
+                    return task.result(), used_model, hedged
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+                if discard is not None:
+                    task.add_done_callback(_discard_callback(discard))
+
+    async def _timed(self, call: Callable[[str], Awaitable[Any]], model: str, kind: str) -> Any:
+        started = time.perf_counter()
+        try:
+            value = await call(model)
+        except asyncio.CancelledError:
+            # Copia descartada: no cuenta como error del modelo
+            raise
+        except Exception:
+            elapsed = time.perf_counter() - started
+            self.stats.record(model, kind, elapsed, ok=False)
+            metrics.increment("llm_requests_total", model=model, outcome="error")
+            raise
+        elapsed = time.perf_counter() - started
+        self.stats.record(model, kind, elapsed, ok=True)
+        metrics.increment("llm_requests_total", model=model, outcome="ok")
+        metrics.observe("llm_request_seconds", elapsed, model=model, kind=kind)
+        return value
+
+    def _record_decision(self, decision: str, model: str) -> None:
+        metrics.increment("llm_router_decisions_total", decision=decision, model=model)
+
+    def state(self) -> Dict[str, Any]:
+        """Modelos en orden de preferencia y su latencia/errores recientes"""
+        return {
+            "order": self.order(),
+            "hedge_enabled": self.hedge_enabled,
+            "turn_budget_seconds": self.turn_budget_seconds,
+            "models": self.stats.summary()
+        }
+
+
+def _discard_callback(discard: Callable[[Any], Awaitable[None]]) -> Callable[[asyncio.Task], None]:
+    """Callback que libera el resultado de una copia que terminó aunque se canceló"""
+
+    def callback(task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is not None:
+            return
+        asyncio.ensure_future(discard(task.result()))
+
+    return callback
+
+
+# Instancia global
+llm_router = LLMRouter(
+    primary_model=os.getenv("GROQ_MODEL", "llama-3.1-8b-instant"),
+    fallback_models=[model.strip() for model in os.getenv("GROQ_FALLBACK_MODELS", "").split(",")],
+    turn_budget_seconds=float(os.getenv("LLM_TURN_BUDGET_SECONDS", "20")),
+    max_attempts=int(os.getenv("LLM_MAX_ATTEMPTS", "3")),
+    backoff_base_seconds=float(os.getenv("GROQ_RETRY_BASE_SECONDS", "1")),
+    hedge_enabled=os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true",
+    hedge_default_seconds=float(os.getenv("LLM_HEDGE_DEFAULT_SECONDS", "4"))
+)
@@ -0,0 +1,58 @@
+import threading
+from typing import Any, Dict
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas en memoria del proceso (contadores y tiempos)
+
+    Cada métrica se identifica por su nombre y etiquetas, p. ej.
+    rate_limit_wait_seconds{priority=bulk,upstream=groq}. Es seguro usarlo
+    desde hilos (asyncio.to_thread) y desde el event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> str:
+        if not labels:
+            return name
+        label_text = ",".join(f"{key}={value}" for key, value in sorted(labels.items()))
+        return f"{name}{{{label_text}}}"
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        """Suma al contador indicado"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """Registra una duración (cantidad, total y máximo)"""
+        key = self._key(name, labels)
+        with self._lock:
+            timing = self._timings.setdefault(key, {"count": 0, "total": 0.0, "max": 0.0})
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Copia de las métricas actuales, con el promedio de cada tiempo"""
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {
+                key: {
+                    "count": timing["count"],
+                    "total": round(timing["total"], 3),
+                    "avg": round(timing["total"] / timing["count"], 3) if timing["count"] else 0.0,
+                    "max": round(timing["max"], 3)
+                }
+                for key, timing in self._timings.items()
+            }
+        return {"counters": counters, "timings": timings}
+
+
+# Instancia global del registro
+metrics = MetricsRegistry()
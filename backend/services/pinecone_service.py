@@ -1,4 +1,5 @@
 import os
+import asyncio
 import logging
 from typing import List, Dict, Any, Optional
 from pinecone import Pinecone, ServerlessSpec
@@ -19,8 +20,10 @@ class PineconeService:
         
         self.pc = Pinecone(api_key=api_key)
         self.environment = os.getenv("PINECONE_ENVIRONMENT", "us-east-1")
-        self.dimension = 1024  # Dimensión para multilingual-e5-large (Pinecone Inference API)
+        # Dimensión del modelo de embeddings (1024 para multilingual-e5-large de Pinecone Inference)
+        self.dimension = int(os.getenv("PINECONE_EMBEDDING_DIMENSION", "1024"))
         self._embedding_service = None  # Lazy loading
+        self._known_indexes = set()  # Índices ya verificados (evita list_indexes por cada upsert)
         
         logger.info(f"PineconeService inicializado con environment: {self.environment}")
     
@@ -42,12 +45,13 @@ class PineconeService:
         
         logger.info(f"PineconeService inicializado con environment: {self.environment}")
         
-    async def create_index(self, index_name: str) -> bool:
+    async def create_index(self, index_name: str, dimension: Optional[int] = None) -> bool:
         """
         Crea un nuevo índice en Pinecone para un chatbot
         
         Args:
             index_name: Nombre único del índice
+            dimension: Dimensión de los vectores (por defecto la configurada)
             
         Returns:
             bool: True si se creó exitosamente
@@ -65,10 +69,11 @@ class PineconeService:
                 return True
             
             # Crear nuevo índice con configuración correcta para el plan gratuito
-            logger.info(f"Creando nuevo índice {index_name} con dimensión {self.dimension}")
+            dimension = dimension or self.dimension
+            logger.info(f"Creando nuevo índice {index_name} con dimensión {dimension}")
             self.pc.create_index(
                 name=index_name,
-                dimension=self.dimension,
+                dimension=dimension,
                 metric='cosine',
                 spec=ServerlessSpec(
                     cloud='aws',
@@ -123,6 +128,7 @@ class PineconeService:
                 return True
                 
             self.pc.delete_index(index_name)
+            self._known_indexes.discard(index_name)
             logger.info(f"Índice {index_name} eliminado exitosamente")
             return True
             
@@ -155,22 +161,24 @@ class PineconeService:
         try:
             logger.info(f"Intentando insertar {len(vectors)} vectores en índice: {index_name}")
             
-            # Verificar que el índice existe
-            existing_indexes = self.pc.list_indexes()
-            existing_names = [index.name for index in existing_indexes]
-            
-            if index_name not in existing_names:
-                logger.error(f"El índice {index_name} no existe. Índices disponibles: {existing_names}")
-                return False
+            # Verificar que el índice existe (una vez por índice)
+            if index_name not in self._known_indexes:
+                existing_indexes = await asyncio.to_thread(self.pc.list_indexes)
+                existing_names = [index.name for index in existing_indexes]
+                
+                if index_name not in existing_names:
+                    logger.error(f"El índice {index_name} no existe. Índices disponibles: {existing_names}")
+                    return False
+                self._known_indexes.add(index_name)
             
             index = self.pc.Index(index_name)
             
-            # Insertar vectores en batches de 100
+            # Insertar vectores en batches de 100, en un hilo para no bloquear el event loop
             batch_size = 100
             total_inserted = 0
             for i in range(0, len(vectors), batch_size):
                 batch = vectors[i:i + batch_size]
-                result = index.upsert(vectors=batch, namespace=namespace)
+                result = await asyncio.to_thread(index.upsert, vectors=batch, namespace=namespace)
                 total_inserted += len(batch)
                 logger.info(f"Batch insertado: {len(batch)} vectores (total: {total_inserted}/{len(vectors)})")
             
@@ -206,7 +214,9 @@ class PineconeService:
         try:
             index = self.pc.Index(index_name)
             
-            results = index.query(
+            # En un hilo para no bloquear el event loop durante la consulta
+            results = await asyncio.to_thread(
+                index.query,
                 vector=query_vector,
                 top_k=top_k,
                 namespace=namespace,
@@ -258,6 +268,69 @@ class PineconeService:
             logger.error(f"Error eliminando vectores de {index_name}: {str(e)}")
             return False
     
+    async def fetch_vectors(
+        self,
+        index_name: str,
+        vector_ids: List[str],
+        namespace: Optional[str] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Obtiene vectores (valores y metadatos) por ID
+        
+        Args:
+            index_name: Nombre del índice
+            vector_ids: IDs a obtener (los inexistentes se omiten)
+            namespace: Namespace donde están los vectores
+            
+        Returns:
+            Dict: {id: {"values": [...], "metadata": {...}}}
+        """
+        index = self.pc.Index(index_name)
+        vectors = {}
+        
+        # En lotes de 100 IDs para no exceder el largo de la consulta
+        batch_size = 100
+        for i in range(0, len(vector_ids), batch_size):
+            response = await asyncio.to_thread(
+                index.fetch, ids=vector_ids[i:i + batch_size], namespace=namespace
+            )
+            for vector_id, vector in response.vectors.items():
+                vectors[vector_id] = {
+                    "values": list(vector.values),
+                    "metadata": dict(vector.metadata or {})
+                }
+        
+        return vectors
+    
+    async def delete_namespace(self, index_name: str, namespace: str) -> bool:
+        """
+        Elimina todos los vectores de un namespace
+        
+        Args:
+            index_name: Nombre del índice
+            namespace: Namespace a vaciar
+            
+        Returns:
+            bool: True si se eliminó exitosamente
+        """
+        try:
+            index = self.pc.Index(index_name)
+            await asyncio.to_thread(index.delete, delete_all=True, namespace=namespace)
+            logger.info(f"Namespace {namespace} eliminado de {index_name}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error eliminando namespace {namespace} de {index_name}: {str(e)}")
+            # Un namespace inexistente ya está vacío
+            return "not found" in str(e).lower() or "404" in str(e)
+    
+    async def get_namespace_vector_count(self, index_name: str, namespace: str) -> int:
+        """Cantidad de vectores de un namespace (0 si no existe)"""
+        index = self.pc.Index(index_name)
+        stats = await asyncio.to_thread(index.describe_index_stats)
+        summary = (stats.namespaces or {}).get(namespace)
+        return summary.vector_count if summary else 0
+    
     async def get_index_stats(self, index_name: str) -> Dict[str, Any]:
         """
         Obtiene estadísticas de un índice
@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from .metrics import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Prioridades de las llamadas: el chat del usuario va antes que la ingesta masiva
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+# Espera máxima entre revisiones del bucket (para reaccionar a devoluciones de tokens)
+MAX_SLEEP_SECONDS = 1.0
+
+
+class TokenBucket:
+    """
+    Token bucket con capacidad de un minuto de cuota que se rellena de forma
+    continua. No es thread-safe por sí solo; lo protege UpstreamLimiter.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.refill_per_second = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def wait_time(self, amount: float, reserve: float) -> float:
+        """Segundos hasta poder consumir amount dejando al menos reserve en el bucket"""
+        # Una solicitud mayor que la capacidad se limita a la capacidad para no esperar para siempre
+        amount = min(amount, self.capacity - reserve)
+        missing = amount + reserve - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.refill_per_second
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class UpstreamLimiter:
+    """
+    Limitador de una API externa con buckets de solicitudes y tokens por minuto
+
+    Las llamadas BULK no pueden usar la fracción de capacidad reservada para
+    las INTERACTIVE, de modo que una ingesta masiva no deja sin cuota al chat.
+    Un límite en 0 desactiva su bucket.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        interactive_reserve: float = 0.2
+    ):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.interactive_reserve = min(max(interactive_reserve, 0.0), 0.9)
+        self._lock = threading.Lock()
+
+    def _reserve(self, bucket: TokenBucket, priority: str) -> float:
+        return bucket.capacity * self.interactive_reserve if priority == BULK else 0.0
+
+    def _try_acquire(self, tokens: float, priority: str) -> float:
+        """Consume la cuota si está disponible; si no, devuelve cuánto esperar"""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is None:
+                    continue
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_time(amount, self._reserve(bucket, priority)))
+            if wait > 0:
+                return wait
+            if self.requests:
+                self.requests.consume(1)
+            if self.tokens:
+                self.tokens.consume(tokens)
+            return 0.0
+
+    async def acquire(self, tokens: float = 0, priority: str = INTERACTIVE) -> float:
+        """
+        Espera hasta que haya cuota para una solicitud de `tokens` tokens
+
+        Args:
+            tokens: Tokens estimados de la solicitud
+            priority: INTERACTIVE o BULK
+
+        Returns:
+            float: Segundos esperados por el límite
+        """
+        started = time.perf_counter()
+        while True:
+            wait = self._try_acquire(tokens, priority)
+            if wait <= 0:
+                break
+            await asyncio.sleep(min(wait, MAX_SLEEP_SECONDS))
+
+        waited = time.perf_counter() - started
+        metrics.observe("rate_limit_wait_seconds", waited, upstream=self.name, priority=priority)
+        if waited > 0.01:
+            metrics.increment("rate_limit_throttled_total", upstream=self.name, priority=priority)
+            logger.info(f"Límite de {self.name}: esperados {waited:.2f}s ({priority}, {tokens:.0f} tokens)")
+        return waited
+
+    def settle(self, estimated_tokens: float, actual_tokens: Optional[float]) -> None:
+        """Corrige el bucket de tokens con el consumo real informado por la API"""
+        if self.tokens is None or actual_tokens is None:
+            return
+        with self._lock:
+            self.tokens.refill(time.monotonic())
+            self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens + estimated_tokens - actual_tokens)
+
+    def state(self) -> Dict[str, Optional[float]]:
+        """Cuota disponible en este momento"""
+        with self._lock:
+            now = time.monotonic()
+            for bucket in (self.requests, self.tokens):
+                if bucket:
+                    bucket.refill(now)
+            return {
+                "requests_available": round(self.requests.tokens, 1) if self.requests else None,
+                "tokens_available": round(self.tokens.tokens, 1) if self.tokens else None
+            }
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata de tokens (~4 caracteres por token)"""
+    return len(text) // 4 + 1
+
+
+def _limiter_from_env(name: str, prefix: str, default_rpm: float, default_tpm: float) -> UpstreamLimiter:
+    return UpstreamLimiter(
+        name,
+        requests_per_minute=float(os.getenv(f"{prefix}_RPM", str(default_rpm))),
+        tokens_per_minute=float(os.getenv(f"{prefix}_TPM", str(default_tpm))),
+        interactive_reserve=float(os.getenv("RATE_LIMIT_INTERACTIVE_RESERVE", "0.2"))
+    )
+
+
+# Limitadores globales del proceso, uno por API externa
+groq_limiter = _limiter_from_env("groq", "GROQ", default_rpm=30, default_tpm=0)
+pinecone_embed_limiter = _limiter_from_env("pinecone_embed", "PINECONE_EMBED", default_rpm=0, default_tpm=250000)
+
+rate_limiters = {
+    groq_limiter.name: groq_limiter,
+    pinecone_embed_limiter.name: pinecone_embed_limiter,
+}
@@ -0,0 +1,203 @@
+import os
+import time
+import asyncio
+import logging
+from typing import List, Tuple
+
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from models import ChatbotDocument, CustomChatbot
+from .pinecone_service import pinecone_service
+from .embedding_service_pinecone import embedding_service
+from .ingestion import IngestionError, PermanentIngestionError
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def document_vector_ids(document: ChatbotDocument) -> List[str]:
+    """IDs de los vectores de un documento procesado"""
+    return [f"doc_{document.id}_chunk_{i}" for i in range(document.chunks_count or 0)]
+
+
+async def reindex_chatbot(db: Session, chatbot_id: int) -> None:
+    """
+    Re-index blue/green de un chatbot, sin dejarlo nunca sin contexto
+
+    1. Se define un destino sombra: un namespace nuevo en el mismo índice o,
+       si cambió la dimensión de los embeddings, un índice nuevo. Desde ese
+       momento la ingesta escribe en ambos destinos.
+    2. Se copian los chunks almacenados en el destino activo. Solo se vuelven
+       a embeber (a partir del texto guardado en la metadata) si cambió el
+       modelo o la dimensión.
+    3. Se verifica que el destino sombra tenga tantos vectores como chunks
+       registran los documentos procesados.
+    4. Se cambia el puntero activo del chatbot en una sola transacción y se
+       elimina el destino anterior.
+
+    Si el trabajo falla antes del cambio, el chatbot sigue respondiendo con
+    el destino activo y un reintento continúa con el mismo destino sombra.
+
+    Raises:
+        PermanentIngestionError: Si el chatbot no existe
+        IngestionError: Si la copia o la verificación fallan
+    """
+    chatbot = db.query(CustomChatbot).filter(CustomChatbot.id == chatbot_id).first()
+    if not chatbot:
+        raise PermanentIngestionError(f"Chatbot {chatbot_id} no encontrado")
+
+    target_model = embedding_service.model_name
+    target_dimension = pinecone_service.dimension
+
+    if not (chatbot.shadow_index_name and chatbot.shadow_namespace):
+        await _prepare_shadow(db, chatbot, target_dimension)
+
+    source = (chatbot.pinecone_index_name, chatbot.active_namespace)
+    shadow = (chatbot.shadow_index_name, chatbot.shadow_namespace)
+    reembed = await _needs_reembedding(chatbot, target_model, target_dimension)
+
+    logger.info(
+        f"Re-index del chatbot {chatbot_id}: {source[0]}/{source[1]} -> {shadow[0]}/{shadow[1]} "
+        f"({'re-embebiendo' if reembed else 'copiando vectores'})"
+    )
+
+    # Copiar documentos procesados; una segunda pasada cubre los que terminaron
+    # de procesarse mientras tanto sin alcanzar a escribir en el destino sombra
+    copied = set()
+    for _ in range(2):
+        db.expire_all()
+        query = db.query(ChatbotDocument).filter(
+            ChatbotDocument.chatbot_id == chatbot_id,
+            ChatbotDocument.is_processed == True
+        )
+        if copied:
+            query = query.filter(ChatbotDocument.id.notin_(copied))
+
+        for document in query.order_by(ChatbotDocument.id.asc()).all():
+            await _copy_document(document, source, shadow, reembed)
+            copied.add(document.id)
+
+    await _verify_shadow(db, chatbot_id, shadow)
+
+    # Cambio atómico del puntero activo
+    chatbot.pinecone_index_name, chatbot.pinecone_namespace = shadow
+    chatbot.embedding_model = target_model
+    chatbot.embedding_dimension = target_dimension
+    chatbot.shadow_index_name = None
+    chatbot.shadow_namespace = None
+    db.commit()
+    logger.info(f"Chatbot {chatbot_id} ahora usa {shadow[0]}/{shadow[1]}")
+
+    await _garbage_collect(source, shadow)
+
+
+async def _prepare_shadow(db: Session, chatbot: CustomChatbot, target_dimension: int) -> None:
+    """Elige y crea el destino sombra, y lo registra para que la ingesta escriba también ahí"""
+    suffix = str(int(time.time()))
+    index_name = chatbot.pinecone_index_name
+
+    current_dimension = chatbot.embedding_dimension or await _index_dimension(index_name)
+    if current_dimension and current_dimension != target_dimension:
+        # La dimensión es fija por índice: hace falta uno nuevo
+        index_name = f"{chatbot.pinecone_index_name.split('--')[0]}--{suffix}"
+        if not await pinecone_service.create_index(index_name, dimension=target_dimension):
+            raise IngestionError(f"No se pudo crear el índice {index_name}")
+
+    chatbot.shadow_index_name = index_name
+    chatbot.shadow_namespace = f"chatbot_{chatbot.id}_{suffix}"
+    db.commit()
+
+
+async def _index_dimension(index_name: str) -> int:
+    stats = await pinecone_service.get_index_stats(index_name)
+    return stats.get("dimension") or 0
+
+
+async def _needs_reembedding(chatbot: CustomChatbot, target_model: str, target_dimension: int) -> bool:
+    """
+    Los vectores solo se reutilizan si se generaron con el mismo modelo y
+    dimensión. Los chatbots anteriores al registro del modelo usaban el modelo
+    por defecto, así que basta con que coincida la dimensión del índice.
+    """
+    if chatbot.embedding_model and chatbot.embedding_model != target_model:
+        return True
+    dimension = chatbot.embedding_dimension or await _index_dimension(chatbot.pinecone_index_name)
+    return bool(dimension) and dimension != target_dimension
+
+
+async def _copy_document(
+    document: ChatbotDocument,
+    source: Tuple[str, str],
+    shadow: Tuple[str, str],
+    reembed: bool
+) -> None:
+    """Copia los vectores de un documento al destino sombra, re-embebiendo si corresponde"""
+    vector_ids = document_vector_ids(document)
+    batch_size = embedding_service.batch_size
+
+    for i in range(0, len(vector_ids), batch_size):
+        batch_ids = vector_ids[i:i + batch_size]
+        stored = await pinecone_service.fetch_vectors(source[0], batch_ids, namespace=source[1])
+        missing = [vector_id for vector_id in batch_ids if vector_id not in stored]
+        if missing:
+            raise IngestionError(
+                f"Faltan {len(missing)} vectores de {document.original_filename} en el destino activo"
+            )
+
+        if reembed:
+            embeddings = await embedding_service.generate_embeddings(
+                [stored[vector_id]["metadata"].get("text", "") for vector_id in batch_ids]
+            )
+            if len(embeddings) != len(batch_ids):
+                raise IngestionError("Error generando embeddings")
+        else:
+            embeddings = [stored[vector_id]["values"] for vector_id in batch_ids]
+
+        vectors = [
+            {"id": vector_id, "values": values, "metadata": stored[vector_id]["metadata"]}
+            for vector_id, values in zip(batch_ids, embeddings)
+        ]
+        if not await pinecone_service.upsert_vectors(shadow[0], vectors, namespace=shadow[1]):
+            raise IngestionError("Error subiendo vectores al destino sombra")
+
+
+async def _verify_shadow(db: Session, chatbot_id: int, shadow: Tuple[str, str]) -> None:
+    """
+    Verifica que el destino sombra tenga todos los chunks de los documentos
+    procesados. Las estadísticas de Pinecone tardan en reflejar los upserts,
+    por lo que se reintenta unos segundos antes de fallar.
+    """
+    attempts = int(os.getenv("REINDEX_VERIFY_ATTEMPTS", "10"))
+    interval = float(os.getenv("REINDEX_VERIFY_INTERVAL_SECONDS", "3"))
+
+    for attempt in range(attempts):
+        db.expire_all()
+        expected = sum(
+            document.chunks_count or 0
+            for document in db.query(ChatbotDocument).filter(
+                ChatbotDocument.chatbot_id == chatbot_id,
+                ChatbotDocument.is_processed == True
+            ).all()
+        )
+        actual = await pinecone_service.get_namespace_vector_count(shadow[0], shadow[1])
+        if actual == expected:
+            logger.info(f"Destino sombra verificado: {actual} vectores")
+            return
+        if attempt < attempts - 1:
+            await asyncio.sleep(interval)
+
+    raise IngestionError(f"El destino sombra tiene {actual} vectores, se esperaban {expected}")
+
+
+async def _garbage_collect(old: Tuple[str, str], new: Tuple[str, str]) -> None:
+    """Elimina el destino anterior (el índice completo si ya no se usa)"""
+    if old[0] != new[0]:
+        success = await pinecone_service.delete_index(old[0])
+    else:
+        success = await pinecone_service.delete_namespace(old[0], old[1])
+
+    if not success:
+        # No es crítico: el chatbot ya usa el destino nuevo
+        logger.warning(f"No se pudo eliminar el destino anterior {old[0]}/{old[1]}")
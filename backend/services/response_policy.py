@@ -0,0 +1,132 @@
+import os
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from models import ChatbotSettings
+from .metrics import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Acciones de la política
+LLM = "llm"            # Generar la respuesta con el LLM
+TEMPLATE = "template"  # Responder con una plantilla, sin LLM
+WIDEN = "widen"        # Repetir la búsqueda con más resultados y un umbral menor
+ACTIONS = (LLM, TEMPLATE, WIDEN)
+
+# Parámetros de búsqueda de los chatbots sin valores propios
+DEFAULT_TOP_K = int(os.getenv("TOP_K_RESULTS", "5"))
+# Score mínimo para usar un chunk como contexto (alto para evitar falsos positivos)
+DEFAULT_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.70"))
+
+GREETINGS = ["hola", "hello", "hi", "buenos días", "buenas tardes", "buenas noches", "hey", "saludos"]
+THANKS = ["gracias", "thank you", "thanks", "muchas gracias"]
+
+DEFAULT_NO_CONTEXT_TEMPLATE = (
+    "Lo siento, no encontré información sobre eso en los documentos. "
+    "Solo puedo responder preguntas sobre el contenido de los archivos que tengo cargados."
+)
+
+
+@dataclass
+class PolicyDecision:
+    """Resultado de la política: qué hacer con la pregunta y por qué"""
+    action: str
+    reason: str
+    reply: Optional[str] = None
+    context_chunks: List[dict] = field(default_factory=list)
+    max_score: float = 0.0
+
+
+class ResponsePolicy:
+    """
+    Decide, a partir de la intención y del resultado de la búsqueda, si vale
+    la pena llamar al LLM, responder con una plantilla o ampliar la búsqueda
+
+    Reglas (configurables por chatbot en ChatbotSettings):
+    - Saludos y agradecimientos cortos: respuesta directa.
+    - Algún chunk pasa el umbral: LLM con ese contexto.
+    - El mejor score queda cerca del umbral (>= widen_min_score): low_score_action.
+    - Sin resultados útiles: no_hits_action.
+    - Tras ampliar la búsqueda sin éxito: plantilla.
+    """
+
+    def settings_for(self, db: Session, chatbot_id: Optional[int]) -> ChatbotSettings:
+        """Configuración del chatbot, o los valores por defecto si no tiene"""
+        if chatbot_id is None:
+            return ChatbotSettings.with_defaults()
+        settings = db.query(ChatbotSettings).filter(ChatbotSettings.chatbot_id == chatbot_id).first()
+        return settings or ChatbotSettings.with_defaults(chatbot_id)
+
+    def retrieval_params(self, settings: ChatbotSettings) -> Tuple[int, float]:
+        """top_k y umbral de score del chatbot (calibrados o fijados a mano)"""
+        top_k = settings.top_k or DEFAULT_TOP_K
+        min_score = settings.min_score if settings.min_score is not None else DEFAULT_MIN_SCORE
+        return top_k, min_score
+
+    def intent(self, user_text: str, settings: ChatbotSettings) -> Optional[str]:
+        """'greeting' o 'thanks' si el mensaje es solo eso; None en otro caso"""
+        if not settings.quick_replies_enabled:
+            return None
+
+        text = user_text.lower()
+        if any(greeting in text for greeting in GREETINGS) and len(user_text.split()) <= 3:
+            return "greeting"
+        if any(thank in text for thank in THANKS) and len(user_text.split()) <= 5:
+            return "thanks"
+        return None
+
+    def decide(
+        self,
+        settings: ChatbotSettings,
+        search_results: List[dict],
+        min_score: float,
+        widened: bool = False
+    ) -> PolicyDecision:
+        """
+        Decide según los resultados de la búsqueda
+
+        Args:
+            settings: Configuración del chatbot
+            search_results: Resultados de Pinecone (con score)
+            min_score: Umbral para usar un chunk como contexto
+            widened: Si los resultados vienen de una búsqueda ampliada
+        """
+        # Un umbral calibrado puede quedar bajo widen_min_score: ampliar nunca lo sube
+        threshold = min(settings.widen_min_score, min_score) if widened else min_score
+        context_chunks = [result for result in search_results if result.get("score", 0) >= threshold]
+        max_score = max((result.get("score", 0) for result in search_results), default=0.0)
+
+        if context_chunks:
+            reason = "widened" if widened else "context"
+            return PolicyDecision(LLM, reason, context_chunks=context_chunks, max_score=max_score)
+
+        if widened:
+            action, reason = TEMPLATE, "widen_failed"
+        elif search_results and max_score >= settings.widen_min_score:
+            action, reason = settings.low_score_action, "low_score"
+        else:
+            action, reason = settings.no_hits_action, "no_hits"
+
+        if action not in ACTIONS:
+            logger.warning(f"Acción de política desconocida '{action}', se usa la plantilla")
+            action = TEMPLATE
+
+        reply = self.no_context_reply(settings) if action == TEMPLATE else None
+        return PolicyDecision(action, reason, reply=reply, max_score=max_score)
+
+    def no_context_reply(self, settings: ChatbotSettings) -> str:
+        return settings.no_context_template or DEFAULT_NO_CONTEXT_TEMPLATE
+
+    def record(self, action: str, reason: str) -> None:
+        """Cuenta la decisión en las métricas"""
+        metrics.increment("chat_policy_decisions_total", action=action, reason=reason)
+
+
+# Instancia global
+response_policy = ResponsePolicy()
@@ -0,0 +1,256 @@
+import os
+import re
+import math
+import json
+import random
+import asyncio
+import logging
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from models import ChatbotDocument, ChatbotSettings, CustomChatbot
+from .pinecone_service import pinecone_service
+from .embedding_service_pinecone import embedding_service
+from .rate_limiter import BULK
+from .reindex import document_vector_ids
+from .response_policy import DEFAULT_MIN_SCORE, DEFAULT_TOP_K
+from .ingestion import PermanentIngestionError
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Largo máximo (caracteres) de la pregunta sintética que se arma con un chunk
+PROBE_MAX_CHARS = 200
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Percentil por interpolación lineal (values no vacío)"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+@dataclass
+class CalibrationResult:
+    """Distribución de scores observada y parámetros que se derivaron de ella"""
+    chatbot_id: int
+    samples: int
+    found: int
+    applied: bool
+    top_k: Optional[int] = None
+    min_score: Optional[float] = None
+    self_score_p10: Optional[float] = None
+    self_score_p50: Optional[float] = None
+    noise_score_p50: Optional[float] = None
+    self_rank_p90: Optional[float] = None
+    noise_score_p90: Optional[float] = None
+    passing_p50: Optional[float] = None
+    allow_stricter: bool = False
+    reason: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+class RetrievalCalibrator:
+    """
+    Calibra offline el top_k y el umbral de score de cada chatbot
+
+    Toma una muestra de chunks del namespace activo y usa el comienzo de cada
+    uno como pregunta sintética (embebida como 'query'). Para cada pregunta se
+    anota el score y la posición del chunk de origen, y el score del último
+    resultado (posición probe_k) como referencia de un chunk no relacionado.
+
+    La pregunta sintética es casi el texto del chunk, así que el score y la
+    posición del chunk de origen son optimistas frente a preguntas reales
+    (parafraseadas): solo sirven para comprobar que el índice responde, no
+    para fijar parámetros.
+
+    - min_score: percentil 90 del ruido (el score que un chunk no relacionado
+      rara vez alcanza). Sin referencia de ruido (corpus más chico que
+      probe_k) se mantiene el valor por defecto.
+    - top_k: la mediana de resultados que pasan el umbral.
+
+    Salvo con allow_stricter, la calibración solo puede ampliar la búsqueda:
+    min_score nunca queda sobre RAG_MIN_SCORE ni top_k bajo TOP_K_RESULTS.
+    Un umbral más alto o un k más chico dejan preguntas parafraseadas sin
+    contexto, y la política responde "no encontré información".
+    """
+
+    def __init__(
+        self,
+        sample_size: int = 40,
+        probe_k: int = 20,
+        min_found: int = 5,
+        min_top_k: int = 2,
+        max_top_k: int = 10,
+        score_floor: float = 0.5,
+        score_ceiling: float = 0.9,
+        concurrency: int = 4
+    ):
+        self.sample_size = sample_size
+        self.probe_k = probe_k
+        self.min_found = min_found
+        self.min_top_k = min_top_k
+        self.max_top_k = max_top_k
+        self.score_floor = score_floor
+        self.score_ceiling = score_ceiling
+        self.concurrency = concurrency
+
+    async def calibrate(
+        self,
+        db: Session,
+        chatbot_id: int,
+        apply: bool = True,
+        allow_stricter: bool = False
+    ) -> CalibrationResult:
+        """
+        Mide la distribución de scores del chatbot y guarda top_k/min_score
+
+        Args:
+            db: Sesión de base de datos
+            chatbot_id: Chatbot a calibrar
+            apply: Si es False solo se mide, sin guardar (simulación)
+            allow_stricter: Permite subir min_score sobre RAG_MIN_SCORE y
+                bajar top_k de TOP_K_RESULTS
+
+        Raises:
+            PermanentIngestionError: Si el chatbot no existe
+        """
+        chatbot = db.query(CustomChatbot).filter(CustomChatbot.id == chatbot_id).first()
+        if not chatbot:
+            raise PermanentIngestionError(f"Chatbot {chatbot_id} no encontrado")
+
+        documents = db.query(ChatbotDocument).filter(
+            ChatbotDocument.chatbot_id == chatbot_id,
+            ChatbotDocument.is_processed == True
+        ).all()
+        vector_ids = [vector_id for document in documents for vector_id in document_vector_ids(document)]
+
+        # Muestra reproducible por chatbot
+        sample_ids = random.Random(chatbot_id).sample(vector_ids, min(self.sample_size, len(vector_ids)))
+        stored = await pinecone_service.fetch_vectors(
+            chatbot.pinecone_index_name, sample_ids, namespace=chatbot.active_namespace
+        )
+        probes = {
+            vector_id: self._probe_text(vector["metadata"].get("text", ""))
+            for vector_id, vector in stored.items()
+        }
+        probes = {vector_id: text for vector_id, text in probes.items() if text}
+
+        if not probes:
+            result = CalibrationResult(chatbot_id, samples=0, found=0, applied=False, reason="sin chunks")
+            logger.info(f"Calibración del chatbot {chatbot_id} omitida: sin chunks para muestrear")
+            return result
+
+        embeddings = await embedding_service.generate_embeddings(list(probes.values()), BULK, input_type="query")
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def probe(vector_id: str, embedding: List[float]):
+            async with semaphore:
+                results = await pinecone_service.query_vectors(
+                    index_name=chatbot.pinecone_index_name,
+                    query_vector=embedding,
+                    top_k=self.probe_k,
+                    namespace=chatbot.active_namespace
+                )
+            return vector_id, results
+
+        observations = await asyncio.gather(*(
+            probe(vector_id, embedding) for vector_id, embedding in zip(probes, embeddings)
+        ))
+
+        result = self._derive(chatbot_id, observations, allow_stricter)
+        if result.applied:
+            if apply:
+                self._save(db, chatbot_id, result)
+            else:
+                result.applied = False
+                result.reason = "simulación"
+        logger.info(
+            f"Calibración del chatbot {chatbot_id}: top_k={result.top_k}, min_score={result.min_score} "
+            f"({result.found}/{result.samples} chunks encontrados{'' if result.applied else ', sin aplicar'})"
+        )
+        return result
+
+    def _probe_text(self, text: str) -> str:
+        """Primera oración del chunk (acotada), como pregunta sintética"""
+        text = " ".join(text.split())
+        sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+        return sentence[:PROBE_MAX_CHARS].strip()
+
+    def _derive(self, chatbot_id: int, observations, allow_stricter: bool = False) -> CalibrationResult:
+        self_scores, self_ranks, noise_scores = [], [], []
+        scores_by_probe = []
+        for vector_id, results in observations:
+            scores = [result.get("score", 0) for result in results]
+            scores_by_probe.append(scores)
+            if len(scores) >= self.probe_k:
+                noise_scores.append(scores[-1])
+            for rank, result in enumerate(results, start=1):
+                if result.get("id") == vector_id:
+                    self_scores.append(result.get("score", 0))
+                    self_ranks.append(rank)
+                    break
+
+        result = CalibrationResult(
+            chatbot_id, samples=len(observations), found=len(self_scores), applied=False,
+            allow_stricter=allow_stricter
+        )
+        if len(self_scores) < self.min_found:
+            result.reason = "muestra insuficiente"
+            return result
+
+        # Solo informativos (ver docstring de la clase)
+        result.self_score_p10 = round(percentile(self_scores, 0.1), 4)
+        result.self_score_p50 = round(percentile(self_scores, 0.5), 4)
+        result.self_rank_p90 = round(percentile(self_ranks, 0.9), 2)
+
+        min_score = None
+        if len(noise_scores) >= self.min_found:
+            result.noise_score_p50 = round(percentile(noise_scores, 0.5), 4)
+            result.noise_score_p90 = round(percentile(noise_scores, 0.9), 4)
+            min_score = min(max(result.noise_score_p90, self.score_floor), self.score_ceiling)
+            if not allow_stricter:
+                min_score = min(min_score, DEFAULT_MIN_SCORE)
+        else:
+            result.reason = "sin referencia de ruido: se mantiene el umbral por defecto"
+
+        threshold = min_score if min_score is not None else DEFAULT_MIN_SCORE
+        passing = [sum(1 for score in scores if score >= threshold) for scores in scores_by_probe]
+        result.passing_p50 = round(percentile(passing, 0.5), 2)
+        top_k = min(max(math.ceil(result.passing_p50), self.min_top_k), self.max_top_k)
+        if not allow_stricter:
+            top_k = max(top_k, DEFAULT_TOP_K)
+
+        result.min_score = round(min_score, 3) if min_score is not None else None
+        result.top_k = top_k
+        result.applied = True
+        return result
+
+    def _save(self, db: Session, chatbot_id: int, result: CalibrationResult) -> None:
+        settings = db.query(ChatbotSettings).filter(ChatbotSettings.chatbot_id == chatbot_id).first()
+        if settings is None:
+            settings = ChatbotSettings.with_defaults(chatbot_id)
+            db.add(settings)
+
+        settings.top_k = result.top_k
+        settings.min_score = result.min_score
+        settings.calibrated_at = datetime.now(timezone.utc)
+        settings.calibration_stats = json.dumps(result.to_dict())
+        db.commit()
+
+
+# Instancia global
+retrieval_calibrator = RetrievalCalibrator(
+    sample_size=int(os.getenv("RETRIEVAL_CALIBRATION_SAMPLES", "40")),
+    probe_k=int(os.getenv("RETRIEVAL_CALIBRATION_PROBE_K", "20")),
+    max_top_k=int(os.getenv("RETRIEVAL_CALIBRATION_MAX_TOP_K", "10"))
+)
@@ -0,0 +1,187 @@
+import os
+import re
+import time
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .metrics import metrics
+
+load_dotenv()
+
+
+def draft_words(text: str) -> List[str]:
+    """Palabras comparables del texto: en minúsculas y sin signos de puntuación"""
+    return re.findall(r"\w+", text.lower())
+
+
+@dataclass
+class PrefetchResult:
+    """Embedding de la pregunta y resultados de Pinecone (sin filtrar por score)"""
+    embedding: List[float]
+    results: List[dict]
+
+
+@dataclass
+class PrefetchedRetrieval:
+    """Búsqueda adelantada de un borrador, en curso o terminada"""
+    text: str
+    task: asyncio.Task
+    top_k: int
+    namespace: Optional[str]
+    fingerprint: str
+    created_at: float = field(default_factory=time.monotonic)
+
+    async def wait(self) -> Optional[PrefetchResult]:
+        """Resultado de la búsqueda (None si falló o no hay embedding)"""
+        try:
+            result = await self.task
+        except asyncio.CancelledError:
+            if self.task.cancelled():
+                return None
+            raise
+        except Exception:
+            return None
+        return result if result and result.embedding else None
+
+    def same_text(self, text: str) -> bool:
+        """Si el texto es el mismo del borrador (salvo mayúsculas, espacios y signos)"""
+        return draft_words(self.text) == draft_words(text)
+
+    def covers(self, top_k: int, namespace: Optional[str], fingerprint: str) -> bool:
+        """Si la búsqueda sirve para la configuración y los documentos actuales"""
+        return self.top_k >= top_k and self.namespace == namespace and self.fingerprint == fingerprint
+
+
+class RetrievalPrefetch:
+    """
+    Búsquedas adelantadas mientras el usuario escribe
+
+    El frontend envía el borrador tras una pausa al escribir y el servidor
+    calcula en segundo plano el embedding y el top-k de Pinecone. Al enviar el
+    mensaje se reutiliza esa búsqueda (o se espera la que está en curso) en
+    lugar de hacer una nueva si el texto final es el mismo borrador (salvo
+    mayúsculas, espacios y signos) o lo completa con hasta max_extra_words
+    palabras sin dígitos. Cualquier otra diferencia, como "prueba 1" contra
+    "prueba 2", es otra pregunta y se busca de nuevo. Se guarda un borrador por
+    usuario y chatbot: uno nuevo reemplaza al anterior y cancela su búsqueda
+    si no terminó. Cada borrador se usa una sola vez y vence por TTL.
+
+    Los borradores viven en memoria del proceso: con varios workers solo se
+    aprovechan si el envío llega al mismo proceso que el borrador.
+    """
+
+    def __init__(
+        self,
+        max_extra_words: int = 2,
+        ttl_seconds: float = 60,
+        max_entries: int = 1000,
+        enabled: bool = True
+    ):
+        self.max_extra_words = max_extra_words
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries: "OrderedDict[Tuple[int, int], PrefetchedRetrieval]" = OrderedDict()
+
+    def matches(self, draft: str, text: str) -> bool:
+        """Si text es el borrador, o el borrador completado con pocas palabras sin dígitos"""
+        draft, text = draft_words(draft), draft_words(text)
+        if not draft or text[:len(draft)] != draft:
+            return False
+        extra = text[len(draft):]
+        return len(extra) <= self.max_extra_words and not any(
+            any(char.isdigit() for char in word) for word in extra
+        )
+
+    def _expired(self, entry: PrefetchedRetrieval) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def start(
+        self,
+        user_id: int,
+        chatbot_id: int,
+        text: str,
+        top_k: int,
+        namespace: Optional[str],
+        fingerprint: str,
+        fetch: Callable[[], Awaitable[PrefetchResult]]
+    ) -> bool:
+        """
+        Lanza la búsqueda del borrador en segundo plano (sin esperarla)
+
+        Returns:
+            False si ya había una búsqueda vigente para el mismo texto
+        """
+        key = (user_id, chatbot_id)
+        current = self._entries.get(key)
+        if (current and not self._expired(current) and current.covers(top_k, namespace, fingerprint)
+                and current.same_text(text)):
+            metrics.increment("retrieval_prefetch_requests_total", outcome="reused")
+            return False
+
+        if current and not current.task.done():
+            current.task.cancel()
+        self._entries[key] = PrefetchedRetrieval(
+            text=text,
+            task=asyncio.create_task(fetch()),
+            top_k=top_k,
+            namespace=namespace,
+            fingerprint=fingerprint
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            _, oldest = self._entries.popitem(last=False)
+            oldest.task.cancel()
+        metrics.increment("retrieval_prefetch_requests_total", outcome="started")
+        return True
+
+    def take(self, user_id: int, chatbot_id: int, text: str) -> Optional[PrefetchedRetrieval]:
+        """
+        Búsqueda adelantada para el mensaje enviado, si el texto coincide con
+        el borrador (la entrada se consume)
+        """
+        if not self.enabled:
+            return None
+
+        entry = self._entries.pop((user_id, chatbot_id), None)
+        if entry is None:
+            outcome = "miss"
+        elif self._expired(entry):
+            outcome = "expired"
+        elif not self.matches(entry.text, text):
+            outcome = "changed"
+        else:
+            metrics.increment("retrieval_prefetch_lookups_total", outcome="hit")
+            return entry
+
+        if entry is not None and not entry.task.done():
+            entry.task.cancel()
+        metrics.increment("retrieval_prefetch_lookups_total", outcome=outcome)
+        return None
+
+    def stats(self) -> Dict[str, float]:
+        """Borradores en memoria y tasa de aprovechamiento"""
+        snapshot = metrics.snapshot()["counters"]
+        lookups = {
+            key.split("outcome=")[-1].rstrip("}"): value
+            for key, value in snapshot.items() if key.startswith("retrieval_prefetch_lookups_total")
+        }
+        total = sum(lookups.values())
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "lookups": lookups,
+            "hit_rate": round(lookups.get("hit", 0) / total, 3) if total else 0.0
+        }
+
+
+# Instancia global
+retrieval_prefetch = RetrievalPrefetch(
+    max_extra_words=int(os.getenv("RETRIEVAL_PREFETCH_MAX_EXTRA_WORDS", "2")),
+    ttl_seconds=float(os.getenv("RETRIEVAL_PREFETCH_TTL_SECONDS", "60")),
+    enabled=os.getenv("RETRIEVAL_PREFETCH_ENABLED", "true").lower() == "true"
+)
@@ -0,0 +1,77 @@
+"""
+Worker de ingesta de documentos
+Consume la cola persistente (tabla ingestion_jobs) en uno o varios procesos
+
+Uso:
+    python worker.py --processes 4
+"""
+
+import sys
+import os
+import signal
+import socket
+import asyncio
+import argparse
+import logging
+import multiprocessing
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def run_process(index: int):
+    """Punto de entrada de cada proceso worker"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # Importar dentro del proceso para que cada uno tenga su propio pool de conexiones
+    from database import Base, engine
+    from services.ingestion import run_worker_loop
+
+    Base.metadata.create_all(bind=engine)
+
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+    async def main():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass  # Windows
+        await run_worker_loop(worker_id, stop_event)
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker de ingesta de documentos")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=int(os.getenv("INGESTION_WORKER_PROCESSES", "1")),
+        help="Número de procesos worker"
+    )
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_process(0)
+        sys.exit(0)
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=run_process, args=(i,), name=f"ingestion-worker-{i}") for i in range(args.processes)]
+    for process in processes:
+        process.start()
+
+    print(f"🚀 {len(processes)} procesos worker de ingesta iniciados")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
@@ -2,7 +2,7 @@ import React, { useState, useEffect, useRef, useMemo } from 'react';
 import './chat-interface.css';
 import ChatSidebar from '../chat-sidebar/chat-sidebar';
 import ChatNoConversation from '../chat-no-conversation/chat-no-conversation';
-import { listConversations, sendMessage, createConversation, listUserChatbots, deleteConversation } from '../../../lib/api';
+import { listConversations, sendMessage, createConversation, listUserChatbots, deleteConversation, prefetchDraft } from '../../../lib/api';
 import type { ChatbotInfo, ChatResponseDTO } from '../../../lib/api';
 
 interface ChatMessage {
@@ -67,6 +67,16 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ userEmail: _userEmail })
     }
   }, [availableChatbots, activeConversationId, conversations]);
 
+  // Tras una pausa al escribir, adelantar la búsqueda del borrador en el backend
+  useEffect(() => {
+    const draft = inputValue.trim();
+    if (!activeConversationId || sending || draft.length < 8) return;
+    const timer = setTimeout(() => {
+      prefetchDraft(Number(activeConversationId), draft).catch(() => {});
+    }, 600);
+    return () => clearTimeout(timer);
+  }, [inputValue, activeConversationId, sending]);
+
   // Cargar conversaciones desde el backend
   const loadConversations = async () => {
     try {
@@ -185,6 +185,14 @@ export async function sendMessage(conversationId: number, text: string, chatbotI
   });
 }
 
+// Adelanta la búsqueda RAG del borrador; el envío la reutiliza si el texto no cambia
+export async function prefetchDraft(conversationId: number, text: string) {
+  return api('/api/chat/prefetch', {
+    method: 'POST',
+    body: { text, conversation_id: conversationId }
+  });
+}
+
 // ===== CHATBOTS API =====
 export async function createChatbot(data: { title: string; description?: string }) {
   return api('/api/chatbots/', { method: 'POST', body: data });